@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import time
+import base64
+import asyncio
+
+import numpy as np
+
+import g711
+from g711 import AUDIO_FORMAT
+from resample import SAMPLE_RATE, Resampler
+
+# 把麥克風的 20ms 音訊塊合併成較大的封包再用 input_audio_buffer.append 送出，
+# 減少每秒的訊息數量（每則訊息都要各自 base64 編碼、序列化成 JSON 再送出）。
+# packet_ms 是平常的封包長度，adaptive 為 True 時如果量到的傳送時間變長
+# 就加大封包（最多到 max_packet_ms），恢復正常後再縮回 packet_ms；如果
+# websocket 卡住，排隊中的音訊超過上限時會丟掉最舊的部分，避免延遲無限制地累積。
+# feed() 收到的是麥克風的 24kHz pcm16，audio_format 不是 pcm16 時會先轉換
+# 成 session 的 input_audio_format（例如 8kHz 的 g711_ulaw）再排隊
+class AudioSender:
+    def __init__(self, packet_ms: float = 60, adaptive: bool = True,
+                 max_packet_ms: float = 500, max_queued_ms: float = 2000,
+                 audio_format: str = AUDIO_FORMAT):
+        self.audio_format = audio_format
+        self.rate, self.sample_width = g711.FORMATS[audio_format]
+        self.resampler = Resampler(SAMPLE_RATE, self.rate)
+        self.base_packet_ms = packet_ms
+        self.packet_ms = packet_ms
+        self.adaptive = adaptive
+        self.max_packet_ms = max_packet_ms
+        self.max_queued_bytes = self.ms_to_bytes(max_queued_ms)
+        self.pending = bytearray()
+        self.ready = asyncio.Event()
+        self.lock = asyncio.Lock()  # 確保 run() 與 flush() 依序送出
+        self.send_ms = 0.0          # 傳送時間的移動平均
+
+        self.frames_in = 0     # 收到的音訊塊數
+        self.packets_sent = 0  # 送出的 append 訊息數
+        self.bytes_sent = 0    # 送出的 base64 音訊資料量
+        self.blocked_s = 0.0   # 等待傳送完成的總時間
+        self.dropped_bytes = 0 # 排隊太多而丟棄的音訊資料量
+
+    def ms_to_bytes(self, ms: float) -> int:
+        # 單聲道，pcm16 每個樣本 2 個位元組，G.711 是 1 個
+        return int(self.rate * ms / 1000) * self.sample_width
+
+    def packet_bytes(self) -> int:
+        return self.ms_to_bytes(self.packet_ms)
+
+    def queued_ms(self) -> float:
+        return len(self.pending) / self.sample_width / self.rate * 1000
+
+    def feed(self, data: bytes) -> None:
+        self.frames_in += 1
+        if self.audio_format != "pcm16":
+            pcm = self.resampler.process(np.frombuffer(data, dtype=np.int16))
+            data = g711.encode(pcm, self.audio_format).tobytes()
+        self.pending += data
+        overflow = len(self.pending) - self.max_queued_bytes
+        if overflow > 0:
+            # 保留最新的音訊，丟掉最舊的部分（保持樣本對齊）
+            overflow += -overflow % self.sample_width
+            del self.pending[:overflow]
+            self.dropped_bytes += overflow
+        if len(self.pending) >= self.packet_bytes():
+            self.ready.set()
+
+    async def run(self, connection) -> None:
+        from websockets.exceptions import ConnectionClosed
+
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while len(self.pending) >= self.packet_bytes():
+                    async with self.lock:
+                        await self._send(connection, self.packet_bytes())
+        except ConnectionClosed:
+            # 連線中斷，沒送出去的音訊還留在 pending，可以在新的連線上再啟動 run()
+            return
+
+    async def flush(self, connection) -> None:
+        # 把剩下不足一個封包的音訊也送出，例如在手動 commit 之前
+        async with self.lock:
+            if self.pending:
+                await self._send(connection, len(self.pending))
+
+    async def end_turn(self, connection) -> None:
+        # 停止錄音時呼叫：剩下不足一個封包的音訊屬於這一段話，現在就送出；
+        # 沒有連線或送不出去就丟掉，不要留到下次錄音時接在新的一段話前面
+        from websockets.exceptions import ConnectionClosed
+
+        if connection is not None:
+            try:
+                await self.flush(connection)
+            except ConnectionClosed:
+                pass
+        self.dropped_bytes += len(self.pending)
+        self.pending.clear()
+
+    async def _send(self, connection, size: int) -> None:
+        chunk = bytes(self.pending[:size])
+        del self.pending[:size]
+        if not chunk:
+            return
+        audio = base64.b64encode(chunk).decode("utf-8")
+        start = time.perf_counter()
+        try:
+            await connection.input_audio_buffer.append(audio=audio)
+        except BaseException:
+            # 沒有送出去就放回最前面
+            self.pending[:0] = chunk
+            raise
+        elapsed = time.perf_counter() - start
+        self.packets_sent += 1
+        self.bytes_sent += len(audio)
+        self.blocked_s += elapsed
+        self.send_ms = 0.8 * self.send_ms + 0.2 * elapsed * 1000
+        if self.adaptive:
+            self._adapt()
+
+    def _adapt(self) -> None:
+        # 傳送時間佔封包長度的比例太高就加大封包，恢復後再逐步縮回原本的大小
+        if self.send_ms > self.packet_ms * 0.1:
+            self.packet_ms = min(self.max_packet_ms, self.packet_ms * 2)
+        elif self.send_ms < self.packet_ms * 0.02:
+            self.packet_ms = max(self.base_packet_ms, self.packet_ms / 2)
+
+    def stats(self) -> str:
+        return (f"sender: {self.frames_in} frames in, {self.packets_sent} packets, "
+                f"{self.bytes_sent} bytes, {self.blocked_s * 1000:.0f}ms blocked, "
+                f"{self.dropped_bytes} bytes dropped, packet {self.packet_ms:.0f}ms")
@@ -1,94 +1,609 @@
 from __future__ import annotations
 
 import io
+import os
 import base64
+import shutil
+import tempfile
+import subprocess
+import time as _time
 import asyncio
-import threading
+from collections import deque
 from typing import Callable, Awaitable
 
 import numpy as np
-import pyaudio
-import sounddevice as sd
 from pydub import AudioSegment
 
-CHUNK_LENGTH_S = 0.05  # 100ms
-SAMPLE_RATE = 24000
-FORMAT = pyaudio.paInt16
-CHANNELS = 1
+import g711
+from g711 import AUDIO_FORMAT
+from decode_cache import decode_cache, bytes_digest, file_digest
+from b64_decode import Base64Decoder
+from resample import SAMPLE_RATE, CHANNELS, Resampler
+
+# pyaudio 與 sounddevice 要到開啟音效裝置時才載入，只用到解碼等功能的程式
+# 在沒有 PortAudio 的機器上也可以匯入這個模組
+CHUNK_LENGTH_S = 0.05  # 50ms
+
+def __getattr__(name: str):
+    # FORMAT 是原本範例中 pyaudio 的樣本格式，用到時才載入 pyaudio
+    if name == "FORMAT":
+        import pyaudio
+        return pyaudio.paInt16
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# 播放端的預設值，可以用環境變數依照部署環境在延遲與斷音之間取捨：
+#   PLAYER_BLOCK_MS    每次 callback 處理的毫秒數
+#   PLAYER_PREFILL_MS  開始播放前先累積的毫秒數，未設定就依照網路狀況自動調整
+PLAYER_BLOCK_S = float(os.environ.get("PLAYER_BLOCK_MS", CHUNK_LENGTH_S * 1000)) / 1000
+PLAYER_PREFILL_MS = (float(os.environ["PLAYER_PREFILL_MS"])
+                     if "PLAYER_PREFILL_MS" in os.environ else None)
+# 音效裝置的取樣率，預設直接以 24kHz 開啟裝置，由驅動程式轉換，不必在 Python 中
+# 轉換取樣率；設為 native 則以裝置原生的取樣率開啟，再由 Resampler 與 24kHz
+# 互相轉換（避開品質不好的驅動程式轉換，但要多花 CPU），設為其他數字就以該取樣率開啟
+AUDIO_DEVICE_RATE = os.environ.get("AUDIO_DEVICE_RATE", str(SAMPLE_RATE))
+
+# 解碼快取中轉換後資料的格式，改變取樣率或聲道數就不會用到舊的快取
+CACHE_TARGET = f"pcm16-{SAMPLE_RATE}-{CHANNELS}ch"
 
 def audio_to_pcm16_base64(audio_bytes: bytes) -> bytes:
+    # 啟用解碼快取時，同樣內容的音訊解碼過一次就存在快取中，之後直接以 mmap 讀回；
+    # 沒有啟用就不必計算雜湊值
+    key = None
+    if decode_cache.enabled:
+        key = decode_cache.key(bytes_digest(audio_bytes), CACHE_TARGET)
+        cached = decode_cache.get(key)
+        if cached is not None:
+            try:
+                return base64.b64encode(cached).decode('ascii')
+            finally:
+                if hasattr(cached, "close"):
+                    cached.close()
     # load the audio file from the byte stream
     audio = AudioSegment.from_file(io.BytesIO(audio_bytes))
     print(f"Loaded audio: {audio.frame_rate=} {audio.channels=} {audio.sample_width=} {audio.frame_width=}")
     # resample to 24kHz mono pcm16
     pcm_audio = audio.set_frame_rate(SAMPLE_RATE).set_channels(CHANNELS).set_sample_width(2).raw_data
+    if key is not None:
+        decode_cache.put(key, pcm_audio)
     # return pcm_audio
     encoded = base64.b64encode(pcm_audio).decode('ascii')
     return encoded
 
+def iter_pcm16_chunks(path: str, chunk_s: float = 0.5):
+    """以串流方式解碼音訊檔，每次產生 chunk_s 秒的 24kHz mono pcm16 資料
+
+    直接讓 ffmpeg 輸出轉換好的原始資料，不論檔案多長，記憶體用量
+    都只跟 chunk_s 有關。啟用解碼快取時，解碼的同時寫入快取，沒有修改過的
+    檔案第二次就直接從快取的 mmap 切塊，不必再啟動 ffmpeg
+    """
+    chunk_bytes = int(chunk_s * SAMPLE_RATE) * 2 * CHANNELS
+    key = decode_cache.key(file_digest(path), CACHE_TARGET) if decode_cache.enabled else None
+    cached = decode_cache.get(key) if key else None
+    if cached is not None:
+        try:
+            # mmap 切片是複製出來的 bytes，關閉 mmap 後仍然可以使用
+            for i in range(0, len(cached), chunk_bytes):
+                yield cached[i:i + chunk_bytes]
+        finally:
+            # 讀完或呼叫端提早停止（generator 被關閉）時釋放映射
+            if hasattr(cached, "close"):
+                cached.close()
+        return
+
+    from pydub.utils import get_encoder_name
+
+    encoder = get_encoder_name()
+    if shutil.which(encoder) is None:
+        raise FileNotFoundError(f"{encoder} not found on PATH, cannot decode {path}")
+    # ffmpeg 的錯誤訊息寫到暫存檔，解碼失敗時放進例外中
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [encoder, '-v', 'error', '-i', path,
+         '-f', 's16le', '-acodec', 'pcm_s16le',
+         '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-'],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+    )
+    writer = decode_cache.writer(key) if key else None
+    complete = False
+    try:
+        while True:
+            # 會等到讀滿 chunk_bytes 或是檔案結束
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            if writer is not None:
+                writer.write(data)
+            yield data
+        complete = True
+    finally:
+        process.stdout.close()
+        if not complete and process.poll() is None:
+            process.kill()
+        returncode = process.wait()
+        if writer is not None:
+            # 沒有讀完（例如呼叫端提早停止）或 ffmpeg 解碼失敗就不寫入快取
+            if complete and returncode == 0:
+                writer.commit()
+            else:
+                writer.discard()
+        stderr.seek(0)
+        message = stderr.read().decode(errors="replace").strip()
+        stderr.close()
+    # 解碼失敗時不能當成只是比較短的音訊，讓呼叫端知道不要送出 commit
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path} (exit code {returncode}): {message}")
+
 # utility functions
 # source: https://reurl.cc/1XaNzX
-def float_to_16bit_pcm(float32_array):
-    clipped = [max(-1.0, min(1.0, x)) for x in float32_array]
-    pcm16 = b''.join(struct.pack('<h', int(x * 32767)) for x in clipped)
-    return pcm16
-
-def base64_encode_audio(float32_array):
-    pcm_bytes = float_to_16bit_pcm(float32_array)
-    encoded = base64.b64encode(pcm_bytes).decode('ascii')
+# 原本的範例是逐一樣本處理，這裡改用 NumPy 一次轉換整個陣列
+_rng = np.random.default_rng()
+
+def float_to_16bit_pcm(float32_array, clip=True, dither=False, out=None):
+    """把 -1.0~1.0 的浮點數音訊轉成 pcm16，傳回 int16 陣列
+
+    clip 為 False 時呼叫端必須自行確保數值不會超出範圍；dither 為 True
+    時會加上 ±1 LSB 的三角分佈抖動；out 可傳入預先配置的 int16 陣列
+    重複使用，傳回的是 out 前段對應長度的 view
+    """
+    samples = np.asarray(float32_array, dtype=np.float32)
+    if out is None:
+        out = np.empty(len(samples), dtype=np.int16)
+    elif len(out) < len(samples):
+        raise ValueError(f"out is too small: {len(out)} < {len(samples)}")
+    else:
+        out = out[:len(samples)]
+    scaled = samples * np.float32(32767)
+    if dither:
+        scaled += _rng.random(len(samples), dtype=np.float32)
+        scaled -= _rng.random(len(samples), dtype=np.float32)
+    if clip:
+        np.clip(scaled, -32767, 32767, out=scaled)
+    # 跟原本的 int() 一樣直接捨去小數
+    np.copyto(out, scaled, casting='unsafe')
+    return out
+
+def _is_chunked(audio) -> bool:
+    # 單一陣列或數值串列以外的可迭代物件都當成分段的陣列
+    if isinstance(audio, np.ndarray):
+        return False
+    if isinstance(audio, (list, tuple)):
+        return len(audio) > 0 and not np.isscalar(audio[0])
+    return True
+
+def chunks_to_16bit_pcm(chunks, clip=True, dither=False, out=None):
+    """把分段的浮點數陣列依序轉換成一整段 pcm16 資料
+
+    有傳入 out 時會依序寫入 out，不夠放才改用串接的方式；一旦有一段
+    放不下，之後的每一段都接在後面，維持原本的順序
+    """
+    parts = []
+    pos = 0
+    for chunk in chunks:
+        n = len(chunk)
+        if out is not None and not parts and pos + n <= len(out):
+            float_to_16bit_pcm(chunk, clip, dither, out[pos:pos + n])
+            pos += n
+        else:
+            parts.append(float_to_16bit_pcm(chunk, clip, dither).tobytes())
+    if out is None:
+        return b''.join(parts)
+    if not parts:
+        # 全部都放進 out 了，直接傳回 view 不必再複製
+        return out[:pos]
+    return out[:pos].tobytes() + b''.join(parts)
+
+def base64_encode_audio(float32_array, clip=True, dither=False, out=None):
+    if _is_chunked(float32_array):
+        pcm = chunks_to_16bit_pcm(float32_array, clip, dither, out)
+    else:
+        pcm = float_to_16bit_pcm(float32_array, clip, dither, out)
+    encoded = base64.b64encode(pcm).decode('ascii')
     return encoded
 
+def device_rate(kind: str) -> int:
+    # kind 是 "input" 或 "output"，傳回要用來開啟預設裝置的取樣率
+    if AUDIO_DEVICE_RATE != "native":
+        return int(AUDIO_DEVICE_RATE)
+    import sounddevice as sd
+
+    return int(sd.query_devices(kind=kind)["default_samplerate"])
+
+# 固定容量的環狀緩衝區，播放端的 PortAudio 執行緒（消費者）與
+# asyncio 執行緒（生產者）各自只更新自己的索引，因此不需要加鎖，
+# 也不會在每次 callback 時配置新的陣列
+class RingBuffer:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        # 兩個索引都只會遞增，相減就是目前可讀取的樣本數
+        self._write = 0  # 只由生產者更新
+        self._read = 0   # 只由消費者更新
+        self.overruns = 0   # 緩衝區滿了而丟棄的樣本數
+        self.underruns = 0  # 播放途中資料不足而補零的次數
+        self.drains = 0     # 回應播放完畢而沒有資料的次數，不算是 underrun
+        self._starved = True
+        self._end = None       # 生產者以 mark_end() 標記的回應結尾位置
+        self._clear_to = None  # 生產者要求消費者丟棄到這個位置為止的資料
+
+    def available(self) -> int:
+        return self._write - self._read
+
+    def write_position(self) -> int:
+        # 到目前為止寫入的樣本總數，下一個寫入的樣本就在這個位置
+        return self._write
+
+    def read_position(self) -> int:
+        # 到目前為止讀出（包含清除掉）的樣本總數
+        return self._read
+
+    def write(self, data: np.ndarray) -> int:
+        n = min(len(data), self.capacity - self.available())
+        if n < len(data):
+            self.overruns += len(data) - n
+        start = self._write % self.capacity
+        first = min(n, self.capacity - start)
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[:n - first] = data[first:n]
+        # 資料複製完成後才移動索引，消費者才看得到
+        self._write += n
+        return n
+
+    def free_region(self) -> np.ndarray:
+        # 生產者可以直接寫入的連續空間（到緩衝區尾端為止），寫好後呼叫 commit()
+        start = self._write % self.capacity
+        free = self.capacity - self.available()
+        return self.buffer[start:start + min(free, self.capacity - start)]
+
+    def commit(self, n: int) -> None:
+        # 直接寫入 free_region() 的 n 個樣本可以讓消費者讀取了
+        self._write += n
+
+    def read_into(self, out: np.ndarray) -> int:
+        clear_to = self._clear_to
+        if clear_to is not None:
+            self._clear_to = None
+            self._read = max(self._read, clear_to)
+            # 刻意清除造成的沒有資料不算是 underrun
+            self._starved = True
+        if len(out) == 0:
+            # 預先緩衝時只處理清除要求，不改變是否沒有資料的狀態
+            return 0
+        n = min(len(out), self.available())
+        start = self._read % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:n] = self.buffer[:n - first]
+        self._read += n
+        if n < len(out):
+            # 只在從有資料變成沒資料時計算一次，剛好播到回應的結尾不算
+            if not self._starved:
+                if self._read == self._end:
+                    self.drains += 1
+                else:
+                    self.underruns += 1
+            self._starved = True
+        else:
+            self._starved = False
+        return n
+
+    def mark_end(self):
+        # 生產者在一個回應的資料都寫入後呼叫，播到這裡沒有資料是正常的結束
+        self._end = self._write
+
+    def clear(self):
+        # 只能在消費者沒有執行時（串流已停止）呼叫
+        self._read = self._write
+        self._starved = True
+
+    def request_clear(self):
+        # 生產者可以隨時呼叫，由消費者在下一次讀取時丟棄目前已寫入的資料
+        self._clear_to = self._write
+
+    def clear_pending(self) -> bool:
+        return self._clear_to is not None
+
+class JitterBuffer:
+    """決定收到語音之後要先累積多少才開始播放
+
+    每段語音（一個回應）以到達得最早的片段推算基準時間，片段 k 應該在
+    基準時間加上前面所有片段的長度時到達，實際晚到的毫秒數就是它的
+    延遲。收到新的一段語音或播放到一半資料用完時，會先等待 target_ms
+    再開始播放；prefill_ms 為 None 時，target_ms 會調整為最近 window 個
+    片段延遲的 quantile 百分位數，網路穩定時幾乎不增加延遲，片段到達
+    時間不穩定時則多緩衝一些以免播到一半斷音。
+    所有時間都以 time.monotonic() 的秒數傳入，方便用模擬的時間測試
+    """
+
+    def __init__(self, prefill_ms: float | None = None, min_prefill_ms: float = 0.0,
+                 max_prefill_ms: float = 400.0, window: int = 200, quantile: float = 95):
+        self.adaptive = prefill_ms is None
+        self.min_prefill_ms = min_prefill_ms
+        self.max_prefill_ms = max_prefill_ms
+        self.quantile = quantile
+        self.target_ms = min_prefill_ms if prefill_ms is None else prefill_ms
+        self.lateness: deque[float] = deque(maxlen=window)  # 各片段晚到的毫秒數
+        self.gaps: deque[float] = deque(maxlen=window)      # 片段到達的間隔毫秒數
+        self.buffering = False
+        self.since = 0.0          # 開始累積的時間
+        self.burst_start = None   # 這段語音的基準時間，None 表示目前沒有在播放的語音
+        self.burst_samples = 0    # 這段語音到目前為止收到的樣本數
+        self.last_arrival = None
+        self.packets = 0
+        self.late = 0       # 超過預定播放時間才到達的片段數
+        self.rebuffers = 0  # 播放到一半資料用完，重新累積的次數
+        self.bursts = 0
+
+    def arrived(self, samples: int, available: int, now: float) -> None:
+        # 生產者在寫入緩衝區之前呼叫，available 是寫入前還沒播放的樣本數
+        if self.last_arrival is not None:
+            self.gaps.append((now - self.last_arrival) * 1000)
+        self.last_arrival = now
+        self.packets += 1
+        lateness_ms = 0.0
+        if self.burst_start is not None:
+            lateness_ms = ((now - self.burst_start) * 1000
+                           - self.burst_samples * 1000 / SAMPLE_RATE)
+        if self.burst_start is None or (available == 0 and lateness_ms > self.max_prefill_ms):
+            # 新的一段語音
+            self.bursts += 1
+            self.burst_start = now
+            self.burst_samples = 0
+            self._start_buffering(now)
+        else:
+            if lateness_ms < 0:
+                # 比預期還早到，改以這個片段為基準
+                self.burst_start = now - self.burst_samples / SAMPLE_RATE
+                lateness_ms = 0.0
+            self.lateness.append(lateness_ms)
+            if lateness_ms > self.target_ms:
+                self.late += 1
+            if available == 0 and not self.buffering:
+                # 播放到一半資料用完了，再累積一次
+                self.rebuffers += 1
+                self._start_buffering(now)
+        self.burst_samples += samples
+
+    def _start_buffering(self, now: float) -> None:
+        if self.adaptive and self.lateness:
+            target = float(np.percentile(self.lateness, self.quantile))
+            self.target_ms = min(self.max_prefill_ms, max(self.min_prefill_ms, target))
+        self.since = now
+        self.buffering = True
+
+    def ready(self, now: float) -> bool:
+        # 消費者在每次 callback 時呼叫，傳回是否可以開始播放
+        if self.buffering and (now - self.since) * 1000 >= self.target_ms:
+            self.buffering = False
+        return not self.buffering
+
+    def end(self) -> None:
+        # 語音被丟棄或停止播放，下一個片段視為新的一段語音
+        self.burst_start = None
+        self.buffering = False
+
+    def stats(self) -> dict:
+        gaps = list(self.gaps)
+        lateness = list(self.lateness)
+        return {
+            "target_ms": self.target_ms,
+            "packets": self.packets,
+            "bursts": self.bursts,
+            "late": self.late,
+            "rebuffers": self.rebuffers,
+            "gap_p50_ms": float(np.percentile(gaps, 50)) if gaps else 0.0,
+            "gap_p95_ms": float(np.percentile(gaps, 95)) if gaps else 0.0,
+            "lateness_p95_ms": float(np.percentile(lateness, 95)) if lateness else 0.0,
+        }
+
 # utility class
 # source: https://reurl.cc/mRjK7W
 class AudioPlayerAsync:
-    def __init__(self):
-        self.queue = []
-        self.lock = threading.Lock()
-        self.stream = sd.OutputStream(
+    def __init__(self, max_buffer_s: float = 120.0, block_s: float = PLAYER_BLOCK_S,
+                 prefill_ms: float | None = PLAYER_PREFILL_MS,
+                 max_prefill_ms: float = 400.0, rate: int | None = None,
+                 audio_format: str = AUDIO_FORMAT):
+        # 收到的音訊依照 session 的 output_audio_format 解碼
+        self.audio_format = audio_format
+        self.format_rate = g711.FORMATS[audio_format][0]
+        # 以裝置的取樣率播放，收到的音訊在寫入緩衝區前先轉換
+        self.rate = device_rate("output") if rate is None else rate
+        self.resampler = Resampler(self.format_rate, self.rate)
+        # 預先配置好可以容納 max_buffer_s 秒音訊的緩衝區
+        self.ring = RingBuffer(int(max_buffer_s * self.rate))
+        self.jitter = JitterBuffer(prefill_ms, max_prefill_ms=max_prefill_ms)
+        # add_base64() 重複使用的解碼器與暫存區
+        self.b64 = Base64Decoder()
+        self._scratch = np.empty(0, dtype=np.uint8)
+        self._decoded = np.empty(0, dtype=np.int16)
+        self.block_s = block_s
+        self.stream = self._open_stream()
+        self.playing = False
+        self._frame_count = 0
+        self._item_start = None  # 新的語音項目第一個樣本在緩衝區中的位置
+        self._on_first_audio = None
+        self._on_silent = None
+
+    def _open_stream(self):
+        import sounddevice as sd
+
+        return sd.OutputStream(
             callback=self.callback,
-            samplerate=SAMPLE_RATE,
+            samplerate=self.rate,
             channels=CHANNELS,
             dtype=np.int16,
-            blocksize=int(CHUNK_LENGTH_S * SAMPLE_RATE),
+            blocksize=int(self.block_s * self.rate),
         )
-        self.playing = False
-        self._frame_count = 0
 
     def callback(self, outdata, frames, time, status):  # noqa
-        with self.lock:
-            data = np.empty(0, dtype=np.int16)
+        out = outdata[:, 0]
+        if self.jitter.ready(_time.monotonic()):
+            n = self.ring.read_into(out)
+        else:
+            # 還在預先緩衝，只處理 flush() 的清除要求
+            n = self.ring.read_into(out[:0])
+        item_start = self._item_start
+        if item_start is None:
+            self._frame_count += n
+        else:
+            end = self.ring.read_position()
+            if end > item_start:
+                # 新項目的樣本從這一塊開始送出，之前的樣本屬於上一個項目；
+                # 被 flush() 清除而沒有送出的樣本不算。先更新樣本數再清除標記，
+                # get_frame_count() 不會讀到上一個項目的樣本數
+                self._frame_count = end - max(item_start, end - n)
+                self._item_start = None
+
+        # 回報第一個不是靜音的樣本實際從喇叭發出的時間
+        on_first_audio = self._on_first_audio
+        if on_first_audio is not None and n > 0 and out[:n].any():
+            self._on_first_audio = None
+            # 從第一個有聲音的樣本在這一塊資料中的位置推算
+            first = int(np.argmax(out[:n] != 0))
+            audible_at = _time.monotonic() + first / self.rate
+            if time is not None:
+                # 加上這一塊資料從現在到送進 DAC 的時間
+                audible_at += max(0.0, time.outputBufferDacTime - time.currentTime)
+            on_first_audio(audible_at)
+
+        # flush() 要求的清除已經處理，這一塊開始就是靜音
+        on_silent = self._on_silent
+        if on_silent is not None and not self.ring.clear_pending():
+            self._on_silent = None
+            silent_at = _time.monotonic()
+            if time is not None:
+                silent_at += max(0.0, time.outputBufferDacTime - time.currentTime)
+            on_silent(silent_at)
 
-            # get next item from queue if there is still space in the buffer
-            while len(data) < frames and len(self.queue) > 0:
-                item = self.queue.pop(0)
-                frames_needed = frames - len(data)
-                data = np.concatenate((data, item[:frames_needed]))
-                if len(item) > frames_needed:
-                    self.queue.insert(0, item[frames_needed:])
+        # fill the rest of the frames with zeros if there is no more data
+        if n < frames:
+            out[n:] = 0
 
-            self._frame_count += len(data)
+    @property
+    def overruns(self) -> int:
+        return self.ring.overruns
 
-            # fill the rest of the frames with zeros if there is no more data
-            if len(data) < frames:
-                data = np.concatenate(
-                    (data, np.zeros(frames - len(data), dtype=np.int16))
-                )
+    @property
+    def underruns(self) -> int:
+        return self.ring.underruns
 
-        outdata[:] = data.reshape(-1, 1)
+    def stats(self) -> dict:
+        return {"overruns": self.overruns, "underruns": self.underruns,
+                "drains": self.ring.drains, "block_ms": self.block_s * 1000, **self.jitter.stats()}
+
+    def report(self) -> None:
+        stats = self.stats()
+        print("== playback ==")
+        print(f"block {stats['block_ms']:.0f}ms prefill {stats['target_ms']:.0f}ms "
+              f"underruns {stats['underruns']} drains {stats['drains']} "
+              f"overruns {stats['overruns']} "
+              f"late {stats['late']}/{stats['packets']} rebuffers {stats['rebuffers']}")
+        print(f"delta gap p50={stats['gap_p50_ms']:.0f}ms p95={stats['gap_p95_ms']:.0f}ms "
+              f"lateness p95={stats['lateness_p95_ms']:.0f}ms")
+
+    def set_block_size(self, block_s: float) -> None:
+        # 以新的 blocksize 重新開啟串流，緩衝區中的音訊會保留下來
+        playing = self.playing
+        if playing:
+            self.stream.stop()
+        self.stream.close()
+        self.block_s = block_s
+        self.stream = self._open_stream()
+        if playing:
+            self.stream.start()
+
+    def watch_first_audio(self, callback):
+        # callback 會在 PortAudio 的執行緒中以 time.monotonic() 的時間呼叫一次
+        self._on_first_audio = callback
 
     def reset_frame_count(self):
-        self._frame_count = 0
+        # 在寫入新的語音項目之前呼叫，等到這個項目的第一個樣本實際送出播放時，
+        # 才由 callback 重新開始計算，緩衝區中上一個項目的音訊不會算進來
+        self._item_start = self.ring.write_position()
 
     def get_frame_count(self):
+        # 以裝置的取樣率計算的樣本數，新項目還沒開始播放時是 0
+        if self._item_start is not None:
+            return 0
         return self._frame_count
 
+    def played_ms(self) -> int:
+        # 從上次 reset_frame_count() 之後實際送出播放的毫秒數
+        return self.get_frame_count() * 1000 // self.rate
+
+    def is_playing(self) -> bool:
+        # 還有收到但沒有播放完的語音
+        return self.ring.available() > 0
+
+    def end_response(self) -> None:
+        # 回應的語音都收到了，播完之後沒有資料不算是 underrun
+        self.ring.mark_end()
+
+    def flush(self, on_silent=None) -> int:
+        """丟掉還沒播放的音訊但不停止串流，傳回丟掉的樣本數（以 24kHz 計算）
+
+        下一次 callback 就會變成靜音，不必像 stop() 一樣重新啟動串流；
+        on_silent 會在 PortAudio 的執行緒中以 time.monotonic() 表示的靜音
+        開始時間呼叫一次
+        """
+        pending = self.ring.available() * SAMPLE_RATE // self.rate
+        self.jitter.end()
+        self.resampler.reset()
+        if not self.playing:
+            # 串流沒有在執行，可以直接清空
+            self.ring.clear()
+            if on_silent is not None:
+                on_silent(_time.monotonic())
+            return pending
+        # 先要求清除再設定 on_silent，callback 看到 on_silent 時清除要求一定已經送出
+        self.ring.request_clear()
+        self._on_silent = on_silent
+        return pending
+
     def add_data(self, data: bytes):
-        with self.lock:
-            # bytes is pcm16 single channel audio data, convert to numpy array
-            np_data = np.frombuffer(data, dtype=np.int16)
-            self.queue.append(np_data)
-            if not self.playing:
-                self.start()
+        # bytes is single channel audio data in audio_format, decode to int16 samples
+        np_data = g711.decode(data, self.audio_format)
+        self.jitter.arrived(len(np_data) * SAMPLE_RATE // self.format_rate,
+                            self.ring.available(), _time.monotonic())
+        self.ring.write(self.resampler.process(np_data))
+        if not self.playing:
+            self.start()
+
+    def add_base64(self, delta: str | bytes | memoryview):
+        """直接把 response.audio.delta 的 base64 資料解碼進播放的緩衝區
+
+        與 add_data(base64.b64decode(delta)) 的結果相同，但不會產生中間的
+        bytes 與陣列：pcm16 而且不必轉換取樣率時，直接解碼到環狀緩衝區中
+        還沒使用的區段；其他情況先解碼到重複使用的暫存區。delta 是
+        EventRouter 以 payload="delta" 登記時取得的 memoryview 時，從收到的
+        websocket 訊息到緩衝區只會複製這一次
+        """
+        src = self.b64.source(delta)
+        size = self.b64.buffer_size(src)
+        if len(self._scratch) < size:
+            self._scratch = np.empty(size * 2, dtype=np.uint8)
+        region = self.ring.free_region()
+        if self.audio_format == "pcm16" and self.rate == self.format_rate \
+                and region.nbytes >= size:
+            n = self.b64.decode_into(src, region.view(np.uint8)) // 2
+            self.jitter.arrived(n, self.ring.available(), _time.monotonic())
+            self.ring.commit(n)
+        else:
+            n = self.b64.decode_into(src, self._scratch)
+            scratch = self._scratch[:n]
+            if self.audio_format == "pcm16":
+                samples = scratch[:n - n % 2].view(np.int16)
+            else:
+                if len(self._decoded) < n:
+                    self._decoded = np.empty(len(self._scratch), dtype=np.int16)
+                samples = g711.decode(scratch, self.audio_format, out=self._decoded)
+            self.jitter.arrived(len(samples) * SAMPLE_RATE // self.format_rate,
+                                self.ring.available(), _time.monotonic())
+            # ring.write 會處理緩衝區已滿或跨過尾端的情況
+            self.ring.write(self.resampler.process(samples))
+        if not self.playing:
+            self.start()
 
     def start(self):
         self.playing = True
@@ -97,8 +612,76 @@ class AudioPlayerAsync:
     def stop(self):
         self.playing = False
         self.stream.stop()
-        with self.lock:
-            self.queue = []
+        # 串流已停止，可以安全地清空緩衝區
+        self.ring.clear()
+        self.jitter.end()
+        self.resampler.reset()
 
     def terminate(self):
         self.stream.close()
+
+# 以 callback 擷取麥克風音訊，每收到一塊資料就透過 call_soon_threadsafe
+# 放進 asyncio 的佇列，傳送端只有在真的有資料時才會被喚醒，不必不斷輪詢
+class MicCapture:
+    def __init__(self, frame_s: float = 0.02, max_frames: int = 50, rate: int | None = None):
+        self.frame_s = frame_s
+        self.frame_size = int(SAMPLE_RATE * frame_s)
+        # 以裝置的取樣率擷取，放進佇列前才在事件迴圈中轉換成 24kHz，
+        # 不佔用 PortAudio 的 callback；rate 為 None 時在 start() 決定
+        self.rate = rate
+        self.resampler: Resampler | None = None
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(max_frames)
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.stream = None
+        self.captured = 0   # 放進佇列的音訊塊數
+        self.dropped = 0    # 佇列滿了而丟棄的音訊塊數
+        self.overflows = 0  # PortAudio 回報輸入溢位的次數
+
+    def start(self):
+        import sounddevice as sd
+
+        self.loop = asyncio.get_running_loop()
+        if self.rate is None:
+            self.rate = device_rate("input")
+        if self.rate != SAMPLE_RATE:
+            self.resampler = Resampler(self.rate, SAMPLE_RATE)
+        self.stream = sd.InputStream(
+            callback=self.callback,
+            samplerate=self.rate,
+            channels=CHANNELS,
+            dtype="int16",
+            blocksize=int(self.rate * self.frame_s),
+        )
+        self.stream.start()
+
+    def callback(self, indata, frames, time, status):  # noqa
+        if status and status.input_overflow:
+            self.overflows += 1
+        # indata 的記憶體之後會被 PortAudio 重複使用，必須先複製；
+        # callback 中只複製資料，轉換取樣率留給 _put()
+        self.loop.call_soon_threadsafe(self._put, indata[:, 0].copy())
+
+    def _put(self, samples: np.ndarray):
+        # 在事件迴圈的執行緒中依照收到的順序執行，Resampler 的狀態不會錯亂
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        data = samples.tobytes()
+        if self.queue.full():
+            # 丟掉最舊的資料，讓延遲維持在佇列長度以內
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+        self.captured += 1
+
+    async def read(self) -> bytes:
+        return await self.queue.get()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def stats(self) -> str:
+        return (f"mic: {self.captured} frames captured, {self.dropped} dropped, "
+                f"{self.overflows} overflows")
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import binascii
+
+import numpy as np
+
+# 以 NumPy 查表解碼 base64，直接寫進呼叫端提供的陣列（例如播放端環狀緩衝區
+# 中還沒使用的區段），不像 base64.b64decode 每次都產生新的 bytes：
+#
+#   decoder = Base64Decoder()
+#   src = decoder.source(event["delta"])    # str、bytes 或 memoryview
+#   n = decoder.decode_into(src, out)       # out 是 uint8 陣列，傳回解碼的位元組數
+#
+# 運算過程用到的暫存陣列都重複使用，長時間播放時記憶體用量不會增加，但每次解碼
+# 仍然會配置一些小物件（benchmark.py delta_decode 中每個 100ms 的 delta 約 3KB）。
+# NumPy 查表比 base64.b64decode 使用的 C 實作 binascii 慢，是以 CPU 時間換取較少的
+# 記憶體配置
+
+_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_INVALID = 0xFF
+
+def _decode_table() -> np.ndarray:
+    table = np.full(256, _INVALID, dtype=np.uint8)
+    table[np.frombuffer(_ALPHABET, dtype=np.uint8)] = np.arange(64, dtype=np.uint8)
+    # 補齊用的 = 當成 0，解碼後多出來的位元組由 decoded_size 排除
+    table[ord("=")] = 0
+    return table
+
+_TABLE = _decode_table()
+
+class Base64Decoder:
+    def __init__(self, capacity: int = 1 << 16):
+        # capacity 是一次可以解碼的 base64 字元數，不夠時會自動加大
+        self._grow(capacity)
+
+    def _grow(self, n: int) -> None:
+        n = -(-n // 4) * 4
+        # np.take 的索引一定要是 intp，先轉換到重複使用的陣列，否則每次都會配置暫存陣列
+        self._codes = np.empty(n, dtype=np.intp)
+        self._index = np.empty(n, dtype=np.uint8)  # 每個字元代表的 6 位元值
+        self._tmp = np.empty(n // 4, dtype=np.uint8)
+        self.capacity = n
+
+    @staticmethod
+    def source(data: str | bytes | memoryview) -> np.ndarray:
+        # bytes 與 memoryview 直接以 uint8 陣列檢視，不複製；
+        # str 沒有緩衝區介面，只能先轉成 bytes
+        if isinstance(data, str):
+            data = data.encode("ascii")
+        return np.frombuffer(data, dtype=np.uint8)
+
+    @staticmethod
+    def decoded_size(src: np.ndarray) -> int:
+        n = len(src)
+        if n == 0:
+            return 0
+        pad = int(src[-1] == 0x3D) + int(n > 1 and src[-2] == 0x3D)  # "="
+        return n // 4 * 3 - pad
+
+    @staticmethod
+    def buffer_size(src: np.ndarray) -> int:
+        # decode_into 會寫入的位元組數，包含補齊產生的 1~2 個多餘位元組
+        return len(src) // 4 * 3
+
+    def decode_into(self, src: np.ndarray, out: np.ndarray) -> int:
+        """把 src（uint8 陣列）解碼到 out 的開頭，傳回解碼後的位元組數
+
+        out 至少要有 buffer_size(src) 個位元組
+        """
+        n = len(src)
+        if n % 4:
+            raise binascii.Error("Incorrect padding")
+        if n > self.capacity:
+            self._grow(n)
+        quads = n // 4
+        index = self._index[:n]
+        codes = self._codes[:n]
+        np.copyto(codes, src)
+        # 索引一定在 0~255 之間；預設的 mode="raise" 會把 out 先寫到暫存區
+        np.take(_TABLE, codes, out=index, mode="clip")
+        if n and index.max() == _INVALID:
+            raise binascii.Error("Invalid base64 character")
+        q0, q1, q2, q3 = index[0::4], index[1::4], index[2::4], index[3::4]
+        o = out[:quads * 3]
+        o0, o1, o2 = o[0::3], o[1::3], o[2::3]
+        t = self._tmp[:quads]
+        # 每 4 個 6 位元值組成 3 個位元組，uint8 左移超出的位元會直接捨去
+        np.left_shift(q0, 2, out=o0)
+        np.right_shift(q1, 4, out=t)
+        np.bitwise_or(o0, t, out=o0)
+        np.left_shift(q1, 4, out=o1)
+        np.right_shift(q2, 2, out=t)
+        np.bitwise_or(o1, t, out=o1)
+        np.left_shift(q2, 6, out=o2)
+        np.bitwise_or(o2, q3, out=o2)
+        return self.decoded_size(src)
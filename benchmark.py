@@ -0,0 +1,360 @@
+# 測量各項音訊處理的效能，數值以「處理速度是即時播放的幾倍」表示
+import gc
+import sys
+import time
+import json
+import base64
+import asyncio
+import tempfile
+import threading
+import tracemalloc
+
+import numpy as np
+
+import g711
+import audio_util
+from decode_cache import DecodeCache
+from event_router import EventRouter
+from audio_sender import AudioSender
+from vad_gate import VadGate
+from audio_util import (SAMPLE_RATE, AudioPlayerAsync, JitterBuffer, MicCapture,
+                        Resampler, RingBuffer, base64_encode_audio, float_to_16bit_pcm)
+
+def timeit(func, repeat=5):
+    # 取多次執行中最快的一次
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(name, audio_seconds, elapsed):
+    print(f'{name:<40} {elapsed * 1000:9.2f} ms  '
+          f'{audio_seconds / elapsed:10.0f}x realtime')
+
+def bench_pcm16(seconds=60.0):
+    samples = np.random.default_rng(0).uniform(
+        -1.2, 1.2, int(seconds * SAMPLE_RATE)
+    ).astype(np.float32)
+    out = np.empty(len(samples), dtype=np.int16)
+    chunks = np.array_split(samples, int(seconds / 0.02))
+
+    report('float_to_16bit_pcm',
+           seconds, timeit(lambda: float_to_16bit_pcm(samples)))
+    report('float_to_16bit_pcm(out=...)',
+           seconds, timeit(lambda: float_to_16bit_pcm(samples, out=out)))
+    report('float_to_16bit_pcm(dither=True)',
+           seconds, timeit(lambda: float_to_16bit_pcm(samples, dither=True)))
+    report('base64_encode_audio',
+           seconds, timeit(lambda: base64_encode_audio(samples, out=out)))
+    report('base64_encode_audio(20ms chunks)',
+           seconds, timeit(lambda: base64_encode_audio(chunks, out=out)))
+
+def fake_mic(callback, stop, frame_size):
+    # 模擬音效卡每 20ms 呼叫一次 callback
+    frame = np.zeros((frame_size, 1), dtype=np.int16)
+    while not stop.is_set():
+        time.sleep(frame_size / SAMPLE_RATE)
+        callback(frame, frame_size, None, None)
+
+async def poll_capture(seconds):
+    # 原本的作法：不斷檢查是否累積了足夠的資料
+    frame_size = int(SAMPLE_RATE * 0.02)
+    available = [0]
+    stop = threading.Event()
+    def callback(indata, frames, time_info, status):
+        available[0] += frames
+    thread = threading.Thread(target=fake_mic, args=(callback, stop, frame_size))
+    thread.start()
+    frames = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if available[0] < frame_size:
+            await asyncio.sleep(0)
+            continue
+        available[0] -= frame_size
+        frames += 1
+        await asyncio.sleep(0)
+    stop.set()
+    thread.join()
+    return frames, 0
+
+async def callback_capture(seconds):
+    mic = MicCapture()
+    mic.loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    thread = threading.Thread(target=fake_mic, args=(mic.callback, stop, mic.frame_size))
+    thread.start()
+    frames = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        await mic.read()
+        frames += 1
+    stop.set()
+    thread.join()
+    return frames, mic.dropped
+
+def bench_mic(seconds=3.0):
+    for name, capture in [('busy poll', poll_capture),
+                          ('callback + queue', callback_capture)]:
+        cpu = time.process_time()
+        frames, dropped = asyncio.run(capture(seconds))
+        cpu = time.process_time() - cpu
+        print(f'{name:<40} {cpu / seconds * 100:6.1f}% CPU  '
+              f'{frames} frames  {dropped} dropped')
+
+class FakeInputAudioBuffer:
+    # 模擬 SDK 把事件序列化成 JSON 的負擔
+    async def append(self, audio):
+        json.dumps({'type': 'input_audio_buffer.append', 'audio': audio})
+
+class FakeConnection:
+    def __init__(self):
+        self.input_audio_buffer = FakeInputAudioBuffer()
+
+async def send_frames(sender, frames):
+    connection = FakeConnection()
+    task = asyncio.create_task(sender.run(connection))
+    for frame in frames:
+        sender.feed(frame)
+        await asyncio.sleep(0)
+    await sender.flush(connection)
+    task.cancel()
+
+def bench_sender(seconds=60.0):
+    frame = bytes(int(SAMPLE_RATE * 0.02) * 2)
+    frames = [frame] * int(seconds / 0.02)
+    for packet_ms in (20, 60, 200):
+        sender = AudioSender(packet_ms=packet_ms, adaptive=False)
+        elapsed = timeit(lambda: asyncio.run(send_frames(sender, frames)), repeat=1)
+        report(f'AudioSender(packet_ms={packet_ms}) '
+               f'{sender.packets_sent / seconds:.0f} msg/s', seconds, elapsed)
+
+def delta_arrivals(rng, responses=20, seconds=8.0, delta_ms=100, stall_p=0.03):
+    # 模擬網路傳來的 response.audio.delta：大致依照即時的速度送達，
+    # 但每個片段有隨機的延遲，偶爾還會卡住一段時間
+    arrivals = []
+    start = 0.0
+    for _ in range(responses):
+        count = int(seconds * 1000 / delta_ms)
+        for k in range(count):
+            delay = rng.exponential(0.02)
+            if rng.random() < stall_p:
+                delay += rng.uniform(0.1, 0.3)
+            arrivals.append((start + k * delta_ms / 1000 + delay, k == 0, k == count - 1))
+        start += seconds + 2.0
+    arrivals.sort()
+    return arrivals, int(SAMPLE_RATE * delta_ms / 1000)
+
+def simulate_playback(arrivals, samples, jitter, block_s):
+    # 以模擬的時間交錯執行生產者與播放端的 callback
+    ring = RingBuffer(SAMPLE_RATE * 60)
+    out = np.zeros(int(block_s * SAMPLE_RATE), dtype=np.int16)
+    data = np.ones(samples, dtype=np.int16)
+    startup = []
+    first_arrival = None
+    t = 0.0
+    i = 0
+    end = arrivals[-1][0] + 2.0
+    while t < end:
+        while i < len(arrivals) and arrivals[i][0] <= t:
+            arrival, first, last = arrivals[i]
+            if first:
+                first_arrival = arrival
+            jitter.arrived(samples, ring.available(), arrival)
+            ring.write(data)
+            if last:
+                # 回應最後一個片段播完不算是 underrun
+                ring.mark_end()
+            i += 1
+        if jitter.ready(t) and ring.read_into(out) and first_arrival is not None:
+            startup.append((t - first_arrival) * 1000)
+            first_arrival = None
+        t += block_s
+    return ring.underruns, startup
+
+def bench_jitter(block_s=0.02):
+    arrivals, samples = delta_arrivals(np.random.default_rng(0))
+    for prefill_ms in (0, 50, 100, 200, None):
+        jitter = JitterBuffer(prefill_ms)
+        underruns, startup = simulate_playback(arrivals, samples, jitter, block_s)
+        name = 'adaptive' if prefill_ms is None else f'prefill {prefill_ms}ms'
+        print(f'{name:<16} startup {np.mean(startup):6.1f}ms  '
+              f'target {jitter.target_ms:6.1f}ms  underruns {underruns:4d}  '
+              f'late {jitter.late:4d}  rebuffers {jitter.rebuffers:4d}')
+
+def bench_resample(seconds=30.0, block_s=0.02):
+    from pydub import AudioSegment
+
+    for from_rate, to_rate in [(48000, SAMPLE_RATE), (44100, SAMPLE_RATE),
+                               (SAMPLE_RATE, 48000), (SAMPLE_RATE, 44100)]:
+        pcm = np.random.default_rng(0).integers(
+            -8000, 8000, int(seconds * from_rate), dtype=np.int16)
+        blocks = np.array_split(pcm, int(seconds / block_s))
+        def streaming():
+            resampler = Resampler(from_rate, to_rate)
+            for block in blocks:
+                resampler.process(block)
+        # audio_to_pcm16_base64 以 pydub 一次轉換整段音訊
+        segment = AudioSegment(pcm.tobytes(), frame_rate=from_rate,
+                               sample_width=2, channels=1)
+        report(f'Resampler {from_rate}->{to_rate} ({block_s * 1000:.0f}ms blocks)',
+               seconds, timeit(streaming, repeat=3))
+        report(f'pydub set_frame_rate {from_rate}->{to_rate}',
+               seconds, timeit(lambda: segment.set_frame_rate(to_rate), repeat=3))
+
+def speech_like(rng, seconds=60.0, frame_s=0.02):
+    # 模擬講話：1~4 秒的語音段落（帶有音節起伏的諧波）之間夾著 1~6 秒的背景雜音
+    samples = []
+    t = 0.0
+    while t < seconds:
+        silence = rng.uniform(1, 6)
+        samples.append(rng.normal(0, 60, int(silence * SAMPLE_RATE)))
+        talk = rng.uniform(1, 4)
+        n = int(talk * SAMPLE_RATE)
+        k = np.arange(n) / SAMPLE_RATE
+        envelope = np.abs(np.sin(2 * np.pi * 3 * k))
+        voice = sum(np.sin(2 * np.pi * f * k) / i for i, f in enumerate((140, 280, 420, 560), 1))
+        samples.append(3000 * envelope * voice + rng.normal(0, 60, n))
+        t += silence + talk
+    pcm = np.clip(np.concatenate(samples), -32768, 32767).astype(np.int16)
+    frame = int(SAMPLE_RATE * frame_s)
+    return [pcm[i:i + frame].tobytes() for i in range(0, len(pcm) - frame + 1, frame)]
+
+def bench_vad(seconds=60.0):
+    frames = speech_like(np.random.default_rng(0), seconds)
+    gate = VadGate()
+    def run():
+        for frame in frames:
+            gate.process(frame)
+    report('VadGate.process(20ms frames)', len(frames) * 0.02, timeit(run, repeat=1))
+    print(gate.stats())
+
+def bench_g711(seconds=60.0):
+    rate = g711.FORMATS['g711_ulaw'][0]
+    pcm = np.random.default_rng(0).integers(
+        -32768, 32767, int(seconds * rate), dtype=np.int16)
+    for audio_format in ('g711_ulaw', 'g711_alaw'):
+        encoded = g711.encode(pcm, audio_format).tobytes()
+        report(f'{audio_format} encode',
+               seconds, timeit(lambda: g711.encode(pcm, audio_format)))
+        report(f'{audio_format} decode',
+               seconds, timeit(lambda: g711.decode(encoded, audio_format)))
+    # 各格式每秒經過 base64 編碼後的資料量
+    for audio_format, (rate, width) in g711.FORMATS.items():
+        print(f'{audio_format:<12} {rate * width * 4 / 3 / 1000:5.1f} KB/s per direction')
+
+def bench_decode_cache(path='chinese.mp3'):
+    # realtime_api_file.py 啟動時的解碼：沒有快取（cold）與有快取（warm）的比較，
+    # 使用暫存的快取目錄，不影響平常的快取
+    with open(path, 'rb') as f:
+        audio_bytes = f.read()
+    default_cache = audio_util.decode_cache
+    with tempfile.TemporaryDirectory() as directory:
+        audio_util.decode_cache = DecodeCache(directory, enabled=True)
+        try:
+            for label in ('cold', 'warm'):
+                start = time.perf_counter()
+                chunks = audio_util.iter_pcm16_chunks(path, 0.5)
+                first = next(chunks)
+                first_s = time.perf_counter() - start
+                size = len(first) + sum(len(chunk) for chunk in chunks)
+                elapsed = time.perf_counter() - start
+                seconds = size / 2 / SAMPLE_RATE
+                print(f'iter_pcm16_chunks ({label}): first chunk {first_s * 1000:.1f} ms')
+                report(f'iter_pcm16_chunks ({label})', seconds, elapsed)
+            # 同樣的內容與目標格式共用同一個快取項目，先清掉才是 cold
+            audio_util.decode_cache.clear()
+            for label in ('cold', 'warm'):
+                start = time.perf_counter()
+                audio_util.audio_to_pcm16_base64(audio_bytes)
+                report(f'audio_to_pcm16_base64 ({label})', seconds, time.perf_counter() - start)
+            audio_util.decode_cache.report()
+        finally:
+            audio_util.decode_cache = default_cache
+
+def delta_frames(seconds, delta_ms=100):
+    # 模擬伺服端送來的 response.audio.delta 訊息
+    rng = np.random.default_rng(0)
+    n = int(SAMPLE_RATE * delta_ms / 1000)
+    return [json.dumps({
+        'type': 'response.audio.delta', 'event_id': f'event_{i}',
+        'response_id': 'resp_1', 'item_id': 'item_1', 'output_index': 0,
+        'content_index': 0,
+        'delta': base64.b64encode(rng.integers(-8000, 8000, n, dtype=np.int16).tobytes()).decode(),
+    }, separators=(',', ':')).encode() for i in range(int(seconds * 1000 / delta_ms))]
+
+def dispatch(router, frame):
+    # 處理函式都不是 async，不必經過事件迴圈，直接執行 dispatch() 到結束
+    try:
+        router.dispatch(None, frame).send(None)
+    except StopIteration:
+        pass
+
+def bench_delta_decode(seconds=60.0):
+    # 從收到的 websocket 訊息到播放端的緩衝區：原本的 json 解碼 + b64decode + add_data，
+    # 與 payload="delta" + add_base64 相比，記錄每個 delta 配置的記憶體、處理完仍然
+    # 佔用的記憶體區塊數與 GC 次數。CPython 的正式版本沒有記錄配置次數的計數器，
+    # 所以以 tracemalloc 量得的每個 delta 暫時配置的位元組數代替
+    frames = delta_frames(seconds)
+    out = np.empty(int(SAMPLE_RATE * 0.02), dtype=np.int16)
+    for label, payload, handle in (
+        ('b64decode + add_data', None,
+         lambda player, event: player.add_data(base64.b64decode(event['delta']))),
+        ('payload + add_base64', 'delta',
+         lambda player, event: player.add_base64(event['delta'])),
+    ):
+        # 不開始播放，由這裡代替 callback 讀出緩衝區
+        player = AudioPlayerAsync(rate=SAMPLE_RATE, audio_format='pcm16', prefill_ms=0)
+        player.playing = True
+        router = EventRouter()
+        router.on('response.audio.delta', raw=True, payload=payload)(
+            lambda event: handle(player, event))
+
+        def run(trace):
+            allocated = 0
+            blocks = sys.getallocatedblocks()
+            for frame in frames:
+                if trace:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                dispatch(router, frame)
+                while player.ring.read_into(out):
+                    pass
+                if trace:
+                    allocated += tracemalloc.get_traced_memory()[1] - before
+            return allocated, sys.getallocatedblocks() - blocks
+
+        elapsed = timeit(lambda: run(False), repeat=3)
+        gc.collect()
+        collections = sum(s['collections'] for s in gc.get_stats())
+        tracemalloc.start()
+        allocated, retained = run(True)
+        tracemalloc.stop()
+        collections = sum(s['collections'] for s in gc.get_stats()) - collections
+        report(label, seconds, elapsed)
+        print(f'{"":<40} {allocated / len(frames):9.0f} bytes allocated per delta '
+              f'({allocated / seconds / 1000:.1f} KB per audio second), '
+              f'{retained / len(frames):.2f} blocks retained per delta, '
+              f'{collections / seconds:.2f} GC runs per audio second')
+        player.stream.close()
+
+BENCHMARKS = {
+    'pcm16': bench_pcm16,
+    'mic': bench_mic,
+    'sender': bench_sender,
+    'jitter': bench_jitter,
+    'resample': bench_resample,
+    'vad': bench_vad,
+    'g711': bench_g711,
+    'decode_cache': bench_decode_cache,
+    'delta_decode': bench_delta_decode,
+}
+
+if __name__ == '__main__':
+    # 可以在命令列指定要執行的項目，未指定就全部執行
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import time
+import random
+import asyncio
+import inspect
+from collections import OrderedDict
+from typing import Any, Callable
+
+from websockets.exceptions import InvalidStatus, WebSocketException
+
+from event_router import EventRouter
+from latency_trace import percentile
+
+# 斷線後自動重新連線的 Realtime API 連線管理器，取代直接以 async with 包住
+# client.beta.realtime.connect(...) 的寫法：
+#
+#   manager = ConnectionManager(router, session={"turn_detection": None})
+#
+#   @manager.on_connect
+#   def on_connect(conn):
+#       global connection
+#       connection = conn
+#
+#   await manager.run(create_client())
+#
+# 每次連上（包含重新連線）都會重新送出 session 設定，並且依照記錄下來的
+# 對話項目以 conversation.item.create 重建對話，再呼叫 on_connect 登記的函式，
+# 讓傳送音訊等工作改用新的連線；斷線時以指數退避的間隔重試。
+# 使用者的語音只能以文字轉錄重建，所以 replay=True 時如果 session 沒有設定
+# input_audio_transcription，就會以 transcription 參數的設定開啟（會另外計費），
+# 傳入 transcription=None 則不開啟，沒有轉錄的使用者語音就無法重建。
+# 金鑰錯誤等重試也不會成功的 HTTP 狀態碼會直接拋出例外，連續失敗 max_attempts
+# 次之後也會放棄
+TRANSCRIPTION = {"model": "whisper-1"}
+NON_RETRYABLE_STATUS = {400, 401, 403, 404}
+
+_transcription_noted = False
+
+class ConnectionManager:
+    def __init__(self, router: EventRouter, session: dict | None = None,
+                 model: str = "gpt-4o-realtime-preview",
+                 extra_query: dict | None = None, replay: bool = True,
+                 transcription: dict | None = TRANSCRIPTION,
+                 min_backoff: float = 0.1, max_backoff: float = 10.0,
+                 max_attempts: int | None = 10):
+        global _transcription_noted
+        self.router = router
+        self.session = dict(session or {})  # 每次連線都會重新套用的設定
+        if (replay and transcription is not None
+                and "input_audio_transcription" not in self.session):
+            self.session["input_audio_transcription"] = dict(transcription)
+            if not _transcription_noted:
+                # 同一個行程中有很多交談階段時只提醒一次
+                _transcription_noted = True
+                print(f"connection: input_audio_transcription turned on "
+                      f"({transcription.get('model')}) to replay user turns after a "
+                      f"reconnect; pass transcription=None to turn it off")
+        self.model = model
+        self.extra_query = extra_query or {}
+        self.replay = replay
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts  # 連續失敗幾次就放棄，None 表示不限
+        self.connection = None
+        self.connected = asyncio.Event()
+        self.callbacks: list[Callable[[Any], Any]] = []
+        self.closed = False
+        # 目前對話中的項目，依照建立的順序排列
+        self.items: OrderedDict[str, dict] = OrderedDict()
+        router.on_any(self.track)
+
+        self.connects = 0
+        self.drops = 0
+        self.failures = 0       # 連線失敗的次數
+        self.replayed = 0       # 重建對話時送出的項目數
+        self.skipped = 0        # 沒有文字內容而無法重建的項目數
+        self.truncated = 0      # 因為使用者的語音沒有轉錄而停止重建的次數
+        self.recover_ms: list[float] = []  # 每次斷線到重新可以使用的毫秒數
+
+    def on_connect(self, callback: Callable[[Any], Any]) -> Callable[[Any], Any]:
+        # callback(connection) 可以是一般函式或 async 函式
+        self.callbacks.append(callback)
+        return callback
+
+    # ---- 記錄對話項目 ----
+
+    def track(self, event: dict, size: int = 0) -> None:
+        event_type = event.get("type")
+        if event_type == "conversation.item.created":
+            item = event["item"]
+            self.items.setdefault(item["id"], item)
+        elif event_type == "response.output_item.done":
+            # 完成的項目才有完整的文字轉錄與函式參數
+            item = event["item"]
+            self.items[item["id"]] = item
+        elif event_type == "conversation.item.input_audio_transcription.completed":
+            item = self.items.get(event["item_id"])
+            if item and item.get("content"):
+                item["content"][event.get("content_index", 0)]["transcript"] = event["transcript"]
+        elif event_type == "conversation.item.deleted":
+            self.items.pop(event["item_id"], None)
+
+    @staticmethod
+    def replay_item(item: dict) -> dict | None:
+        """把伺服端的項目轉成可以用 conversation.item.create 重建的形式
+
+        伺服端不會傳回語音的內容，所以語音只能以文字轉錄重建，
+        沒有轉錄的語音就傳回 None
+        """
+        item_type = item.get("type")
+        if item_type == "function_call":
+            return {key: item[key] for key in ("id", "type", "call_id", "name", "arguments")}
+        if item_type == "function_call_output":
+            return {key: item[key] for key in ("id", "type", "call_id", "output")}
+        role = item.get("role")
+        text_type = "text" if role == "assistant" else "input_text"
+        content = []
+        for part in item.get("content") or []:
+            text = part.get("text") or part.get("transcript")
+            if text:
+                content.append({"type": text_type, "text": text})
+        if not content:
+            return None
+        return {"id": item["id"], "type": "message", "role": role, "content": content}
+
+    # ---- 連線 ----
+
+    async def update_session(self, **config: Any) -> None:
+        # 修改設定並記下來，重新連線時也會套用
+        self.session.update(config)
+        if self.connection is not None:
+            await self.connection.session.update(session=config)
+
+    async def _setup(self, conn) -> None:
+        if self.session:
+            await conn.session.update(session=self.session)
+        if self.replay and self.connects > 1:
+            items = list(self.items.values())
+            for i, item in enumerate(items):
+                replay = self.replay_item(item)
+                if replay is None and item.get("role") == "user":
+                    # 少了使用者的問題，之後的回答就接不上了，從這裡開始都不重建
+                    self.truncated += 1
+                    self.skipped += len(items) - i
+                    break
+                if replay is None:
+                    self.skipped += 1
+                    continue
+                await conn.conversation.item.create(item=replay)
+                self.replayed += 1
+        self.connection = conn
+        for callback in self.callbacks:
+            result = callback(conn)
+            if inspect.isawaitable(result):
+                await result
+        self.connected.set()
+
+    async def run(self, client) -> None:
+        backoff = self.min_backoff
+        attempts = 0  # 連續失敗的次數
+        dropped_at: float | None = None
+        while not self.closed:
+            try:
+                async with client.beta.realtime.connect(
+                    model=self.model, extra_query=self.extra_query,
+                ) as conn:
+                    self.connects += 1
+                    await self._setup(conn)
+                    if dropped_at is not None:
+                        self.recover_ms.append((time.monotonic() - dropped_at) * 1000)
+                        print(f"reconnected in {self.recover_ms[-1]:.0f}ms "
+                              f"({self.replayed} items replayed so far)")
+                        dropped_at = None
+                    backoff = self.min_backoff
+                    attempts = 0
+                    await self.router.run(conn)
+                # 伺服端正常關閉連線也當作斷線處理
+                if self.closed:
+                    break
+                print("connection closed by server")
+            except (WebSocketException, OSError, asyncio.TimeoutError) as exc:
+                if self.closed:
+                    break
+                if (isinstance(exc, InvalidStatus)
+                        and exc.response.status_code in NON_RETRYABLE_STATUS):
+                    # 例如金鑰錯誤（401），重試也不會成功
+                    self.failures += 1
+                    print(f"connection rejected: {exc!r}")
+                    raise
+                if self.connection is None:
+                    self.failures += 1
+                    attempts += 1
+                    if self.max_attempts is not None and attempts >= self.max_attempts:
+                        print(f"giving up after {attempts} failed attempts: {exc!r}")
+                        raise
+                print(f"connection lost: {exc!r}")
+            finally:
+                self.connected.clear()
+            if self.connection is not None:
+                self.connection = None
+                self.drops += 1
+            if dropped_at is None:
+                dropped_at = time.monotonic()
+            # 指數退避，加上隨機的抖動避免大量用戶端同時重新連線
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+            backoff = min(self.max_backoff, backoff * 2)
+
+    async def close(self) -> None:
+        self.closed = True
+        self.router.stop()
+        if self.connection is not None:
+            await self.connection.close()
+
+    def report(self) -> None:
+        print("== connection ==")
+        print(f"{self.connects} connects, {self.drops} drops, {self.failures} failed attempts, "
+              f"{self.replayed} items replayed, {self.skipped} skipped")
+        if self.truncated:
+            transcription = "on" if self.session.get("input_audio_transcription") else "off"
+            print(f"{self.truncated} replays stopped at a user turn without a transcript "
+                  f"(input_audio_transcription is {transcription})")
+        if self.recover_ms:
+            print(f"time to recover p50={percentile(self.recover_ms, 50):.0f}ms "
+                  f"max={max(self.recover_ms):.0f}ms")
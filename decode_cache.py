@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import os
+import mmap
+import hashlib
+import tempfile
+from pathlib import Path
+
+# 把解碼（並轉換取樣率）後的 pcm16 存在磁碟上的快取。同樣的音訊檔（問候語、
+# 測試片段）再送一次時，直接以 mmap 讀回轉換好的資料，不必再跑一次 ffmpeg。
+# 檔案以路徑、大小與修改時間為鍵，不必在開始解碼前先讀完整個檔案計算雜湊值；
+# 已經在記憶體中的資料則以內容的雜湊值為鍵：
+#
+#   from decode_cache import decode_cache, file_digest
+#
+#   key = decode_cache.key(file_digest(path), "pcm16-24000-1ch")
+#   data = decode_cache.get(key)        # 沒有快取時傳回 None
+#   if data is None:
+#       decode_cache.put(key, decode(path))
+#
+# 鍵同時包含目標格式，改變取樣率或聲道數就是不同的項目；
+# 總大小超過上限時，依照最後使用的時間刪掉最舊的項目
+#
+# 預設不使用，可以用環境變數設定：
+#   DECODE_CACHE=1        使用快取
+#   DECODE_CACHE_DIR      快取目錄，預設是 ~/.cache/realtime/decode
+#   DECODE_CACHE_MB       快取的總大小上限，預設 512MB
+DECODE_CACHE = os.environ.get("DECODE_CACHE") == "1"
+DECODE_CACHE_DIR = os.environ.get(
+    "DECODE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "realtime", "decode"))
+DECODE_CACHE_MB = float(os.environ.get("DECODE_CACHE_MB", 512))
+
+SUFFIX = ".pcm"
+
+def bytes_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def file_digest(path: str) -> str:
+    # 只看路徑、大小與修改時間，不讀取檔案內容；檔案被修改後就是不同的項目
+    st = os.stat(path)
+    key = f"{os.path.realpath(path)}\0{st.st_size}\0{st.st_mtime_ns}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+class CacheWriter:
+    """一邊解碼一邊寫入快取，commit() 之後其他人才看得到"""
+
+    def __init__(self, cache: DecodeCache, key: str):
+        self.cache = cache
+        self.key = key
+        # 先寫到同一個目錄中的暫存檔，完成後再改名，多個行程同時寫入也不會讀到一半的資料
+        fd, self.tmp = tempfile.mkstemp(dir=cache.directory, suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+
+    def commit(self) -> None:
+        self.file.close()
+        size = os.path.getsize(self.tmp)
+        os.replace(self.tmp, self.cache.path(self.key))
+        self.cache.stored(size)
+
+    def discard(self) -> None:
+        # 解碼到一半就中止時丟掉暫存檔
+        self.file.close()
+        try:
+            os.unlink(self.tmp)
+        except FileNotFoundError:
+            pass
+
+class DecodeCache:
+    def __init__(self, directory: str = DECODE_CACHE_DIR,
+                 max_bytes: int = int(DECODE_CACHE_MB * 1024 * 1024),
+                 enabled: bool = DECODE_CACHE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0   # 從快取讀回的位元組數
+        self.bytes_stored = 0   # 寫入快取的位元組數
+
+    @staticmethod
+    def key(digest: str, target: str) -> str:
+        return f"{digest}-{target}"
+
+    def path(self, key: str) -> Path:
+        return self.directory / (key + SUFFIX)
+
+    def get(self, key: str) -> mmap.mmap | bytes | None:
+        """傳回唯讀的 mmap（可以直接切片或交給 base64），沒有快取時傳回 None"""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                # 長度 0 的檔案不能 mmap
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            # 以修改時間記錄最後使用的時間，淘汰時依此排序
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_served += size
+        return data
+
+    def writer(self, key: str) -> CacheWriter | None:
+        if not self.enabled:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return CacheWriter(self, key)
+
+    def put(self, key: str, data: bytes) -> None:
+        writer = self.writer(key)
+        if writer is None:
+            return
+        try:
+            writer.write(data)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.commit()
+
+    def stored(self, size: int) -> None:
+        self.bytes_stored += size
+        self.evict()
+
+    def evict(self) -> None:
+        # 總大小超過上限時，從最久沒有使用的項目開始刪除
+        entries = []
+        for path in self.directory.glob("*" + SUFFIX):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue  # 其他行程剛刪掉
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # 已經 mmap 的檔案刪掉後，映射仍然有效
+            path.unlink(missing_ok=True)
+            total -= size
+            self.evictions += 1
+
+    def size(self) -> int:
+        return sum(p.stat().st_size for p in self.directory.glob("*" + SUFFIX)) \
+            if self.directory.exists() else 0
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*" + SUFFIX):
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes_served": self.bytes_served,
+            "bytes_stored": self.bytes_stored,
+        }
+
+    def report(self) -> None:
+        stats = self.stats()
+        print(f"decode cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate'] * 100:.0f}% hit rate), {stats['evictions']} evicted, "
+              f"{stats['bytes_served'] / 1e6:.1f}MB served, "
+              f"{self.size() / 1e6:.1f}MB of {self.max_bytes / 1e6:.0f}MB used")
+
+# 預設的快取，audio_util 的解碼函式都使用這一個
+decode_cache = DecodeCache()
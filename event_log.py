@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import sys
+import json
+import time
+import queue
+import threading
+from collections import deque
+from typing import TextIO
+
+# 不會卡住事件迴圈的事件紀錄器：在事件迴圈中只把精簡的結構化紀錄放進佇列，
+# 由背景執行緒負責格式化並寫到終端機或檔案。可以針對個別事件類型抽樣
+# （例如每 50 個 response.audio.delta 只記錄 1 個）或限制每秒的筆數，並且
+# 一律保留最近 ring_size 筆紀錄，發生錯誤時可以用 dump() 全部倒出來
+#
+#   event_logger = EventLogger(sample_every={"response.audio.delta": 50})
+#   router.on_any(event_logger)
+class EventLogger:
+    def __init__(self, stream: TextIO = sys.stdout, json_lines: bool = False,
+                 sample_every: dict[str, int] | None = None,
+                 max_per_s: float | None = None, ring_size: int = 200):
+        self.stream = stream
+        self.json_lines = json_lines
+        # 事件類型 -> 每幾個記錄一次，0 表示完全不記錄
+        self.sample_every = sample_every or {}
+        self.max_per_s = max_per_s   # 每種事件類型每秒最多記錄的筆數
+        self.ring: deque[dict] = deque(maxlen=ring_size)
+        # 紀錄、dump() 等待寫完用的 Event，或是結束用的 None
+        self.queue: queue.SimpleQueue[dict | threading.Event | None] = queue.SimpleQueue()
+        # 寫出紀錄時持有，dump() 持有時背景執行緒就會暫停
+        self.lock = threading.Lock()
+        self.seen: dict[str, int] = {}
+        self.buckets: dict[str, tuple[float, float]] = {}  # 類型 -> (剩餘額度, 更新時間)
+        self.suppressed = 0   # 因為抽樣或限制而沒有寫出的筆數
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def __call__(self, event: dict, size: int = 0) -> None:
+        event_type = event.get("type", "")
+        item = event.get("item")
+        response = event.get("response")
+        record = {
+            "t": time.monotonic(),
+            "type": event_type,
+            "item_id": event.get("item_id") or (item.get("id") if isinstance(item, dict) else None),
+            "response_id": event.get("response_id") or (
+                response.get("id") if isinstance(response, dict) else None),
+            "size": size,
+        }
+        self.ring.append(record)
+        if self._should_log(event_type, record["t"]):
+            self.queue.put(record)
+        else:
+            self.suppressed += 1
+
+    def _should_log(self, event_type: str, now: float) -> bool:
+        n = self.seen.get(event_type, 0)
+        self.seen[event_type] = n + 1
+        every = self.sample_every.get(event_type, 1)
+        if every <= 0 or n % every:
+            return False
+        if self.max_per_s is None:
+            return True
+        # 以 token bucket 限制每秒筆數
+        tokens, last = self.buckets.get(event_type, (self.max_per_s, now))
+        tokens = min(self.max_per_s, tokens + (now - last) * self.max_per_s)
+        if tokens < 1:
+            self.buckets[event_type] = (tokens, now)
+            return False
+        self.buckets[event_type] = (tokens - 1, now)
+        return True
+
+    def format(self, record: dict) -> str:
+        if self.json_lines:
+            return json.dumps(record, ensure_ascii=False)
+        return (f'{record["t"]:.3f} {record["type"]} '
+                f'item={record["item_id"] or "-"} resp={record["response_id"] or "-"} '
+                f'{record["size"]}B')
+
+    def _writer(self) -> None:
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            if isinstance(record, threading.Event):
+                # 前面的紀錄都寫出了
+                record.set()
+                continue
+            with self.lock:
+                self.stream.write(self.format(record) + "\n")
+                if self.queue.empty():
+                    self.stream.flush()
+
+    def dump(self, stream: TextIO | None = None, timeout: float = 1.0) -> None:
+        """倒出最近的紀錄（包含被抽樣略過的），用來追查錯誤發生前的狀況
+
+        先等背景執行緒寫完佇列中的紀錄，倒出時暫停它，倒出的內容不會和
+        一般的紀錄交錯；預設和一般的紀錄寫到同一個 stream
+        """
+        stream = self.stream if stream is None else stream
+        if self.thread.is_alive():
+            drained = threading.Event()
+            self.queue.put(drained)
+            drained.wait(timeout)
+        with self.lock:
+            self.stream.flush()
+            stream.write(f"== last {len(self.ring)} events ==\n")
+            for record in list(self.ring):
+                stream.write(self.format(record) + "\n")
+            stream.flush()
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        self.stream.flush()
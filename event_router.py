@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import re
+import json
+import time
+import inspect
+from typing import Any, Callable
+
+# 以字典對應事件類型與處理函式，取代每個事件都要走過一長串 if 的寫法，
+# 同時統計各類型事件的數量與處理時間
+#
+#   router = EventRouter()
+#
+#   @router.on("response.audio_transcript.done")
+#   async def on_transcript_done(event):
+#       print(event.transcript)
+#
+#   # raw=True 的處理函式直接取得 JSON 解出的 dict，不必建構 pydantic 物件，
+#   # 適合每秒數十次的 response.audio.delta
+#   @router.on("response.audio.delta", raw=True)
+#   def on_audio_delta(event):
+#       audio_player.add_data(base64.b64decode(event["delta"]))
+#
+#   # 再加上 payload="delta"，event["delta"] 就是指向收到的訊息的 memoryview，
+#   # 佔了訊息大部分的 base64 字串不必經過 json 解碼成 str
+#   @router.on("response.audio.delta", raw=True, payload="delta")
+#   def on_audio_delta(event):
+#       audio_player.add_base64(event["delta"])
+#
+#   await router.run(connection)
+#
+# 處理函式可以是一般函式或 async 函式
+class Route:
+    def __init__(self, handler: Callable[[Any], Any], raw: bool):
+        self.handler = handler
+        self.raw = raw
+        self.is_async = inspect.iscoroutinefunction(handler)
+
+# 事件類型通常是訊息中的第一個欄位，只在開頭這麼多位元組中尋找
+_TYPE_WINDOW = 256
+
+def json_field(name: bytes, value: bytes = b"") -> re.Pattern:
+    # JSON 訊息中 "name":"value 的樣式，允許冒號前後有空白；
+    # 沒有指定 value 時，比對到字串值開頭的引號為止
+    return re.compile(b'"' + re.escape(name) + rb'"\s*:\s*"' + re.escape(value)
+                      + (b'"' if value else b""))
+
+class EventRouter:
+    def __init__(self):
+        self.routes: dict[str, Route] = {}
+        # (事件類型的樣式, 欄位的樣式, 欄位名稱)，見 add() 的 payload
+        self.payloads: list[tuple[re.Pattern, re.Pattern, str]] = []
+        self.observers: list[Callable[[dict, int], Any]] = []
+        self.counts: dict[str, int] = {}
+        self.times: dict[str, float] = {}  # 各類型事件處理函式花費的總秒數
+        self.stopped = False
+
+    def add(self, event_type: str, handler: Callable[[Any], Any], raw: bool = False,
+            payload: str | None = None) -> None:
+        # payload 是一個字串欄位的名稱（只適用於 raw=True），該欄位會以 memoryview
+        # 直接指向收到的訊息而不解碼，欄位的內容不能含有跳脫字元（例如 base64）
+        self.routes[event_type] = Route(handler, raw)
+        if payload is not None:
+            self.payloads.append((json_field(b"type", event_type.encode()),
+                                  json_field(payload.encode()), payload))
+
+    def on(self, *event_types: str, raw: bool = False, payload: str | None = None):
+        def decorator(handler):
+            for event_type in event_types:
+                self.add(event_type, handler, raw, payload)
+            return handler
+        return decorator
+
+    def on_any(self, observer: Callable[[dict, int], Any]) -> Callable[[dict, int], Any]:
+        # 每個事件都會以 dict 與原始訊息的長度傳給 observer，例如用來記錄事件
+        self.observers.append(observer)
+        return observer
+
+    def stop(self) -> None:
+        # 處理完目前的事件後就離開 run()
+        self.stopped = True
+
+    def _split_payload(self, data: bytes) -> dict | None:
+        # 把 payload 欄位的值換成空字串再解碼其餘的部分，欄位本身以 memoryview 取出
+        for type_pattern, field_pattern, field in self.payloads:
+            if type_pattern.search(data, 0, _TYPE_WINDOW) is None:
+                continue
+            match = field_pattern.search(data)
+            if match is None:
+                return None
+            start = match.end()
+            end = data.find(b'"', start)
+            if end < 0:
+                return None
+            event = json.loads(data[:start] + data[end:])
+            event[field] = memoryview(data)[start:end]
+            return event
+        return None
+
+    async def dispatch(self, connection, data: bytes | str) -> None:
+        event = None
+        if self.payloads and isinstance(data, bytes):
+            event = self._split_payload(data)
+        if event is None:
+            event = json.loads(data)
+        event_type = event.get("type", "")
+        self.counts[event_type] = self.counts.get(event_type, 0) + 1
+        for observer in self.observers:
+            observer(event, len(data))
+        route = self.routes.get(event_type)
+        if route is None:
+            return
+        start = time.perf_counter()
+        arg = event if route.raw else connection.parse_event(data)
+        if route.is_async:
+            await route.handler(arg)
+        else:
+            route.handler(arg)
+        self.times[event_type] = self.times.get(event_type, 0.0) + time.perf_counter() - start
+
+    async def run(self, connection) -> None:
+        from websockets.exceptions import ConnectionClosedOK
+
+        self.stopped = False
+        try:
+            while not self.stopped:
+                await self.dispatch(connection, await connection.recv_bytes())
+        except ConnectionClosedOK:
+            return
+
+    def stats(self) -> list[tuple[str, int, float]]:
+        # (事件類型, 數量, 處理函式的總毫秒數)，依數量排序
+        return sorted(
+            ((t, n, self.times.get(t, 0.0) * 1000) for t, n in self.counts.items()),
+            key=lambda row: row[1], reverse=True,
+        )
+
+    def report(self) -> None:
+        print("== events ==")
+        for event_type, count, ms in self.stats():
+            print(f"{event_type:<55} {count:7d} {ms:9.1f}ms")
+
+def print_event(event: dict, size: int = 0) -> None:
+    # 印出事件類型與相關的項目 id
+    item = event.get("item")
+    print(f'{event["type"]}:id('
+          f'{item.get("id", "") if isinstance(item, dict) else ""}'
+          f'{event.get("item_id", "")})')
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import os
+
+import numpy as np
+
+# Realtime API 支援的音訊格式 -> (取樣率, 每個樣本的位元組數)
+# G.711 是 8kHz、每個樣本 1 個位元組，資料量只有 24kHz pcm16 的 1/6
+FORMATS = {
+    "pcm16": (24000, 2),
+    "g711_ulaw": (8000, 1),
+    "g711_alaw": (8000, 1),
+}
+
+# 設定 AUDIO_FORMAT 環境變數（例如 g711_ulaw）就會以該格式收送音訊
+AUDIO_FORMAT = os.environ.get("AUDIO_FORMAT", "pcm16")
+
+# 以下依照 ITU-T G.711 的參考實作，一次算出所有可能的值做成查表，
+# 編碼以 int16 的 65536 種值為索引，解碼以 256 種位元組為索引
+
+def _ulaw_encode_table() -> np.ndarray:
+    pcm = np.arange(-32768, 32768, dtype=np.int32) >> 2  # 14 位元
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), 8159) + 0x21
+    # 區段是 magnitude 超過 0x3F、0x7F、0xFF...的個數
+    segment = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]),
+                              magnitude, side="left")
+    ulaw = (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F)
+    ulaw = np.where(segment >= 8, 0x7F, ulaw)
+    return (ulaw ^ mask).astype(np.uint8)
+
+def _ulaw_decode_table() -> np.ndarray:
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    t = (((u & 0x0F) << 3) + 0x84) << ((u & 0x70) >> 4)
+    return np.where(u & 0x80, 0x84 - t, t - 0x84).astype(np.int16)
+
+def _alaw_encode_table() -> np.ndarray:
+    pcm = np.arange(-32768, 32768, dtype=np.int32) >> 3  # 13 位元
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    magnitude = np.where(pcm >= 0, pcm, -pcm - 1)
+    segment = np.searchsorted(np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF]),
+                              magnitude, side="left")
+    shift = np.where(segment < 2, 1, segment)
+    alaw = (segment << 4) | ((magnitude >> shift) & 0x0F)
+    alaw = np.where(segment >= 8, 0x7F, alaw)
+    return (alaw ^ mask).astype(np.uint8)
+
+def _alaw_decode_table() -> np.ndarray:
+    a = np.arange(256, dtype=np.int32) ^ 0x55
+    segment = (a & 0x70) >> 4
+    t = (a & 0x0F) << 4
+    t = np.where(segment == 0, t + 8, (t + 0x108) << np.maximum(segment - 1, 0))
+    return np.where(a & 0x80, t, -t).astype(np.int16)
+
+_ENCODE = {"g711_ulaw": _ulaw_encode_table(), "g711_alaw": _alaw_encode_table()}
+_DECODE = {"g711_ulaw": _ulaw_decode_table(), "g711_alaw": _alaw_decode_table()}
+
+def encode(pcm: np.ndarray, audio_format: str) -> np.ndarray:
+    """把 int16 陣列（已經是該格式的取樣率）編碼，pcm16 原樣傳回"""
+    if audio_format == "pcm16":
+        return pcm
+    # int16 視為 uint16 後加上 32768 就是查表的索引
+    index = pcm.view(np.uint16) ^ 0x8000
+    return _ENCODE[audio_format][index]
+
+def decode(data: bytes, audio_format: str, out: np.ndarray | None = None) -> np.ndarray:
+    """把收到的音訊資料解碼成 int16 陣列（取樣率不變）
+
+    G.711 格式可以指定 out，解碼結果寫到 out 的開頭而不配置新的陣列
+    """
+    if audio_format == "pcm16":
+        return np.frombuffer(data, dtype=np.int16)
+    data = np.frombuffer(data, dtype=np.uint8)
+    if out is None:
+        return _DECODE[audio_format][data]
+    return np.take(_DECODE[audio_format], data, out=out[:len(data)])
@@ -0,0 +1,142 @@
+# 量測每一輪對話從使用者講完話到喇叭發出聲音的延遲
+#
+#   tracer = LatencyTracer()
+#   tracer.speech_stopped()            # input_audio_buffer.speech_stopped 或手動 commit
+#   tracer.response_created(resp_id)   # response.created
+#   tracer.audio_delta(item_id, audio_player)  # response.audio.delta
+#   ...
+#   audio_player.flush(tracer.barge_in())  # 使用者插話，量測到完全靜音的時間
+#   tracer.report()                    # 結束時印出各階段延遲的統計
+from __future__ import annotations
+
+import time
+from typing import Callable
+
+# 各階段相對於使用者講完話的延遲，依照發生順序排列
+STAGES = ("response_created", "first_delta", "first_audible")
+
+def percentile(values: list[float], p: float) -> float:
+    # 採用 nearest-rank 的方式計算百分位數
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+class TurnSpan:
+    """一輪對話各階段的時間點（time.monotonic() 的秒數）"""
+
+    def __init__(self, turn: int, speech_end: float):
+        self.turn = turn
+        self.speech_end = speech_end
+        self.response_id: str | None = None
+        self.item_id: str | None = None
+        self.response_created: float | None = None
+        self.first_delta: float | None = None
+        self.first_audible: float | None = None
+
+    def latency_ms(self, stage: str) -> float | None:
+        t = getattr(self, stage)
+        return None if t is None else (t - self.speech_end) * 1000
+
+    def __str__(self) -> str:
+        parts = [f"turn {self.turn}"]
+        for stage in STAGES:
+            ms = self.latency_ms(stage)
+            parts.append(f"{stage}=" + ("-" if ms is None else f"{ms:.0f}ms"))
+        if self.first_delta is not None and self.first_audible is not None:
+            parts.append(f"playback={(self.first_audible - self.first_delta) * 1000:.0f}ms")
+        return " ".join(parts)
+
+class LatencyTracer:
+    def __init__(self, on_span: Callable[[TurnSpan], None] | None = print):
+        self.on_span = on_span
+        self.spans: list[TurnSpan] = []
+        self.current: TurnSpan | None = None
+        self.barge_ins: list[float] = []  # 插話到靜音的毫秒數
+
+    def speech_stopped(self) -> None:
+        # 使用者講完話（伺服端 VAD 判斷或是手動 commit），開始新的一輪
+        self.finish()
+        self.current = TurnSpan(len(self.spans) + 1, time.monotonic())
+
+    def response_created(self, response_id: str | None) -> None:
+        span = self.current
+        if span is not None and span.response_created is None:
+            span.response_created = time.monotonic()
+            span.response_id = response_id
+
+    def audio_delta(self, item_id: str, audio_player=None) -> None:
+        span = self.current
+        if span is None or span.first_delta is not None:
+            return
+        span.first_delta = time.monotonic()
+        span.item_id = item_id
+        if audio_player is not None:
+            # 讓播放端在送出第一個有聲音的樣本時回報時間
+            def first_audible(t: float) -> None:
+                span.first_audible = t
+            audio_player.watch_first_audio(first_audible)
+
+    def barge_in(self) -> Callable[[float], None]:
+        # 傳回給 AudioPlayerAsync.flush() 的 on_silent，記錄從現在到靜音的時間
+        start = time.monotonic()
+        def silent(t: float) -> None:
+            self.barge_ins.append((t - start) * 1000)
+        return silent
+
+    def finish(self) -> None:
+        # 結束目前這一輪並送出紀錄
+        span, self.current = self.current, None
+        if span is None:
+            return
+        self.spans.append(span)
+        if self.on_span:
+            self.on_span(span)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        result = {}
+        for stage in STAGES:
+            values = [ms for span in self.spans
+                      if (ms := span.latency_ms(stage)) is not None]
+            if values:
+                result[stage] = {
+                    "count": len(values),
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                    "max": max(values),
+                }
+        return result
+
+    def histogram(self, stage: str, bucket_ms: int = 100, width: int = 40) -> str:
+        values = [ms for span in self.spans
+                  if (ms := span.latency_ms(stage)) is not None]
+        if not values:
+            return ""
+        counts: dict[int, int] = {}
+        for ms in values:
+            bucket = int(ms // bucket_ms)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        peak = max(counts.values())
+        lines = []
+        for bucket in range(min(counts), max(counts) + 1):
+            n = counts.get(bucket, 0)
+            bar = "#" * (n * width // peak)
+            lines.append(f"{bucket * bucket_ms:6d}ms {n:5d} {bar}")
+        return "\n".join(lines)
+
+    def report(self) -> None:
+        self.finish()
+        print(f"== latency over {len(self.spans)} turns ==")
+        for stage, stats in self.summary().items():
+            print(f"{stage:<17} n={stats['count']:<4} "
+                  f"p50={stats['p50']:.0f}ms p95={stats['p95']:.0f}ms "
+                  f"p99={stats['p99']:.0f}ms max={stats['max']:.0f}ms")
+        if self.barge_ins:
+            values = list(self.barge_ins)
+            print(f"{'barge_in':<17} n={len(values):<4} "
+                  f"p50={percentile(values, 50):.0f}ms p95={percentile(values, 95):.0f}ms "
+                  f"p99={percentile(values, 99):.0f}ms max={max(values):.0f}ms")
+        histogram = self.histogram("first_audible")
+        if histogram:
+            print("first_audible histogram:")
+            print(histogram)
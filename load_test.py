@@ -0,0 +1,94 @@
+# 對本機的模擬伺服器同時開啟大量交談階段，量測單一行程可以承受多少使用者：
+#
+#   python realtime_stub_server.py --port 8765
+#   REALTIME_BASE_URL=ws://localhost:8765/v1 python load_test.py --sessions 200 --duration 30
+#
+# 每個交談階段都以即時的速度送出音訊（預設是講 1 秒、停 1.5 秒的合成語音，
+# 也可以用 --audio 指定音訊檔），由伺服端 VAD 判斷段落並回應，結束時印出
+# 每秒訊息數、每個交談階段佔用的 CPU 與事件迴圈的延遲
+from __future__ import annotations
+
+import time
+import random
+import asyncio
+import argparse
+
+import numpy as np
+
+import g711
+from g711 import AUDIO_FORMAT
+from resample import SAMPLE_RATE
+from realtime_util import REALTIME_BASE_URL, create_client
+from session_runtime import RealtimeSession, SessionRuntime
+
+FRAME_S = 0.02  # 每次送出的音訊長度，與麥克風的音訊塊相同
+
+def synthetic_audio(talk_s: float = 1.0, pause_s: float = 1.5) -> np.ndarray:
+    # 講 talk_s 秒（帶有音節起伏的諧波）再停 pause_s 秒
+    k = np.arange(int(talk_s * SAMPLE_RATE)) / SAMPLE_RATE
+    voice = sum(np.sin(2 * np.pi * f * k) / i for i, f in enumerate((140, 280, 420), 1))
+    talk = 4000 * np.abs(np.sin(np.pi * k / talk_s)) * voice
+    pause = np.zeros(int(pause_s * SAMPLE_RATE))
+    return np.concatenate((talk, pause)).astype(np.int16)
+
+def file_audio(path: str, pause_s: float = 1.5) -> np.ndarray:
+    from audio_util import iter_pcm16_chunks
+
+    pcm = np.frombuffer(b"".join(iter_pcm16_chunks(path, 5.0)), dtype=np.int16)
+    # 後面補一段靜音，伺服端 VAD 才會判斷講完話
+    return np.concatenate((pcm, np.zeros(int(pause_s * SAMPLE_RATE), dtype=np.int16)))
+
+async def feed_loop(sessions: list[RealtimeSession], audio: np.ndarray,
+                    deadline: float) -> None:
+    # 以一個工作每 20ms 替所有交談階段送出一塊音訊，而不是每個交談階段各自計時
+    frame = int(FRAME_S * SAMPLE_RATE)
+    frames = [audio[i:i + frame].tobytes() for i in range(0, len(audio) - frame + 1, frame)]
+    # 每個交談階段從不同的位置開始，避免所有人同時講話
+    offsets = [random.randrange(len(frames)) for _ in sessions]
+    tick = 0
+    start = time.monotonic()
+    while time.monotonic() < deadline:
+        for session, offset in zip(sessions, offsets):
+            if session.manager.connected.is_set():
+                session.feed(frames[(offset + tick) % len(frames)])
+        tick += 1
+        # 依照開始的時間計算下一次，不會因為處理時間而越來越慢
+        await asyncio.sleep(max(0.0, start + tick * FRAME_S - time.monotonic()))
+
+async def run_load(args) -> None:
+    audio = file_audio(args.audio) if args.audio else synthetic_audio()
+    runtime = SessionRuntime(create_client())
+    sessions = []
+    deadline = time.monotonic() + args.duration
+    for i in range(args.sessions):
+        sessions.append(runtime.add(RealtimeSession(
+            session={"modalities": ["audio", "text"]}, replay=False,
+            packet_ms=args.packet_ms, audio_format=args.audio_format,
+        )))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.sessions)
+    await feed_loop(sessions, audio, deadline)
+    stats = runtime.stats()
+    await runtime.close()
+    runtime.report(stats)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Realtime API 多交談階段的負載測試")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30.0, help="測試的秒數")
+    parser.add_argument("--ramp", type=float, default=2.0,
+                        help="在幾秒內陸續開啟所有交談階段")
+    parser.add_argument("--packet-ms", type=float, default=60,
+                        help="每個 input_audio_buffer.append 的音訊長度")
+    parser.add_argument("--audio", default=None,
+                        help="要送出的音訊檔（例如 chinese.mp3），未指定就用合成的語音")
+    parser.add_argument("--audio-format", default=AUDIO_FORMAT, choices=list(g711.FORMATS),
+                        help="收送音訊的格式")
+    args = parser.parse_args()
+    if not REALTIME_BASE_URL:
+        # 避免不小心對正式的 API 開啟數百個交談階段
+        parser.error("請設定 REALTIME_BASE_URL 指向本機的模擬伺服器")
+    asyncio.run(run_load(args))
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,22 @@
 from __future__ import annotations
 
-import base64
 import asyncio
 from typing import Any, cast
 from typing_extensions import override
 
 from textual import events
-from audio_util import CHANNELS, SAMPLE_RATE, AudioPlayerAsync
+from audio_util import CHANNELS, SAMPLE_RATE, AudioPlayerAsync, MicCapture
+from audio_sender import AudioSender
+from event_router import EventRouter
+from latency_trace import LatencyTracer
 from textual.app import App, ComposeResult
 from textual.widgets import Button, Static, RichLog
 from textual.reactive import reactive
-from textual.containers import Container
+from textual.containers import Container, Vertical
+from rich.text import Text
 
 from openai import AsyncOpenAI
+from realtime_util import create_client, audio_format_session
 from openai.types.beta.realtime.session import Session
 from openai.resources.beta.realtime.realtime import AsyncRealtimeConnection
 
@@ -42,6 +46,74 @@ class AudioStatusIndicator(Static):
         return status
 
 
+class TranscriptView(Vertical):
+    """A transcript pane that appends streamed deltas and repaints at a capped rate."""
+
+    DEFAULT_CSS = """
+        TranscriptView RichLog {
+            height: 1fr;
+        }
+
+        TranscriptView Static {
+            height: auto;
+        }
+    """
+
+    def __init__(self, refresh_hz: float = 30, max_lines: int = 1000, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.refresh_hz = refresh_hz
+        # 還在串流中的回應內容，送完或回應結束後就移除，不會隨著交談越來越大
+        self.acc_items: dict[str, str] = {}
+        self.item_responses: dict[str, str] = {}  # 串流中的項目屬於哪一個回應
+        # 串流中所有項目串起來的文字，通常只要接上新的片段，不必每次重新串接
+        self.live_text = ""
+        self.dirty = False
+        # 歷史紀錄只保留最後 max_lines 行
+        self.history = RichLog(wrap=True, highlight=True, markup=False, max_lines=max_lines)
+        self.live = Static("")
+
+    @override
+    def compose(self) -> ComposeResult:
+        # 已經送完的回應只寫入 RichLog 一次，串流中的回應顯示在下方
+        yield self.history
+        yield self.live
+
+    def on_mount(self) -> None:
+        self.set_interval(1 / self.refresh_hz, self.flush)
+
+    def append(self, item_id: str, delta: str, response_id: str | None = None) -> None:
+        # 只記下新的片段，等下次 flush 時才更新畫面
+        text = self.acc_items.get(item_id)
+        self.acc_items[item_id] = delta if text is None else text + delta
+        if response_id is not None:
+            self.item_responses[item_id] = response_id
+        if item_id == next(reversed(self.acc_items)):
+            self.live_text += delta
+        else:
+            # 片段屬於前面的項目，位置在中間，只好重新串接
+            self.live_text = "".join(self.acc_items.values())
+        self.dirty = True
+
+    def finish(self, item_id: str, transcript: str | None = None) -> None:
+        text = self.acc_items.pop(item_id, "")
+        self.item_responses.pop(item_id, None)
+        self.history.write(Text(transcript if transcript is not None else text))
+        self.live_text = "".join(self.acc_items.values())
+        self.dirty = True
+        self.flush()
+
+    def end_response(self, response_id: str) -> None:
+        # 回應結束（包含被取消）時還沒有收到 done 的項目，把收到的部分移到歷史紀錄
+        for item_id in [i for i, r in self.item_responses.items() if r == response_id]:
+            self.finish(item_id)
+
+    def flush(self) -> None:
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.live.update(Text(self.live_text))
+
+
 class RealtimeApp(App[None]):
     CSS = """
         Screen {
@@ -103,28 +175,49 @@ class RealtimeApp(App[None]):
     client: AsyncOpenAI
     should_send_audio: asyncio.Event
     audio_player: AudioPlayerAsync
+    audio_sender: AudioSender
     last_audio_item_id: str | None
     connection: AsyncRealtimeConnection | None
     session: Session | None
     connected: asyncio.Event
+    tracer: LatencyTracer
+    router: EventRouter
+    transcript_view: TranscriptView
+    session_display: SessionDisplay
 
     def __init__(self) -> None:
         super().__init__()
         self.connection = None
         self.session = None
-        self.client = AsyncOpenAI()
+        self.client = create_client()
         self.audio_player = AudioPlayerAsync()
+        self.audio_sender = AudioSender()
         self.last_audio_item_id = None
         self.should_send_audio = asyncio.Event()
         self.connected = asyncio.Event()
+        # 在 Textual 畫面中不逐輪印出，結束後再印出統計
+        self.tracer = LatencyTracer(on_span=None)
+        # 以事件類型對應處理函式
+        self.router = EventRouter()
+        self.router.add("session.created", self.on_session_created)
+        self.router.add("session.updated", self.on_session_updated)
+        self.router.add("input_audio_buffer.speech_stopped", self.on_speech_stopped)
+        self.router.add("response.created", self.on_response_created)
+        self.router.add("response.audio.delta", self.on_audio_delta, raw=True, payload="delta")
+        self.router.add("response.audio_transcript.delta", self.on_transcript_delta, raw=True)
+        self.router.add("response.audio_transcript.done", self.on_transcript_done)
+        self.router.add("response.done", self.on_response_done, raw=True)
 
     @override
     def compose(self) -> ComposeResult:
         """Create child widgets for the app."""
+        # 直接保留元件的參考，不必每個事件都用 query_one 尋找
+        self.session_display = SessionDisplay(id="session-display")
+        self.transcript_view = TranscriptView(id="bottom-pane")
         with Container():
-            yield SessionDisplay(id="session-display")
+            yield self.session_display
             yield AudioStatusIndicator(id="status-indicator")
-            yield RichLog(id="bottom-pane", wrap=True, highlight=True, markup=True)
+            yield self.transcript_view
 
     async def on_mount(self) -> None:
         self.run_worker(self.handle_realtime_connection())
@@ -141,6 +234,7 @@ class RealtimeApp(App[None]):
             # if you want to manually handle VAD yourself, then set `'turn_detection': None`
             await conn.session.update(
                 session={
+                    **audio_format_session(),
                     # "turn_detection": {"type": "server_vad"},
                     "turn_detection": None,
                     # 雖然 input_audio_transcription 的所有參數都是 optional，
@@ -150,50 +244,51 @@ class RealtimeApp(App[None]):
                 }
             )
 
-            acc_items: dict[str, Any] = {}
+            await self.router.run(conn)
 
-            async for event in conn:
-                if event.type == "session.created":
-                    self.session = event.session
-                    session_display = self.query_one(SessionDisplay)
-                    assert event.session.id is not None
-                    session_display.session_id = event.session.id
-                    continue
+    def on_session_created(self, event: Any) -> None:
+        self.session = event.session
+        assert event.session.id is not None
+        self.session_display.session_id = event.session.id
 
-                if event.type == "session.updated":
-                    self.session = event.session
-                    continue
+    def on_session_updated(self, event: Any) -> None:
+        self.session = event.session
 
-                if event.type == "response.audio.delta":
-                    if event.item_id != self.last_audio_item_id:
-                        self.audio_player.reset_frame_count()
-                        self.last_audio_item_id = event.item_id
+    def on_speech_stopped(self, event: Any) -> None:
+        self.tracer.speech_stopped()
 
-                    bytes_data = base64.b64decode(event.delta)
-                    self.audio_player.add_data(bytes_data)
-                    continue
+    def on_response_created(self, event: Any) -> None:
+        self.tracer.response_created(event.response.id)
 
-                # 回應內容是用串流方式一段一段送回來    
-                if event.type == "response.audio_transcript.delta":
-                    try:
-                        text = acc_items[event.item_id]
-                    except KeyError:
-                        acc_items[event.item_id] = event.delta
-                    else:
-                        acc_items[event.item_id] = text + event.delta
-                    
-                    # 清除顯示區域重新顯示累加的回應內容才能呈現串流的效果
-                    bottom_pane = self.query_one("#bottom-pane", RichLog)
-                    bottom_pane.clear()
-                    bottom_pane.write(acc_items[event.item_id])
-                    continue
+    # 最頻繁的事件，直接使用 dict 不必建構 pydantic 物件
+    def on_audio_delta(self, event: dict[str, Any]) -> None:
+        item_id = event["item_id"]
+        self.tracer.audio_delta(item_id, self.audio_player)
+        if item_id != self.last_audio_item_id:
+            self.audio_player.reset_frame_count()
+            self.last_audio_item_id = item_id
+
+        self.audio_player.add_base64(event["delta"])
+
+    # 回應內容是用串流方式一段一段送回來，只附加新的片段，
+    # 畫面則是以固定的頻率更新，不必每個片段都重畫整段文字
+    def on_transcript_delta(self, event: dict[str, Any]) -> None:
+        self.transcript_view.append(event["item_id"], event["delta"], event.get("response_id"))
+
+    # 回應內容送完了，移到歷史紀錄中
+    def on_transcript_done(self, event: Any) -> None:
+        self.transcript_view.finish(event.item_id, event.transcript)
+
+    # 被取消的回應不會有 response.audio_transcript.done，在這裡收尾
+    def on_response_done(self, event: dict[str, Any]) -> None:
+        self.transcript_view.end_response(event["response"]["id"])
+        self.audio_player.end_response()
+
+    # conversation.item.input_audio_transcription.completed 事件必須搭配建立連線時
+    # 設定的 input_audio_transcription 參數，不過一點都不實用，因為 realtime api
+    # 是直接吃音訊資料，這裡的文字是透過 whisper-1 轉換的，跟 realtime api 對
+    # 音訊資料的轉譯結果未必相同，所以沒有登記處理函式
 
-                # 這個事件必須搭配建立連線時設定的 input_audio_transcription 參數
-                # 不過一點都不實用，因為 realtime api 是直接吃音訊資料，這裡的文字是
-                # 透過 whisper-1 轉換的，跟 realtime api 對音訊資料的轉譯結果未必相同
-                if event.type == "conversation.item.input_audio_transcription.completed":
-                    pass
-                
     async def _get_connection(self) -> AsyncRealtimeConnection:
         await self.connected.wait()
         assert self.connection is not None
@@ -207,30 +302,24 @@ class RealtimeApp(App[None]):
         device_info = sd.query_devices()
         print(device_info)
 
-        read_size = int(SAMPLE_RATE * 0.02)
+        # 由 audio_sender 把音訊合併成較大的封包再送出
+        connection = await self._get_connection()
+        self.run_worker(self.audio_sender.run(connection))
 
-        stream = sd.InputStream(
-            channels=CHANNELS,
-            samplerate=SAMPLE_RATE,
-            dtype="int16",
-        )
-        stream.start()
+        mic = MicCapture()
+        mic.start()
 
         status_indicator = self.query_one(AudioStatusIndicator)
 
         try:
             while True:
-                # 先累機基本的音訊資料
-                if stream.read_available < read_size:
-                    await asyncio.sleep(0)
-                    continue
+                # 有音訊資料時才會被喚醒，不必不斷檢查是否累積了足夠的資料
+                data = await mic.read()
 
-                # 等待按下 K 鍵才開始傳送音訊資料
-                await self.should_send_audio.wait()
-
-                data, _ = stream.read(read_size)
+                # 按下 K 鍵才開始傳送音訊資料，在那之前擷取到的就丟掉
+                if not self.should_send_audio.is_set():
+                    continue
 
-                connection = await self._get_connection()
                 # 以下這一段我看不出來有什麼實質作用？
                 # if not sent_audio:
                 #     asyncio.create_task(connection.send({"type": "response.cancel"}))
@@ -239,16 +328,11 @@ class RealtimeApp(App[None]):
                 # 傳送音訊資料給伺服端，伺服端會自動判斷段落就回應
                 # 所以按下 K 鍵後可以持續講話，伺服器會在適當地方自動回應
                 # 不需要手動按 K 停止錄製音訊
-                await connection.input_audio_buffer.append(
-                    audio=base64.b64encode(cast(Any, data)).decode("utf-8")
-                )
-
-                await asyncio.sleep(0)
+                self.audio_sender.feed(data)
         except KeyboardInterrupt:
             pass
         finally:
-            stream.stop()
-            stream.close()
+            mic.stop()
 
     async def on_key(self, event: events.Key) -> None:
         """Handle key press events."""
@@ -266,11 +350,15 @@ class RealtimeApp(App[None]):
             if status_indicator.is_recording:
                 self.should_send_audio.clear()
                 status_indicator.is_recording = False
+                # 還在排隊的音訊是這一段話的結尾，不論有沒有開啟 VAD 都要現在送出，
+                # 不要留到下次錄音時接在新的一段話前面
+                await self.audio_sender.end_turn(self.connection)
 
                 # 本例是不斷傳送音訊給伺服端，由伺服端自動判斷使用者是不是說完一個段落，這稱為 VAD
                 # 如果前面有把 VAD 關閉，這邊就要在第二次按 K 鍵時主動提交音訊資料，伺服器才會處理
                 if self.session and self.session.turn_detection is None:
                     conn = await self._get_connection()
+                    self.tracer.speech_stopped()
                     await conn.input_audio_buffer.commit()
                     await conn.response.create()
             else:
@@ -281,3 +369,6 @@ class RealtimeApp(App[None]):
 if __name__ == "__main__":
     app = RealtimeApp()
     app.run()
+    app.tracer.report()
+    app.router.report()
+    app.audio_player.report()
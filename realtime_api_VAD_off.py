@@ -1,115 +1,190 @@
 from __future__ import annotations
 
-import base64
 import asyncio
 from typing import Any, cast
 from typing_extensions import override
 
-from audio_util import CHANNELS, SAMPLE_RATE, AudioPlayerAsync
+from audio_util import CHANNELS, SAMPLE_RATE, AudioPlayerAsync, MicCapture
 
 from openai import AsyncOpenAI
+from realtime_util import create_client, audio_format_session
 from openai.types.beta.realtime.session import Session
 from openai.resources.beta.realtime.realtime import AsyncRealtimeConnection
 
 from getchar import getkeys
 
+from audio_sender import AudioSender
+from event_log import EventLogger
+from event_router import EventRouter
+from connection_manager import ConnectionManager
+from latency_trace import LatencyTracer
+from vad_gate import CLIENT_VAD, CLIENT_VAD_DUCK, VadGate
+
 connection: AsyncRealtimeConnection | None = None
 audio_player: AudioPlayerAsync = AudioPlayerAsync()
+audio_sender: AudioSender = AudioSender()
 should_send_audio: asyncio.Event = asyncio.Event()
 connected: asyncio.Event = asyncio.Event()
+tracer: LatencyTracer = LatencyTracer()
+# 在本機判斷講話的段落，只送出講話的部分，講完話就自動提交
+vad_gate: VadGate | None = VadGate() if CLIENT_VAD else None
+
+session: Session | None = None
+# 還在生成的回應，有新的一段話時要先取消
+response_id: str | None = None
+# 沒有進行中的回應時設定，伺服端同時只能有一個回應
+response_idle: asyncio.Event = asyncio.Event()
+response_idle.set()
+# 取消回應後最多等多久 response.done
+CANCEL_TIMEOUT_S = 2.0
+
+# 以事件類型對應處理函式
+router: EventRouter = EventRouter()
+# 在背景執行緒記錄事件，頻繁的片段事件只抽樣記錄
+event_logger: EventLogger = EventLogger(
+    sample_every={
+        "response.audio.delta": 50,
+        "response.audio_transcript.delta": 20,
+        "response.function_call_arguments.delta": 20,
+    },
+    max_per_s=20,
+)
+router.on_any(event_logger)
+
+# 斷線時自動重新連線，重新套用 session 設定並重建對話
+manager: ConnectionManager = ConnectionManager(
+    router,
+    # 建立交談階段後還可以修改設定
+    session={"turn_detection": None, **audio_format_session()},
+    # 可以透過 extra_query 傳遞額外的引數
+    extra_query={"voice": "alloy"},
+)
+sender_task: asyncio.Task | None = None
+
+@manager.on_connect
+def on_connect(conn) -> None:
+    global connection, sender_task, response_id
+    connection = conn
+    # 斷線時還在生成的回應已經不存在了
+    response_id = None
+    response_idle.set()
+    # 每次連線（包含重新連線）都以新的連線重新啟動傳送音訊的工作，
+    # 斷線期間排隊的音訊會在這時送出；舊連線的工作要先停掉，
+    # 否則兩個工作會同時從 audio_sender 的佇列取出音訊
+    if sender_task is not None:
+        sender_task.cancel()
+    sender_task = asyncio.create_task(audio_sender.run(conn))
+
+@router.on("session.created", "session.updated")
+def on_session(event) -> None:
+    global session
+    session = event.session
+    connected.set()
+
+# 回應內容的語音也是一段一段送來，直接使用 dict 不必建構 pydantic 物件，
+# base64 的語音資料以 memoryview 取得後直接解碼進播放端的緩衝區
+@router.on("response.audio.delta", raw=True, payload="delta")
+def on_audio_delta(event: dict) -> None:
+    tracer.audio_delta(event["item_id"], audio_player)
+    audio_player.add_base64(event["delta"])
+
+@router.on("response.created")
+def on_response_created(event) -> None:
+    global response_id
+    response_id = event.response.id
+    response_idle.clear()
+    tracer.response_created(event.response.id)
+
+@router.on("response.done")
+def on_response_done(event) -> None:
+    global response_id
+    response_id = None
+    audio_player.end_response()
+    response_idle.set()
+
+# 回應內容的文字是用串流方式一段一段送回來，不需要處理
+# 當回應內容的文字送完了，就印出來
+@router.on("response.audio_transcript.done")
+def on_transcript_done(event) -> None:
+    print(event.transcript)
+
+@router.on("error")
+def on_error(event) -> None:
+    print(event.error.message)
+    # 印出錯誤發生前的事件
+    event_logger.dump()
 
 async def handle_realtime_connection() -> None:
-    global connection
-    session: Session | None = None
-
-    client: AsyncOpenAI = AsyncOpenAI()
-
-    async with client.beta.realtime.connect(
-        model="gpt-4o-realtime-preview",
-        # 可以透過 extra_query 傳遞額外的引數
-        extra_query = {"voice": "alloy"},
-    ) as conn:
-        connection = conn
-        # 建立交談階段後還可以修改設定
-        await conn.session.update(
-            session={"turn_detection": None}
-        )
+    client: AsyncOpenAI = create_client()
 
+    try:
+        await manager.run(client)
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        event_logger.dump()
+        raise
+
+async def commit_turn() -> None:
+    # 由於關閉 VAD，所以要手動提交語音並且指示伺服端生成回應
+    # 提交前先把還在排隊的音訊送出
+    await audio_sender.flush(connection)
+    tracer.speech_stopped()
+    await connection.input_audio_buffer.commit()
+    if response_id is not None:
+        # 用戶端 VAD 可能在上一個回應還沒生成完時就提交新的一段話，
+        # 和插話一樣先取消，等到 response.done 再要求新的回應，否則會收到
+        # conversation_already_has_active_response 錯誤
+        await connection.response.cancel(response_id=response_id)
         try:
-            async for event in conn:
-                print(f'{event.type}:id('
-                      f'{event.item.id if hasattr(event, "item") else ""}'
-                      f'{event.item_id if hasattr(event, "item_id") else ""})')
-                if event.type == "session.created":
-                    session = event.session
-                    connected.set()
-                    continue
-
-                if event.type == "session.updated":
-                    session = event.session
-                    continue
-
-                # 回應內容的語音也是一段一段送來
-                if event.type == "response.audio.delta":
-                    bytes_data = base64.b64decode(event.delta)
-                    audio_player.add_data(bytes_data)
-                    continue
-                                
-                # 回應內容的文字是用串流方式一段一段送回來
-                if event.type == "response.audio_transcript.delta":
-                    continue
-                
-                # 當回應內容的文字送完了，就印出來
-                if event.type == "response.audio_transcript.done":
-                    print(event.transcript)
-                    continue
-
-                if event.type == "error":
-                    print(event.error.message)
-                    continue
-
-        except asyncio.CancelledError:
-            pass
+            await asyncio.wait_for(response_idle.wait(), CANCEL_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            print("previous response did not finish after cancel")
+    await connection.response.create()
 
 async def send_mic_audio() -> None:
     global connection
-    import sounddevice as sd  # type: ignore
 
-    sent_audio = False
-
-    read_size = int(SAMPLE_RATE * 0.02)
+    # 連線之後才開始擷取音訊，並由 audio_sender 合併成較大的封包送出
+    await connected.wait()
 
-    stream = sd.InputStream(
-        channels=CHANNELS,
-        samplerate=SAMPLE_RATE,
-        dtype="int16",
-    )
-    stream.start()
+    mic = MicCapture()
+    mic.start()
 
     try:
         while True:
-            # 先累積基本的音訊資料
-            if stream.read_available < read_size:
-                await asyncio.sleep(0)
-                continue
-
-            # 等待按下 K 鍵才開始傳送音訊資料
-            await should_send_audio.wait()
+            # 有音訊資料時才會被喚醒
+            data = await mic.read()
 
-            data, _ = stream.read(read_size)
+            # 還沒按下 K 鍵前擷取到的音訊直接丟掉
+            if not should_send_audio.is_set():
+                continue
 
             # 傳送音訊資料給伺服端
-            await connection.input_audio_buffer.append(
-                audio=base64.b64encode(cast(Any, data)).decode("utf-8")
-            )
-            await asyncio.sleep(0)
+            if vad_gate is None:
+                audio_sender.feed(data)
+                continue
+            # 回覆的語音還在播放時不判斷，以免把喇叭的聲音當成使用者講話
+            if CLIENT_VAD_DUCK and audio_player.is_playing():
+                continue
+            frames, ended = vad_gate.process(data)
+            for frame in frames:
+                audio_sender.feed(frame)
+            if ended:
+                # 講完話就自動提交，不必等放開 K 鍵
+                await commit_turn()
     except KeyboardInterrupt:
         pass
     except asyncio.CancelledError:
         pass
     finally:
-        stream.stop()
-        stream.close()
+        mic.stop()
+        if sender_task is not None:
+            sender_task.cancel()
+        print(mic.stats())
+        print(audio_sender.stats())
+        if vad_gate is not None:
+            print(vad_gate.stats())
 
 
 async def main() -> None:
@@ -132,16 +207,24 @@ async def main() -> None:
                 should_send_audio.set()
             else:
                 should_send_audio.clear()
-                # 停止播放回覆語音
-                audio_player.stop()
-                # 由於關閉 VAD，所以要手動提交語音並且指示伺服端生成回應
-                await connection.input_audio_buffer.commit()
-                await connection.response.create()
+                # 丟掉還沒播放的回覆語音，串流不停止，下一個回應不必重新開啟裝置
+                audio_player.flush()
+                if vad_gate is None:
+                    await commit_turn()
+                elif vad_gate.active:
+                    # 還在講話就放開 K 鍵，提交目前為止的語音
+                    vad_gate.reset()
+                    await commit_turn()
         elif key == "q":
             break
 
     mic_task.cancel()
     realtime_task.cancel()
     await asyncio.gather(mic_task, realtime_task)
+    event_logger.close()
+    tracer.report()
+    router.report()
+    manager.report()
+    audio_player.report()
 if __name__ == "__main__":
     asyncio.run(main())
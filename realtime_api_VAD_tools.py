@@ -1,146 +1,217 @@
 from __future__ import annotations
 
-import base64
 import asyncio
 from typing import Any, cast
 from typing_extensions import override
 
-from audio_util import CHANNELS, SAMPLE_RATE, AudioPlayerAsync
+from audio_util import CHANNELS, SAMPLE_RATE, AudioPlayerAsync, MicCapture
 
 from openai import AsyncOpenAI
+from realtime_util import create_client, audio_format_session, barge_in
 from openai.types.beta.realtime.session import Session
 from openai.resources.beta.realtime.realtime import AsyncRealtimeConnection
 
 from getchar import getkeys
 
+from audio_sender import AudioSender
+from event_log import EventLogger
+from event_router import EventRouter
+from connection_manager import ConnectionManager
+from latency_trace import LatencyTracer
+from vad_gate import CLIENT_VAD, VadGate
+
 from search_tools import google_res, GoogleRes
+from tool_registry import ToolRegistry
 
-tools = [{
-    "type":"function",
-    # 注意 Realtime API 的這裡少一層 "function"
-    # 這是和 ChatCompletion 不一樣的地方
-    "name": "google_res",                # 函式名稱
-    "description": "取得 Google 搜尋結果", # 函式說明
-    "parameters": GoogleRes.model_json_schema(), # 參數規格
-}]
+# 登記工具函式與參數規格，tools 會自動產生
+registry = ToolRegistry(speculative=True)
+registry.register(google_res, GoogleRes, "取得 Google 搜尋結果")
+tools = registry.tools
 
 connection: AsyncRealtimeConnection | None = None
 audio_player: AudioPlayerAsync = AudioPlayerAsync()
+audio_sender: AudioSender = AudioSender()
 should_send_audio: asyncio.Event = asyncio.Event()
 connected: asyncio.Event = asyncio.Event()
+tracer: LatencyTracer = LatencyTracer()
+# 在本機先過濾掉靜音；伺服端 VAD 要收到一段靜音才會判斷講完話
+# （silence_duration_ms 預設 500ms），所以講完話後要多送一點
+vad_gate: VadGate | None = VadGate(hangover_ms=800) if CLIENT_VAD else None
+
+session: Session | None = None
+# 目前播放中的語音項目與還在生成的回應，插話時用來截斷與取消
+last_audio_item_id: str | None = None
+response_id: str | None = None
+# 已經被插話打斷的項目，之後送達的片段直接丟掉
+interrupted_item_id: str | None = None
+
+# 以事件類型對應處理函式
+router: EventRouter = EventRouter()
+# 在背景執行緒記錄事件，頻繁的片段事件只抽樣記錄
+event_logger: EventLogger = EventLogger(
+    sample_every={
+        "response.audio.delta": 50,
+        "response.audio_transcript.delta": 20,
+        "response.function_call_arguments.delta": 20,
+    },
+    max_per_s=20,
+)
+router.on_any(event_logger)
+
+# 斷線時自動重新連線，重新套用 session 設定並重建對話
+manager: ConnectionManager = ConnectionManager(
+    router,
+    session={
+        **audio_format_session(),
+        'tools': tools,
+        "tool_choice": "auto"
+    },
+    # 可以透過 extra_query 傳遞額外的引數
+    extra_query={"voice": "alloy",},
+)
+sender_task: asyncio.Task | None = None
+
+@manager.on_connect
+def on_connect(conn) -> None:
+    global connection, sender_task, response_id
+    connection = conn
+    # 斷線時還在生成的回應已經不存在了，其中的函式叫用也不會有 response.done
+    response_id = None
+    registry.reset()
+    # 每次連線（包含重新連線）都以新的連線重新啟動傳送音訊的工作，
+    # 斷線期間排隊的音訊會在這時送出；舊連線的工作要先停掉，
+    # 否則兩個工作會同時從 audio_sender 的佇列取出音訊
+    if sender_task is not None:
+        sender_task.cancel()
+    sender_task = asyncio.create_task(audio_sender.run(conn))
+
+@router.on("session.created")
+def on_session_created(event) -> None:
+    global session
+    session = event.session
+    connected.set()
+
+@router.on("response.created")
+def on_response_created(event) -> None:
+    global response_id
+    response_id = event.response.id
+    tracer.response_created(event.response.id)
+
+# 回應內容的語音也是一段一段送來，直接使用 dict 不必建構 pydantic 物件，
+# base64 的語音資料以 memoryview 取得後直接解碼進播放端的緩衝區
+@router.on("response.audio.delta", raw=True, payload="delta")
+def on_audio_delta(event: dict) -> None:
+    global last_audio_item_id
+    item_id = event["item_id"]
+    if item_id == interrupted_item_id:
+        return
+    if item_id != last_audio_item_id:
+        # 新的語音項目從頭開始計算播放的長度，截斷時才知道播放到哪裡
+        last_audio_item_id = item_id
+        audio_player.reset_frame_count()
+    tracer.audio_delta(item_id, audio_player)
+    audio_player.add_base64(event["delta"])
+
+# 伺服端判斷使用者講完話了，開始計算回應的延遲
+@router.on("input_audio_buffer.speech_stopped")
+def on_speech_stopped(event) -> None:
+    tracer.speech_stopped()
+
+# 如果使用者有講新的話，就丟掉還沒播放的音訊，並取消、截斷目前的回應，
+# 播放串流不關閉，下一個回應不必重新開啟音效裝置
+@router.on("input_audio_buffer.speech_started")
+async def on_speech_started(event) -> None:
+    global interrupted_item_id
+    if await barge_in(connection, audio_player, last_audio_item_id,
+                      response_id, tracer.barge_in()):
+        interrupted_item_id = last_audio_item_id
+
+# 回應內容的文字是用串流方式一段一段送回來，不需要處理
+# 當回應內容的文字送完了，就印出來
+@router.on("response.audio_transcript.done")
+def on_transcript_done(event) -> None:
+    print(event.transcript)
+
+# 參數一送完（或是已經是完整的 JSON）就先開始執行函式，
+# 不必等到 response.done
+@router.on("response.output_item.added")
+def on_output_item_added(event) -> None:
+    registry.item_added(event.item)
+
+@router.on("response.function_call_arguments.delta", raw=True)
+def on_arguments_delta(event: dict) -> None:
+    registry.arguments_delta(event["call_id"], event["delta"])
+
+@router.on("response.function_call_arguments.done")
+def on_arguments_done(event) -> None:
+    registry.arguments_done(event.call_id, event.arguments)
+
+# 如果伺服端回應需要叫用函式，就交給背景工作執行，
+# 不會卡住接收與播放語音
+@router.on("response.done")
+def on_response_done(event) -> None:
+    global response_id
+    response_id = None
+    audio_player.end_response()
+    registry.start_calls(connection, event.response)
+
+@router.on("error")
+def on_error(event) -> None:
+    if event.error.code == "response_cancel_not_active":
+        # 插話時回應剛好已經結束，不影響對話
+        return
+    print(event.error.message)
+    # 印出錯誤發生前的事件
+    event_logger.dump()
 
 async def handle_realtime_connection() -> None:
-    global connection
-    session: Session | None = None
-
-    client: AsyncOpenAI = AsyncOpenAI()
-    # last_audio_item_id = None
-
-    async with client.beta.realtime.connect(
-        model="gpt-4o-realtime-preview",
-        # 可以透過 extra_query 傳遞額外的引數
-        extra_query = {"voice": "alloy",},
-
-    ) as conn:
-        connection = conn
-        await connection.session.update(
-            session={
-                'tools': tools,
-                "tool_choice": "auto"
-            }
-        )
-
-        try:
-            async for event in conn:
-                print(f'{event.type}:id('
-                      f'{event.item.id if hasattr(event, "item") else ""}'
-                      f'{event.item_id if hasattr(event, "item_id") else ""})')
-
-                if event.type == "session.created":
-                    session = event.session
-                    connected.set()
-                    continue
-
-                # 回應內容的語音也是一段一段送來
-                if event.type == "response.audio.delta":
-                    bytes_data = base64.b64decode(event.delta)
-                    audio_player.add_data(bytes_data)
-                    continue
-                
-                # 如果使用者有講新的話，就停止播放音訊，避免干擾
-                if event.type == "input_audio_buffer.speech_started":
-                    audio_player.stop()
-                    continue
-
-                # 回應內容的文字是用串流方式一段一段送回來
-                if event.type == "response.audio_transcript.delta":
-                    continue
-                
-                # 當回應內容的文字送完了，就印出來
-                if event.type == "response.audio_transcript.done":
-                    print(event.transcript)
-                    continue
-
-                # 如果伺服端回應需要叫用函式
-                if (event.type == "response.done" and
-                    event.response.output[0].type == "function_call"):
-                    func = event.response.output[0].name
-                    args = event.response.output[0].arguments
-                    # pprint(event.response)
-                    print(f'\tcall {func}(**{args})')
-                    # 將函式叫用結果傳回伺服端
-                    await connection.conversation.item.create(
-                        item={
-                            "type": "function_call_output",
-                            "call_id": event.response.output[0].call_id,
-                            "output": eval(f'{func}(**{args})')
-                        }
-                    )
-                    # 請伺服端重新生成回應
-                    await connection.response.create()
-                    continue
-        except asyncio.CancelledError:
-            pass
+    client: AsyncOpenAI = create_client()
+
+    try:
+        await manager.run(client)
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        event_logger.dump()
+        raise
 
 async def send_mic_audio() -> None:
     global connection
-    import sounddevice as sd  # type: ignore
 
-    sent_audio = False
-
-    read_size = int(SAMPLE_RATE * 0.02)
+    # 連線之後才開始擷取音訊，並由 audio_sender 合併成較大的封包送出
+    await connected.wait()
 
-    stream = sd.InputStream(
-        channels=CHANNELS,
-        samplerate=SAMPLE_RATE,
-        dtype="int16",
-    )
-    stream.start()
+    mic = MicCapture()
+    mic.start()
 
     try:
         while True:
-            # 先累積基本的音訊資料
-            if stream.read_available < read_size:
-                await asyncio.sleep(0)
-                continue
+            # 有音訊資料時才會被喚醒
+            data = await mic.read()
 
-            # 等待按下 K 鍵才開始傳送音訊資料
-            await should_send_audio.wait()
-
-            data, _ = stream.read(read_size)
+            # 還沒按下 K 鍵前擷取到的音訊直接丟掉
+            if not should_send_audio.is_set():
+                continue
 
             # 傳送音訊資料給伺服端，伺服端會自動判斷段落就回應
-            await connection.input_audio_buffer.append(
-                audio=base64.b64encode(cast(Any, data)).decode("utf-8")
-            )
-            await asyncio.sleep(0)
+            if vad_gate is None:
+                audio_sender.feed(data)
+                continue
+            frames, _ = vad_gate.process(data)
+            for frame in frames:
+                audio_sender.feed(frame)
     except KeyboardInterrupt:
         pass
     except asyncio.CancelledError:
         pass
     finally:
-        stream.stop()
-        stream.close()
+        mic.stop()
+        if sender_task is not None:
+            sender_task.cancel()
+        print(mic.stats())
+        print(audio_sender.stats())
+        if vad_gate is not None:
+            print(vad_gate.stats())
 
 
 async def main() -> None:
@@ -162,12 +233,20 @@ async def main() -> None:
                 should_send_audio.set()
             else:
                 should_send_audio.clear()
+                # 還在排隊的音訊是這一段話的結尾，不要留到下次錄音
+                await audio_sender.end_turn(connection)
         elif key == "q":
             break
 
     mic_task.cancel()
     realtime_task.cancel()
     await asyncio.gather(mic_task, realtime_task)
+    registry.close()
+    event_logger.close()
+    tracer.report()
+    router.report()
+    manager.report()
+    audio_player.report()
 
 if __name__ == "__main__":
     asyncio.run(main())
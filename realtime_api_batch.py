@@ -0,0 +1,336 @@
+# 批次處理整個目錄的錄音檔：每個檔案各自開一個交談階段送出音訊並取得回應，
+# 把語音轉錄、回應的文字與回應的語音存到輸出目錄：
+#
+#   python realtime_api_batch.py recordings/ --out results/ --concurrency 4
+#
+# 解碼與轉換取樣率在子行程中進行，不會卡住送出音訊的事件迴圈，
+# 同時最多有 --concurrency 個交談階段。解碼好的音訊逐塊寫到暫存檔，送出時再從暫存檔
+# 逐塊讀取，記憶體中每個檔案只有一塊；暫存檔最多 2 × --concurrency 個（進行中的交談
+# 階段各一個，加上預先解碼好等著的），處理完就刪除。每個檔案處理完才寫入 result.json，
+# 中斷後以相同的參數再執行一次，就會跳過已經完成的檔案
+from __future__ import annotations
+
+import os
+import json
+import time
+import wave
+import base64
+import signal
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import g711
+from g711 import AUDIO_FORMAT
+from resample import SAMPLE_RATE, Resampler
+from audio_util import iter_pcm16_chunks
+from event_router import EventRouter
+from realtime_util import create_client, audio_format_session
+
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".m4a", ".flac", ".ogg", ".webm", ".mp4", ".aac"}
+CHUNK_SECONDS = 0.5  # 每次送出的音訊長度
+DONE_FILE = "result.json"
+# 收到 response.done 之後，最多再等多久輸入語音的轉錄
+TRANSCRIPT_TIMEOUT_S = 5.0
+# 不影響這個檔案結果的錯誤，只印出來不中止，其他錯誤都當成這個檔案失敗
+RECOVERABLE_ERRORS = {
+    "response_cancel_not_active",
+    "conversation_already_has_active_response",
+}
+
+def decode_file(path: str, dest: str, audio_format: str) -> tuple[float, float]:
+    """在子行程中把音訊檔轉成要送出的格式，逐塊寫到 dest
+
+    傳回 (音訊秒數, 解碼花費的秒數)。G.711 格式在這裡就降到 8kHz 並編碼，
+    主行程只需要從 dest 逐塊讀出送出
+    """
+    start = time.perf_counter()
+    rate, _ = g711.FORMATS[audio_format]
+    resampler = Resampler(SAMPLE_RATE, rate) if rate != SAMPLE_RATE else None
+    samples = 0
+    with open(dest, "wb") as f:
+        for data in iter_pcm16_chunks(path, CHUNK_SECONDS):
+            pcm = np.frombuffer(data, dtype=np.int16)
+            samples += len(pcm)
+            if resampler is not None:
+                pcm = resampler.process(pcm)
+            f.write(g711.encode(pcm, audio_format).tobytes())
+    return samples / SAMPLE_RATE, time.perf_counter() - start
+
+def ignore_sigint() -> None:
+    # Ctrl-C 由主行程處理，子行程不印出 KeyboardInterrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def find_audio_files(root: Path) -> list[Path]:
+    if root.is_file():
+        return [root]
+    return sorted(p for p in root.rglob("*")
+                  if p.is_file() and p.suffix.lower() in AUDIO_EXTENSIONS)
+
+def output_dir(root: Path, path: Path, out: Path) -> Path:
+    # 依照輸入檔的相對路徑建立輸出目錄，例如 a/b.mp3 -> out/a/b/
+    base = root.parent if root.is_file() else root
+    return out / path.relative_to(base).with_suffix("")
+
+@dataclass
+class FileResult:
+    file: str
+    audio_s: float = 0.0      # 輸入音訊的秒數
+    decode_s: float = 0.0     # 子行程解碼花費的秒數
+    upload_s: float = 0.0     # 送出所有音訊花費的秒數
+    response_s: float = 0.0   # 從要求回應到 response.done 的秒數
+    total_s: float = 0.0      # 從連線到結束的秒數（不含解碼）
+    input_bytes: int = 0
+    response_audio_s: float = 0.0
+    input_transcript: str = ""
+    transcript: str = ""
+    error: str | None = None
+
+class BatchFile:
+    """一個檔案的交談階段，以 EventRouter 收集回應"""
+
+    def __init__(self, path: Path, out: Path, audio_format: str):
+        self.path = path
+        self.out = out
+        self.audio_format = audio_format
+        self.result = FileResult(file=str(path))
+        self.audio = bytearray()
+        self.connection = None
+        # 回應與輸入語音的轉錄都收到才結束，轉錄可能比 response.done 晚到
+        self.responded = False
+        self.transcribed = False
+        self.timeout: asyncio.TimerHandle | None = None
+        self.closing: asyncio.Task | None = None
+        self.router = EventRouter()
+        self.router.on("conversation.item.input_audio_transcription.completed",
+                       raw=True)(self.on_input_transcript)
+        self.router.on("conversation.item.input_audio_transcription.failed",
+                       raw=True)(self.on_input_transcript_failed)
+        self.router.on("response.audio.delta", raw=True, payload="delta")(self.on_audio_delta)
+        self.router.on("response.audio_transcript.done", raw=True)(self.on_transcript_done)
+        self.router.on("response.text.done", raw=True)(self.on_text_done)
+        self.router.on("response.done", raw=True)(self.on_response_done)
+        self.router.on("error", raw=True)(self.on_error)
+
+    def on_input_transcript(self, event: dict) -> None:
+        self.result.input_transcript = event["transcript"]
+        self.on_transcribed()
+
+    def on_input_transcript_failed(self, event: dict) -> None:
+        print(f"{self.path}: input transcription failed: {event['error'].get('message')}")
+        self.on_transcribed()
+
+    def on_transcribed(self) -> None:
+        self.transcribed = True
+        if self.responded:
+            self.router.stop()
+
+    def on_audio_delta(self, event: dict) -> None:
+        self.audio += base64.b64decode(event["delta"])
+
+    def on_transcript_done(self, event: dict) -> None:
+        self.result.transcript = event["transcript"]
+
+    def on_text_done(self, event: dict) -> None:
+        self.result.transcript = event["text"]
+
+    def on_response_done(self, event: dict) -> None:
+        status = event["response"]["status"]
+        if status != "completed":
+            self.result.error = f"response {status}"
+        self.responded = True
+        if self.transcribed or self.result.error is not None:
+            self.router.stop()
+            return
+        self.timeout = asyncio.get_running_loop().call_later(
+            TRANSCRIPT_TIMEOUT_S, self.on_transcript_timeout)
+
+    def on_transcript_timeout(self) -> None:
+        # router.run() 正在等下一個事件，關閉連線讓它結束
+        print(f"{self.path}: no input transcript after {TRANSCRIPT_TIMEOUT_S:g}s")
+        self.closing = asyncio.create_task(self.connection.close())
+
+    def on_error(self, event: dict) -> None:
+        error = event["error"]
+        if error.get("code") in RECOVERABLE_ERRORS:
+            print(f"{self.path}: ignored error: {error['message']}")
+            return
+        self.result.error = error["message"]
+        self.router.stop()
+
+    async def run(self, client, data_path: str, session: dict, model: str) -> FileResult:
+        rate, width = g711.FORMATS[self.audio_format]
+        chunk = int(CHUNK_SECONDS * rate) * width
+        start = time.perf_counter()
+        # 沒有開啟轉錄就不必等
+        self.transcribed = not session.get("input_audio_transcription")
+        async with client.beta.realtime.connect(model=model) as connection:
+            self.connection = connection
+            await connection.session.update(session=session)
+            # 一次只讀一塊，不把整個檔案載入記憶體
+            with open(data_path, "rb") as f:
+                while data := f.read(chunk):
+                    await connection.input_audio_buffer.append(
+                        audio=base64.b64encode(data).decode("ascii")
+                    )
+            await connection.input_audio_buffer.commit()
+            await connection.response.create()
+            uploaded = time.perf_counter()
+            try:
+                await self.router.run(connection)
+            finally:
+                if self.timeout is not None:
+                    self.timeout.cancel()
+        end = time.perf_counter()
+        self.result.input_bytes = os.path.getsize(data_path)
+        self.result.upload_s = uploaded - start
+        self.result.response_s = end - uploaded
+        self.result.total_s = end - start
+        self.result.response_audio_s = len(self.audio) / width / rate
+        return self.result
+
+    def save(self) -> None:
+        # result.json 最後才寫入，而且先寫到暫存檔再改名，
+        # 有 result.json 就代表這個檔案的輸出都是完整的
+        self.out.mkdir(parents=True, exist_ok=True)
+        with open(self.out / "transcript.txt", "w", encoding="utf-8") as f:
+            f.write(f"[input] {self.result.input_transcript}\n")
+            f.write(f"[response] {self.result.transcript}\n")
+        if self.audio:
+            rate, _ = g711.FORMATS[self.audio_format]
+            pcm = g711.decode(bytes(self.audio), self.audio_format)
+            with wave.open(str(self.out / "response.wav"), "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(rate)
+                f.writeframes(pcm.tobytes())
+        tmp = self.out / (DONE_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(asdict(self.result), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.out / DONE_FILE)
+
+def print_result(result: FileResult) -> None:
+    speed = result.audio_s / result.total_s if result.total_s else 0.0
+    print(f"{result.file}: {result.audio_s:.1f}s audio, decode {result.decode_s:.2f}s, "
+          f"upload {result.upload_s:.2f}s, response {result.response_s:.2f}s, "
+          f"total {result.total_s:.2f}s ({speed:.1f}x realtime)")
+
+async def run_batch(args) -> None:
+    root = Path(args.input)
+    out = Path(args.out)
+    files = find_audio_files(root)
+    pending = [p for p in files if not (output_dir(root, p, out) / DONE_FILE).exists()]
+    print(f"{len(files)} files, {len(files) - len(pending)} already done, "
+          f"{len(pending)} to process")
+    if not pending:
+        return
+
+    session = {
+        # 關閉 VAD，避免伺服端在音訊還沒送完前就自動回應
+        "turn_detection": None,
+        "input_audio_transcription": {"model": "whisper-1"},
+        **audio_format_session(args.audio_format),
+    }
+    if args.instructions:
+        session["instructions"] = args.instructions
+
+    loop = asyncio.get_running_loop()
+    client = create_client()
+    paths = iter(pending)
+    decoded: asyncio.Queue = asyncio.Queue()
+    # 暫存檔（包含解碼中）的數量上限，解碼前取得、交談階段結束並刪除暫存檔後才歸還，
+    # 不會把整個目錄都解碼到磁碟上
+    slots = asyncio.Semaphore(2 * args.concurrency)
+    results: list[FileResult] = []
+    failed: list[FileResult] = []
+    start = time.perf_counter()
+
+    async def decoder(pool) -> None:
+        # 所有 decoder 共用同一個 paths 迭代器，各自取下一個檔案
+        for path in paths:
+            await slots.acquire()
+            fd, data_path = tempfile.mkstemp(suffix=".pcm", dir=tmp_dir)
+            os.close(fd)
+            try:
+                audio_s, decode_s = await loop.run_in_executor(
+                    pool, decode_file, str(path), data_path, args.audio_format)
+            except Exception as exc:
+                os.unlink(data_path)
+                slots.release()
+                failed.append(FileResult(file=str(path), error=f"decode failed: {exc!r}"))
+                print(f"{path}: decode failed: {exc!r}")
+                continue
+            decoded.put_nowait((path, data_path, audio_s, decode_s))
+
+    async def process(path: Path, data_path: str, audio_s: float, decode_s: float) -> None:
+        job = BatchFile(path, output_dir(root, path, out), args.audio_format)
+        job.result.audio_s = audio_s
+        job.result.decode_s = decode_s
+        try:
+            result = await job.run(client, data_path, session, args.model)
+        except Exception as exc:
+            job.result.error = repr(exc)
+            result = job.result
+        if result.error is not None:
+            # 失敗的檔案不寫 result.json，下次執行會重新處理
+            failed.append(result)
+            print(f"{path}: failed: {result.error}")
+            return
+        job.save()
+        results.append(result)
+        print_result(result)
+
+    async def session_worker() -> None:
+        while (item := await decoded.get()) is not None:
+            path, data_path, audio_s, decode_s = item
+            try:
+                await process(path, data_path, audio_s, decode_s)
+            finally:
+                os.unlink(data_path)
+                slots.release()
+
+    with (tempfile.TemporaryDirectory(prefix="realtime_batch_") as tmp_dir,
+          ProcessPoolExecutor(max_workers=args.workers, initializer=ignore_sigint) as pool):
+        decoders = [asyncio.create_task(decoder(pool)) for _ in range(args.workers)]
+        workers = [asyncio.create_task(session_worker()) for _ in range(args.concurrency)]
+        await asyncio.gather(*decoders)
+        for _ in workers:
+            await decoded.put(None)
+        await asyncio.gather(*workers)
+
+    elapsed = time.perf_counter() - start
+    audio_s = sum(r.audio_s for r in results)
+    print(f"== batch: {len(results)} done, {len(failed)} failed in {elapsed:.1f}s ==")
+    if results:
+        print(f"{audio_s:.1f}s audio, {audio_s / elapsed:.1f} audio seconds per second, "
+              f"{len(results) / elapsed * 60:.1f} files per minute")
+        print(f"decode {sum(r.decode_s for r in results):.1f}s, "
+              f"upload {sum(r.upload_s for r in results):.1f}s, "
+              f"response {sum(r.response_s for r in results):.1f}s (summed over files)")
+    for result in failed:
+        print(f"failed: {result.file}: {result.error}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以 Realtime API 批次處理音訊檔")
+    parser.add_argument("input", help="音訊檔或包含音訊檔的目錄")
+    parser.add_argument("--out", default="batch_output", help="輸出目錄")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="同時進行的交談階段數")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2,
+                        help="解碼音訊的子行程數")
+    parser.add_argument("--audio-format", default=AUDIO_FORMAT, choices=list(g711.FORMATS))
+    parser.add_argument("--model", default="gpt-4o-realtime-preview")
+    parser.add_argument("--instructions", default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        print("interrupted, run again with the same arguments to resume")
+
+if __name__ == "__main__":
+    main()
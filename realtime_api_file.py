@@ -1,29 +1,51 @@
-from audio_util import audio_to_pcm16_base64, AudioPlayerAsync
+from audio_util import iter_pcm16_chunks, AudioPlayerAsync, SAMPLE_RATE
 import asyncio
 import base64
+import time
 from openai import AsyncOpenAI
+from realtime_util import create_client
+from decode_cache import decode_cache
 
-audio_player: AudioPlayerAsync = AudioPlayerAsync()
+AUDIO_FILE = "chinese.mp3"
+CHUNK_SECONDS = 0.5 # 每次送出的音訊長度
 
-f = open("chinese.mp3", "rb")
-audio = f.read()
-f.close()
+# 檔案是以 pcm16 送出，session 也維持預設的 pcm16 格式
+audio_player: AudioPlayerAsync = AudioPlayerAsync(audio_format="pcm16")
 
-audio = audio_to_pcm16_base64(audio)
+async def stream_audio_file(connection, path: str) -> None:
+    # 一段一段解碼並送出，不必先把整個檔案載入記憶體；
+    # 設定 DECODE_CACHE=1 時，同一個檔案第二次執行會直接從解碼快取讀取
+    # 從 ffmpeg 讀取會阻塞，在執行緒中取下一塊，等待時事件迴圈還能處理其他事件
+    loop = asyncio.get_running_loop()
+    chunks = iter_pcm16_chunks(path, CHUNK_SECONDS)
+    audio_seconds = 0.0
+    start = time.perf_counter()
+    try:
+        while (data := await loop.run_in_executor(None, next, chunks, None)) is not None:
+            await connection.input_audio_buffer.append(
+                audio=base64.b64encode(data).decode("ascii")
+            )
+            # pcm16 每個樣本 2 個位元組
+            audio_seconds += len(data) / 2 / SAMPLE_RATE
+    finally:
+        # 中途停止時結束 ffmpeg
+        chunks.close()
+    await connection.input_audio_buffer.commit()
+    elapsed = time.perf_counter() - start
+    print(f"Streamed {audio_seconds:.1f}s audio in {elapsed:.2f}s "
+          f"({audio_seconds / elapsed:.1f} audio seconds per second)")
+    if decode_cache.enabled:
+        decode_cache.report()
 
 async def main():
-    client = AsyncOpenAI()
+    client = create_client()
 
     async with client.beta.realtime.connect(model="gpt-4o-realtime-preview") as connection:
         # await connection.session.update(session={'modalities': ['text']})
-        
-        await connection.conversation.item.create(
-            item={
-                "type": "message",
-                "role": "user",
-                "content": [{"type": "input_audio", "audio": audio}],
-            }
-        )
+        # 關閉 VAD，避免伺服端在音訊還沒送完前就自動回應
+        await connection.session.update(session={"turn_detection": None})
+
+        await stream_audio_file(connection, AUDIO_FILE)
         await connection.response.create()
 
         async for event in connection:
@@ -42,6 +64,7 @@ async def main():
                 continue
             
             if event.type == 'response.done':
+                audio_player.end_response()
                 break
 
-asyncio.run(main())
\ No newline at end of file
+asyncio.run(main())
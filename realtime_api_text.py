@@ -1,8 +1,9 @@
 import asyncio
 from openai import AsyncOpenAI
+from realtime_util import create_client
 
 async def main():
-    client = AsyncOpenAI()
+    client = create_client()
 
     # 連線建立 session
     async with client.beta.realtime.connect(model="gpt-4o-realtime-preview") as connection:
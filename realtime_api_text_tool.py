@@ -1,19 +1,17 @@
 import asyncio
 from openai import AsyncOpenAI
+from realtime_util import create_client
 from rich.pretty import pprint
 from search_tools import google_res, GoogleRes
+from tool_registry import ToolRegistry
 
-tools = [{
-    "type":"function",
-    # 注意 Realtime API 的這裡少一層 "function"
-    # 這是和 ChatCompletion 不一樣的地方
-    "name": "google_res",                # 函式名稱
-    "description": "取得 Google 搜尋結果", # 函式說明
-    "parameters": GoogleRes.model_json_schema(), # 參數規格
-}]
+# 登記工具函式與參數規格，tools 會自動產生
+registry = ToolRegistry(speculative=True)
+registry.register(google_res, GoogleRes, "取得 Google 搜尋結果")
+tools = registry.tools
 
 async def main():
-    client = AsyncOpenAI()
+    client = create_client()
 
     async with client.beta.realtime.connect(model="gpt-4o-realtime-preview") as connection:
         await connection.session.update(
@@ -49,26 +47,24 @@ async def main():
 
             elif event.type == 'response.text.done':
                 print(event.text)
+            # 參數一送完（或是已經是完整的 JSON）就先開始執行函式，
+            # 不必等到 response.done
+            elif event.type == "response.output_item.added":
+                registry.item_added(event.item)
+            elif event.type == "response.function_call_arguments.delta":
+                registry.arguments_delta(event.call_id, event.delta)
+            elif event.type == "response.function_call_arguments.done":
+                registry.arguments_done(event.call_id, event.arguments)
             elif event.type == "response.done":
-                # 如果伺服端回應需要叫用函式
-                if event.response.output[0].type == "function_call":
-                    func = event.response.output[0].name
-                    args = event.response.output[0].arguments
-                    # pprint(event.response)
-                    print(f'\tcall {func}(**{args})')
-                    # 將函式叫用結果傳回伺服端
-                    await connection.conversation.item.create(
-                        item={
-                            "type": "function_call_output",
-                            "call_id": event.response.output[0].call_id,
-                            "output": eval(f'{func}(**{args})')
-                        }
-                    )
-                    # 請伺服端重新生成回應
-                    await connection.response.create()
-                else:
+                # 如果伺服端回應需要叫用函式，就在執行緒池中同時執行，
+                # 送回所有結果後再請伺服端重新生成回應
+                if not await registry.run_calls(connection, event.response):
                     break
             elif event.type == "error":
                 print(f'\t{event.error.message}')
 
-asyncio.run(main())
\ No newline at end of file
+try:
+    asyncio.run(main())
+finally:
+    # 不等待還在執行緒中執行的函式
+    registry.close()
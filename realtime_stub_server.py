@@ -0,0 +1,503 @@
+# 在本機模擬 Realtime API 的 websocket 伺服器，不需要連網就可以測試
+# 各個範例程式，並且量測用戶端本身的負擔。搭配 realtime_util.py 使用：
+#
+#   python realtime_stub_server.py --port 8765
+#   REALTIME_BASE_URL=ws://localhost:8765/v1 python realtime_api_VAD.py
+#
+# 測試斷線重連時，可以用 --kill-every 定期切斷所有連線，或是送出
+# SIGUSR1 訊號（kill -USR1 <pid>）立刻切斷
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import shutil
+import signal
+import subprocess
+import time
+
+import numpy as np
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+import g711
+
+SAMPLE_RATE = 24000
+AUDIO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chinese.mp3")
+
+_ids = itertools.count(1)
+
+def new_id(prefix: str) -> str:
+    return f"{prefix}_{next(_ids):012d}"
+
+def load_response_audio(path: str | None) -> bytes:
+    # 取得回應要播放的 24kHz mono pcm16 音訊，沒有檔案或沒有 ffmpeg 就產生
+    # 2 秒的 440Hz 音調。直接呼叫 ffmpeg 而不經過 audio_util，以免在沒有
+    # 音效裝置的機器上還要載入 pyaudio 與 sounddevice
+    if path and os.path.exists(path):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            print(f"ffmpeg not found, using a 440Hz tone instead of {path}")
+        else:
+            result = subprocess.run(
+                [ffmpeg, "-v", "error", "-i", path, "-f", "s16le", "-acodec", "pcm_s16le",
+                 "-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+                stdin=subprocess.DEVNULL, capture_output=True,
+            )
+            if result.returncode == 0 and result.stdout:
+                return result.stdout
+            print(f"cannot decode {path}, using a 440Hz tone: "
+                  f"{result.stderr.decode(errors='replace').strip()}")
+    t = np.arange(2 * SAMPLE_RATE) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16).tobytes()
+
+class StubOptions:
+    def __init__(self, delta_ms=100, pace=1.0, latency_ms=0, audio=b"",
+                 transcript="這是模擬伺服器的回應。", vad_threshold=500.0,
+                 vad_silence_ms=500):
+        self.delta_ms = delta_ms          # 每個 response.audio.delta 的音訊長度
+        self.pace = pace                  # 送出音訊的速度是即時的幾倍，0 表示不等待
+        self.latency_ms = latency_ms      # 模擬伺服端生成回應前的延遲
+        self.audio = audio                # 回應的 pcm16 音訊
+        self.transcript = transcript
+        self.vad_threshold = vad_threshold    # 伺服端 VAD 判斷有聲音的 RMS 門檻
+        self.vad_silence_ms = vad_silence_ms  # 靜音多久判斷為講完
+
+class StubSession:
+    """一條連線對應的交談階段狀態"""
+
+    def __init__(self, ws, options: StubOptions):
+        self.ws = ws
+        self.options = options
+        self.session = {
+            "id": new_id("sess"),
+            "object": "realtime.session",
+            "model": "gpt-4o-realtime-preview",
+            "modalities": ["text", "audio"],
+            "instructions": "",
+            "voice": "alloy",
+            "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16",
+            "input_audio_transcription": None,
+            "turn_detection": {
+                "type": "server_vad",
+                "threshold": 0.5,
+                "prefix_padding_ms": 300,
+                "silence_duration_ms": 200,
+            },
+            "tools": [],
+            "tool_choice": "auto",
+            "temperature": 0.8,
+            "max_response_output_tokens": "inf",
+        }
+        self.items: list[dict] = []
+        self.audio_buffer = bytearray()
+        self.audio_ms = 0.0       # 目前為止收到的音訊長度
+        self.speaking = False
+        self.silence_ms = 0.0
+        self.speech_item_id: str | None = None
+        self.response_task: asyncio.Task | None = None
+
+    async def send(self, event: dict) -> None:
+        event["event_id"] = new_id("event")
+        await self.ws.send(json.dumps(event, ensure_ascii=False))
+
+    async def error(self, message: str, code: str = "invalid_request_error",
+                    event_id: str | None = None) -> None:
+        await self.send({
+            "type": "error",
+            "error": {
+                "type": "invalid_request_error",
+                "code": code,
+                "message": message,
+                "param": None,
+                "event_id": event_id,
+            },
+        })
+
+    async def run(self) -> None:
+        await self.send({"type": "session.created", "session": self.session})
+        try:
+            async for message in self.ws:
+                event = json.loads(message)
+                handler = getattr(self, "on_" + event.get("type", "").replace(".", "_"), None)
+                if handler is None:
+                    await self.error(f"Unknown event type: {event.get('type')}",
+                                     event_id=event.get("event_id"))
+                    continue
+                await handler(event)
+        except ConnectionClosed:
+            pass
+        finally:
+            if self.response_task:
+                self.response_task.cancel()
+
+    # ---- 用戶端事件 ----
+
+    async def on_session_update(self, event: dict) -> None:
+        self.session.update(event.get("session", {}))
+        await self.send({"type": "session.updated", "session": self.session})
+
+    def audio_duration_ms(self, size: int, audio_format: str) -> float:
+        rate, width = g711.FORMATS[audio_format]
+        return size / width / rate * 1000
+
+    async def on_input_audio_buffer_append(self, event: dict) -> None:
+        data = base64.b64decode(event["audio"])
+        audio_format = self.session["input_audio_format"]
+        self.audio_buffer += data
+        duration_ms = self.audio_duration_ms(len(data), audio_format)
+        self.audio_ms += duration_ms
+        if self.session.get("turn_detection"):
+            await self.server_vad(g711.decode(data, audio_format), duration_ms)
+
+    async def server_vad(self, samples: np.ndarray, duration_ms: float) -> None:
+        # 以音量簡單模擬伺服端的 VAD
+        samples = samples.astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0
+        if rms >= self.options.vad_threshold:
+            self.silence_ms = 0.0
+            if not self.speaking:
+                self.speaking = True
+                self.speech_item_id = new_id("item")
+                # 使用者插話時中斷目前的回應
+                await self.cancel_response()
+                await self.send({
+                    "type": "input_audio_buffer.speech_started",
+                    "audio_start_ms": int(self.audio_ms - duration_ms),
+                    "item_id": self.speech_item_id,
+                })
+            return
+        if not self.speaking:
+            # 還沒開始講話前的靜音不必留著
+            self.audio_buffer.clear()
+            return
+        self.silence_ms += duration_ms
+        if self.silence_ms >= self.options.vad_silence_ms:
+            self.speaking = False
+            await self.send({
+                "type": "input_audio_buffer.speech_stopped",
+                "audio_end_ms": int(self.audio_ms),
+                "item_id": self.speech_item_id,
+            })
+            await self.commit(self.speech_item_id)
+            self.start_response({})
+
+    async def on_input_audio_buffer_commit(self, event: dict) -> None:
+        if self.audio_duration_ms(len(self.audio_buffer),
+                                  self.session["input_audio_format"]) < 100:
+            await self.error(
+                "Error committing input audio buffer: buffer too small. "
+                "Expected at least 100ms of audio.",
+                code="input_audio_buffer_commit_empty",
+                event_id=event.get("event_id"),
+            )
+            return
+        await self.commit(new_id("item"))
+
+    async def commit(self, item_id: str) -> None:
+        previous = self.items[-1]["id"] if self.items else None
+        self.audio_buffer.clear()
+        await self.send({
+            "type": "input_audio_buffer.committed",
+            "previous_item_id": previous,
+            "item_id": item_id,
+        })
+        item = {
+            "id": item_id,
+            "object": "realtime.item",
+            "type": "message",
+            "status": "completed",
+            "role": "user",
+            "content": [{"type": "input_audio", "transcript": None}],
+        }
+        await self.add_item(item)
+        if self.session.get("input_audio_transcription"):
+            await self.send({
+                "type": "conversation.item.input_audio_transcription.completed",
+                "item_id": item_id,
+                "content_index": 0,
+                "transcript": "（模擬的語音轉錄）",
+            })
+
+    async def on_input_audio_buffer_clear(self, event: dict) -> None:
+        self.audio_buffer.clear()
+        await self.send({"type": "input_audio_buffer.cleared"})
+
+    async def add_item(self, item: dict) -> None:
+        previous = self.items[-1]["id"] if self.items else None
+        self.items.append(item)
+        await self.send({
+            "type": "conversation.item.created",
+            "previous_item_id": previous,
+            "item": item,
+        })
+
+    async def on_conversation_item_create(self, event: dict) -> None:
+        item = dict(event["item"])
+        item.setdefault("id", new_id("item"))
+        item.setdefault("object", "realtime.item")
+        item.setdefault("status", "completed")
+        await self.add_item(item)
+
+    async def on_conversation_item_truncate(self, event: dict) -> None:
+        await self.send({
+            "type": "conversation.item.truncated",
+            "item_id": event["item_id"],
+            "content_index": event.get("content_index", 0),
+            "audio_end_ms": event["audio_end_ms"],
+        })
+
+    async def on_conversation_item_delete(self, event: dict) -> None:
+        self.items = [i for i in self.items if i["id"] != event["item_id"]]
+        await self.send({"type": "conversation.item.deleted", "item_id": event["item_id"]})
+
+    async def on_response_create(self, event: dict) -> None:
+        if self.response_task and not self.response_task.done():
+            await self.error(
+                "Conversation already has an active response",
+                code="conversation_already_has_active_response",
+                event_id=event.get("event_id"),
+            )
+            return
+        self.start_response(event.get("response") or {})
+
+    async def on_response_cancel(self, event: dict) -> None:
+        if not await self.cancel_response():
+            await self.error(
+                "Cancellation failed: no active response found",
+                code="response_cancel_not_active",
+                event_id=event.get("event_id"),
+            )
+
+    # ---- 生成回應 ----
+
+    def start_response(self, params: dict) -> None:
+        self.response_task = asyncio.create_task(self.respond(params))
+
+    async def cancel_response(self) -> bool:
+        task = self.response_task
+        if task is None or task.done():
+            return False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    def wants_tool_call(self) -> bool:
+        # 設定了工具而且最後一個項目是使用者的訊息時，就模擬叫用第一個工具
+        return bool(self.session.get("tools")) and bool(self.items) and \
+            self.items[-1].get("type") == "message"
+
+    async def respond(self, params: dict) -> None:
+        response = {
+            "id": new_id("resp"),
+            "object": "realtime.response",
+            "status": "in_progress",
+            "status_details": None,
+            "output": [],
+            "usage": None,
+        }
+        await self.send({"type": "response.created", "response": response})
+        try:
+            if self.options.latency_ms:
+                await asyncio.sleep(self.options.latency_ms / 1000)
+            if self.wants_tool_call():
+                item = await self.respond_function_call(response)
+            else:
+                modalities = params.get("modalities") or self.session["modalities"]
+                item = await self.respond_message(response, "audio" in modalities)
+            response["output"].append(item)
+            response["status"] = "completed"
+        except asyncio.CancelledError:
+            response["status"] = "cancelled"
+            response["status_details"] = {"type": "cancelled", "reason": "client_cancelled"}
+            try:
+                await self.send({"type": "response.done", "response": response})
+            except ConnectionClosed:
+                pass
+            raise
+        await self.send({"type": "response.done", "response": response})
+
+    async def respond_function_call(self, response: dict) -> dict:
+        tool = self.session["tools"][0]
+        properties = tool.get("parameters", {}).get("properties", {})
+        arguments = json.dumps({name: "測試" for name in properties}, ensure_ascii=False)
+        item = {
+            "id": new_id("item"),
+            "object": "realtime.item",
+            "type": "function_call",
+            "status": "in_progress",
+            "name": tool["name"],
+            "call_id": new_id("call"),
+            "arguments": "",
+        }
+        common = {"response_id": response["id"], "item_id": item["id"], "output_index": 0}
+        await self.send({"type": "response.output_item.added", "response_id": response["id"],
+                         "output_index": 0, "item": item})
+        # 參數也是一段一段送出
+        for i in range(0, len(arguments), 8):
+            await self.send({
+                "type": "response.function_call_arguments.delta",
+                **common, "call_id": item["call_id"], "delta": arguments[i:i + 8],
+            })
+        await self.send({
+            "type": "response.function_call_arguments.done",
+            **common, "call_id": item["call_id"], "arguments": arguments,
+        })
+        item["arguments"] = arguments
+        item["status"] = "completed"
+        self.items.append(item)
+        await self.send({"type": "response.output_item.done", "response_id": response["id"],
+                         "output_index": 0, "item": item})
+        return item
+
+    @staticmethod
+    def encode_output(audio: bytes, audio_format: str) -> bytes:
+        # 回應的音訊是 24kHz pcm16，G.711 格式直接每 3 個樣本取 1 個降到 8kHz，
+        # 模擬伺服器不在意音質
+        if audio_format == "pcm16":
+            return audio
+        pcm = np.frombuffer(audio, dtype=np.int16)[::3].copy()
+        return g711.encode(pcm, audio_format).tobytes()
+
+    async def respond_message(self, response: dict, with_audio: bool) -> dict:
+        options = self.options
+        item = {
+            "id": new_id("item"),
+            "object": "realtime.item",
+            "type": "message",
+            "status": "in_progress",
+            "role": "assistant",
+            "content": [],
+        }
+        common = {"response_id": response["id"], "item_id": item["id"], "output_index": 0}
+        part_type = "audio" if with_audio else "text"
+        await self.send({"type": "response.output_item.added", "response_id": response["id"],
+                         "output_index": 0, "item": item})
+        await self.send({
+            "type": "response.content_part.added", **common, "content_index": 0,
+            "part": {"type": part_type, "transcript": ""} if with_audio
+                    else {"type": "text", "text": ""},
+        })
+        content = {**common, "content_index": 0}
+        text = options.transcript
+
+        if not with_audio:
+            for char in text:
+                await self.send({"type": "response.text.delta", **content, "delta": char})
+            await self.send({"type": "response.text.done", **content, "text": text})
+            part = {"type": "text", "text": text}
+        else:
+            audio_format = self.session["output_audio_format"]
+            audio = self.encode_output(options.audio, audio_format)
+            rate, width = g711.FORMATS[audio_format]
+            delta_bytes = int(rate * options.delta_ms / 1000) * width
+            n_deltas = max(1, -(-len(audio) // delta_bytes))
+            # 把文字平均分配到各個音訊片段之間
+            chars_per_delta = max(1, -(-len(text) // n_deltas))
+            for i in range(n_deltas):
+                chunk = audio[i * delta_bytes:(i + 1) * delta_bytes]
+                await self.send({
+                    "type": "response.audio.delta", **content,
+                    "delta": base64.b64encode(chunk).decode("ascii"),
+                })
+                piece = text[i * chars_per_delta:(i + 1) * chars_per_delta]
+                if piece:
+                    await self.send({
+                        "type": "response.audio_transcript.delta", **content, "delta": piece,
+                    })
+                if options.pace:
+                    await asyncio.sleep(len(chunk) / width / rate / options.pace)
+                else:
+                    await asyncio.sleep(0)
+            await self.send({"type": "response.audio.done", **content})
+            await self.send({"type": "response.audio_transcript.done", **content,
+                             "transcript": text})
+            part = {"type": "audio", "transcript": text}
+
+        await self.send({"type": "response.content_part.done", **content, "part": part})
+        item["content"] = [part]
+        item["status"] = "completed"
+        self.items.append(item)
+        await self.send({"type": "response.output_item.done", "response_id": response["id"],
+                         "output_index": 0, "item": item})
+        return item
+
+class StubServer:
+    def __init__(self, options: StubOptions, kill_every: float = 0):
+        self.options = options
+        self.kill_every = kill_every  # 每隔幾秒切斷所有連線，0 表示不切斷
+        self.connections = 0
+        self.sockets: set = set()
+        self.kills = 0
+
+    async def handler(self, ws) -> None:
+        self.connections += 1
+        self.sockets.add(ws)
+        start = time.monotonic()
+        try:
+            await StubSession(ws, self.options).run()
+        finally:
+            self.connections -= 1
+            self.sockets.discard(ws)
+            print(f"connection closed after {time.monotonic() - start:.1f}s "
+                  f"({self.connections} open)")
+
+    def kill_all(self) -> None:
+        # 直接中斷 TCP 連線而不送出關閉訊框，模擬網路斷線
+        for ws in list(self.sockets):
+            ws.transport.abort()
+            self.kills += 1
+        print(f"killed all connections ({self.kills} so far)")
+
+    async def kill_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.kill_every)
+            self.kill_all()
+
+    async def serve_forever(self, host: str, port: int) -> None:
+        async with serve(self.handler, host, port, max_size=None) as server:
+            print(f"Realtime stub server on ws://{host}:{port}/v1")
+            if hasattr(signal, "SIGUSR1"):
+                asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.kill_all)
+            if self.kill_every:
+                self.killer = asyncio.create_task(self.kill_periodically())
+            await server.serve_forever()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本機的 Realtime API 模擬伺服器")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delta-ms", type=int, default=100,
+                        help="每個 response.audio.delta 的音訊長度（毫秒）")
+    parser.add_argument("--pace", type=float, default=1.0,
+                        help="送出音訊的速度是即時的幾倍，0 表示不等待")
+    parser.add_argument("--latency-ms", type=int, default=0,
+                        help="response.created 之後開始送出內容前的延遲")
+    parser.add_argument("--audio", default=AUDIO_FILE,
+                        help="回應要播放的音訊檔，找不到檔案或沒有 ffmpeg 就用 440Hz 音調")
+    parser.add_argument("--transcript", default="這是模擬伺服器的回應。")
+    parser.add_argument("--kill-every", type=float, default=0,
+                        help="每隔幾秒切斷所有連線，用來測試斷線重連")
+    args = parser.parse_args()
+
+    options = StubOptions(
+        delta_ms=args.delta_ms,
+        pace=args.pace,
+        latency_ms=args.latency_ms,
+        audio=load_response_audio(args.audio),
+        transcript=args.transcript,
+    )
+    try:
+        asyncio.run(StubServer(options, args.kill_every).serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
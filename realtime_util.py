@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import os
+
+from openai import AsyncOpenAI
+
+from g711 import AUDIO_FORMAT
+from session_recorder import RECORD_SESSION, SessionRecorder, record_client
+
+# 設定 REALTIME_BASE_URL 環境變數就可以改連到本機的模擬伺服器
+# (realtime_stub_server.py)，例如：
+#   REALTIME_BASE_URL=ws://localhost:8765/v1 python realtime_api_VAD.py
+REALTIME_BASE_URL = os.environ.get("REALTIME_BASE_URL")
+
+_recorder = None
+
+def create_client() -> AsyncOpenAI:
+    if not REALTIME_BASE_URL:
+        client = AsyncOpenAI()
+    else:
+        # 模擬伺服器不檢查金鑰，但是 AsyncOpenAI 一定要有金鑰才能建立
+        client = AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY", "local"),
+            websocket_base_url=REALTIME_BASE_URL,
+        )
+    if RECORD_SESSION:
+        # 設定 RECORD_SESSION 時記錄所有連線收送的事件，同一個行程共用一個檔案
+        global _recorder
+        if _recorder is None:
+            _recorder = SessionRecorder(RECORD_SESSION)
+        record_client(client, _recorder)
+    return client
+
+def audio_format_session(audio_format: str = AUDIO_FORMAT) -> dict:
+    # session.update 中收送音訊格式的設定，g711_ulaw/g711_alaw 的資料量只有 pcm16 的 1/6
+    return {"input_audio_format": audio_format, "output_audio_format": audio_format}
+
+async def barge_in(connection, audio_player, item_id: str | None,
+                   response_id: str | None = None, on_silent=None) -> bool:
+    """使用者插話時立刻停止播放，並告知伺服端實際播放到哪裡
+
+    只丟掉播放端還沒播的音訊而不停止串流，有還在生成的回應（response_id
+    不是 None）才取消，再以實際播放的毫秒數送出 conversation.item.truncate，
+    讓伺服端的對話紀錄與使用者實際聽到的內容一致。有截斷項目時傳回 True。
+    回應可能在取消送到之前剛好結束，呼叫端應該忽略 response_cancel_not_active 錯誤
+    """
+    pending = audio_player.flush(on_silent)
+    # 清除之後就不會再播放這個項目，先記下播放到哪裡
+    played_ms = audio_player.played_ms()
+    if response_id is not None:
+        await connection.response.cancel(response_id=response_id)
+    # 音訊已經播完而且回應也結束了，就不需要截斷
+    if item_id is None or (pending == 0 and response_id is None):
+        return False
+    await connection.conversation.item.truncate(
+        item_id=item_id,
+        content_index=0,
+        audio_end_ms=played_ms,
+    )
+    return True
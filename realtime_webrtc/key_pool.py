@@ -0,0 +1,115 @@
+import time
+import threading
+from collections import deque
+
+# 預先在背景產生臨時金鑰，瀏覽器要求時直接從池中取出，不必等待建立
+# session 的 HTTPS 往返。每把金鑰只會發出一次，快要到期的會先丟掉；
+# 剩餘數量低於 low_watermark 時就補到 target 把
+#
+# create_session 是產生臨時金鑰的函式，傳回值要有 client_secret.value 與
+# client_secret.expires_at，例如：
+#   lambda: client.beta.realtime.sessions.create(model='gpt-4o-realtime-preview')
+# 測試時可以換成不需要連網的假函式
+class KeyPool:
+    def __init__(self, create_session, target=3, low_watermark=2,
+                 min_ttl=15.0, interval=1.0):
+        self.create_session = create_session
+        self.target = target
+        self.low_watermark = low_watermark
+        self.min_ttl = min_ttl      # 剩餘時效少於這個秒數的金鑰就不發出
+        self.interval = interval    # 背景檢查的間隔秒數
+        self.keys = deque()         # (金鑰, 到期時間)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.minted = 0       # 產生的金鑰數
+        self.served = 0       # 從池中發出的金鑰數
+        self.discarded = 0    # 快到期而丟掉的金鑰數
+        self.misses = 0       # 池中沒有金鑰而當場產生的次數
+        self.errors = 0
+        self.mint_latency = deque(maxlen=100)  # 最近幾次產生金鑰花費的秒數
+
+    def mint(self):
+        start = time.perf_counter()
+        response = self.create_session()
+        self.mint_latency.append(time.perf_counter() - start)
+        # 背景執行緒與處理要求的執行緒都可能同時產生金鑰
+        with self.lock:
+            self.minted += 1
+        return response.client_secret.value, response.client_secret.expires_at
+
+    def _prune(self):
+        # 呼叫端必須持有 self.lock
+        deadline = time.time() + self.min_ttl
+        while self.keys and self.keys[0][1] <= deadline:
+            self.keys.popleft()
+            self.discarded += 1
+
+    def get(self):
+        with self.lock:
+            self._prune()
+            key = self.keys.popleft() if self.keys else None
+            depth = len(self.keys)
+            if key is not None:
+                self.served += 1
+            else:
+                self.misses += 1
+        if depth < self.low_watermark:
+            self.wakeup.set()
+        if key is not None:
+            return key[0]
+        # 池中沒有可用的金鑰，只好當場產生
+        return self.mint()[0]
+
+    def refill(self):
+        with self.lock:
+            self._prune()
+            if len(self.keys) >= self.low_watermark:
+                return
+            needed = self.target - len(self.keys)
+        for _ in range(needed):
+            try:
+                key = self.mint()
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                print(f'Failed to mint ephemeral key: {e}')
+                return
+            with self.lock:
+                # 依照到期時間排序，最早到期的先發出
+                self.keys.append(key)
+                self.keys = deque(sorted(self.keys, key=lambda k: k[1]))
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.refill()
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def start(self):
+        # 可以重複呼叫，只會啟動一個背景執行緒
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self):
+        latency = list(self.mint_latency)
+        return {
+            "depth": len(self.keys),
+            "minted": self.minted,
+            "served": self.served,
+            "discarded": self.discarded,
+            "misses": self.misses,
+            "errors": self.errors,
+            "mint_latency_avg": sum(latency) / len(latency) if latency else None,
+            "mint_latency_max": max(latency) if latency else None,
+        }
@@ -1,19 +1,33 @@
 from openai import OpenAI
-from flask import Flask, render_template
+from flask import Flask, jsonify, render_template
 import time
 
+from key_pool import KeyPool
+
 app = Flask(__name__)
 client = OpenAI()
 
-def get_ephemeral_key():
+def create_session():
     # 生成臨時金鑰
     response = client.beta.realtime.sessions.create(
         model='gpt-4o-realtime-preview'
     )
     # 把時效時間顯示在瀏覽器的終端機上
     print(f'Expires at: {time.ctime(response.client_secret.expires_at)}')
+    return response
+
+# 在背景預先產生臨時金鑰
+key_pool = KeyPool(create_session)
+
+# 以 flask run 或 WSGI 伺服器啟動時不會執行 __main__ 的部分，
+# 所以在收到第一個要求時啟動背景執行緒
+@app.before_request
+def start_key_pool():
+    key_pool.start()
+
+def get_ephemeral_key():
     # 傳回臨時金鑰
-    return response.client_secret.value
+    return key_pool.get()
 
 # 顯示首頁
 @app.route('/')
@@ -25,5 +39,11 @@ def index():
 def key():
     return get_ephemeral_key()
 
+# 查看金鑰池的狀態
+@app.route('/stats')
+def stats():
+    return jsonify(key_pool.stats())
+
 if __name__ == '__main__':
+    key_pool.start()
     app.run("0.0.0.0", 5000)
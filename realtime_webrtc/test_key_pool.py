@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import time
+import threading
+from types import SimpleNamespace
+
+from key_pool import KeyPool
+
+# 以假的 sessions.create 測試金鑰池，不會真的連到 OpenAI：
+#
+#   cd realtime_webrtc
+#   python -m pytest test_key_pool.py
+#   python test_key_pool.py
+
+class FakeSessions:
+    # 取代 client.beta.realtime.sessions.create，產生的金鑰在 ttl 秒後到期
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def create(self):
+        with self.lock:
+            self.calls += 1
+            value = f"key-{self.calls}"
+        secret = SimpleNamespace(value=value, expires_at=time.time() + self.ttl)
+        return SimpleNamespace(client_secret=secret)
+
+def test_refill_to_target_below_low_watermark():
+    sessions = FakeSessions()
+    pool = KeyPool(sessions.create, target=3, low_watermark=2)
+    pool.refill()
+    assert len(pool.keys) == 3 and sessions.calls == 3
+    # 還有 2 把，不低於 low_watermark 就不補
+    assert pool.get() == "key-1"
+    assert not pool.wakeup.is_set()
+    pool.refill()
+    assert sessions.calls == 3
+    # 剩 1 把時喚醒背景執行緒，補回 3 把
+    assert pool.get() == "key-2"
+    assert pool.wakeup.is_set()
+    pool.refill()
+    assert len(pool.keys) == 3 and sessions.calls == 5
+    assert pool.stats()["served"] == 2
+
+def test_prune_discards_keys_about_to_expire():
+    sessions = FakeSessions(ttl=5.0)
+    pool = KeyPool(sessions.create, target=2, low_watermark=1, min_ttl=15.0)
+    pool.refill()
+    # 剩餘時效少於 min_ttl 的金鑰不會發出，改成當場產生
+    sessions.ttl = 60.0
+    assert pool.get() == "key-3"
+    stats = pool.stats()
+    assert stats["discarded"] == 2
+    assert stats["served"] == 0 and stats["misses"] == 1
+
+def test_miss_mints_on_demand():
+    sessions = FakeSessions()
+    pool = KeyPool(sessions.create)
+    assert pool.get() == "key-1"
+    stats = pool.stats()
+    assert stats["misses"] == 1 and stats["minted"] == 1 and stats["depth"] == 0
+    assert pool.wakeup.is_set()
+
+def test_concurrent_gets_are_counted():
+    sessions = FakeSessions()
+    pool = KeyPool(sessions.create, target=20, low_watermark=20)
+    pool.refill()
+    keys = []
+    threads = [threading.Thread(target=lambda: keys.append(pool.get())) for _ in range(40)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    stats = pool.stats()
+    # 每把金鑰只發出一次
+    assert len(set(keys)) == 40
+    assert stats["served"] == 20 and stats["misses"] == 20
+    assert stats["minted"] == sessions.calls == 40
+
+def test_background_thread_fills_pool():
+    sessions = FakeSessions()
+    pool = KeyPool(sessions.create, target=3, low_watermark=2, interval=0.01)
+    pool.start()
+    pool.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(pool.keys) < 3:
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.01)
+    finally:
+        pool.stop()
+    assert sessions.calls == 3
+
+if __name__ == "__main__":
+    test_refill_to_target_below_low_watermark()
+    test_prune_discards_keys_about_to_expire()
+    test_miss_mints_on_demand()
+    test_concurrent_gets_are_counted()
+    test_background_thread_fills_pool()
+    print("ok")
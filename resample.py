@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import numpy as np
+
+# Realtime API 的 pcm16 格式與取樣率轉換，只依賴 NumPy，不會載入 pyaudio、
+# sounddevice 等需要音效裝置的套件；load_test.py、realtime_api_batch.py 這些
+# 在沒有音效裝置的伺服器上執行的程式只需要這個模組
+SAMPLE_RATE = 24000
+CHANNELS = 1
+
+class Resampler:
+    """以多相（polyphase）FIR 濾波器串流轉換 pcm16 的取樣率
+
+    轉換比例化簡成 up/down 的整數比（例如 48000 -> 24000 是 1/2，
+    44100 -> 24000 是 80/147），濾波器依相位拆成 up 組，每個輸出樣本
+    只需要計算一組 taps 個乘加。前一塊資料最後的 taps - 1 個樣本與
+    下一個輸出的位置會保留下來，所以可以一塊一塊地轉換，接縫處
+    不會有雜音
+    """
+
+    def __init__(self, from_rate: int, to_rate: int, taps: int = 32, beta: float = 8.0):
+        g = np.gcd(from_rate, to_rate)
+        self.up = to_rate // g
+        self.down = from_rate // g
+        self.taps = taps
+        # 截止頻率取兩邊取樣率中較低者的 Nyquist 頻率，保留一點過渡帶
+        cutoff = 0.45 / max(self.up, self.down)
+        n = taps * self.up
+        k = np.arange(n) - (n - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * k) * np.kaiser(n, beta) * self.up
+        # phases[r, j] = h[r + j * up]，依相位分組
+        self.phases = h.reshape(taps, self.up).T.astype(np.float32).copy()
+        # 裝置每次給的資料長度通常固定，依照 (起始位置, 長度) 快取取樣的索引與係數
+        self._plans: dict[tuple[int, int], tuple[np.ndarray, np.ndarray, int]] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.pos = 0  # 下一個輸出樣本相對於下一塊資料開頭的位置，以 1/up 個輸入樣本為單位
+
+    def _plan(self, n: int) -> tuple[np.ndarray, np.ndarray, int]:
+        plan = self._plans.get((self.pos, n))
+        if plan is not None:
+            return plan
+        end = n * self.up
+        count = max(0, -(-(end - self.pos) // self.down))
+        positions = self.pos + np.arange(count) * self.down
+        base = positions // self.up + self.taps - 1
+        # 每個輸出樣本取最近的 taps 個輸入樣本（由新到舊）與對應相位的係數相乘
+        index = base[:, None] - np.arange(self.taps)
+        plan = (index, self.phases[positions % self.up], count * self.down - end)
+        if len(self._plans) < 64:
+            self._plans[(self.pos, n)] = plan
+        return plan
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        if self.up == self.down:
+            return block
+        index, coeffs, advance = self._plan(len(block))
+        buf = np.concatenate((self.history, block.astype(np.float32)))
+        out = np.einsum("ij,ij->i", buf[index], coeffs)
+        self.pos += advance
+        self.history = buf[len(buf) - (self.taps - 1):]
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
@@ -1,13 +1,155 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
 from googlesearch import search
 from pydantic import BaseModel, Field
 
-def google_res(keyword, num_results=5, verbose=False):
-    content = "以下為已發生的事實：\n"               # 強調資料可信度
-    for res in search(keyword, advanced=True,    # 一一串接搜尋結果
-                      num_results=num_results,
-                      lang='zh-TW'):
-        content += f"標題：{res.title}\n" \
-                   f"摘要：{res.description}\n\n"
+# 搜尋結果的快取，相同的問題在 ttl 秒內直接傳回先前的結果。記憶體中最多
+# 保留 max_entries 筆，超過時移除最久沒用到的；指定 path 時另外存放在 sqlite
+# 資料庫中，讓多個行程共用。同時有多個相同的查詢時只會實際搜尋一次
+class SearchCache:
+    def __init__(self, ttl=600.0, max_entries=256, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # key -> (到期時間, 結果)
+        self.inflight = {}             # key -> 正在搜尋中的 Future
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS search_cache "
+                            "(key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            self.db.commit()
+        self.hits = 0        # 記憶體中找到
+        self.disk_hits = 0   # sqlite 中找到
+        self.misses = 0      # 實際搜尋
+        self.waits = 0       # 等待相同查詢的結果
+        self.evictions = 0
+        self.disk_errors = 0  # 讀寫 sqlite 失敗的次數
+
+    @staticmethod
+    def make_key(keyword, num_results, lang):
+        # 忽略大小寫與多餘的空白
+        keyword = " ".join(keyword.split()).casefold()
+        return json.dumps([keyword, num_results, lang], ensure_ascii=False)
+
+    def _get(self, key, now):
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+        if self.db is not None:
+            row = self._get_disk(key)
+            if row is not None and row[1] > now:
+                self.disk_hits += 1
+                self._put_memory(key, row[0], row[1])
+                return row[0]
+        return None
+
+    def _get_disk(self, key):
+        # 讀不到（例如其他行程正在寫入，database is locked）就當作沒有快取
+        try:
+            return self.db.execute(
+                "SELECT value, expires FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.disk_errors += 1
+            print(f"search cache: sqlite read failed: {e!r}")
+            return None
+
+    def _put_memory(self, key, value, expires):
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            value = self._get(key, time.time())
+            if value is not None:
+                return value
+            future = self.inflight.get(key)
+            if future is not None:
+                self.waits += 1
+                owner = False
+            else:
+                self.misses += 1
+                future = self.inflight[key] = Future()
+                owner = True
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+        expires = time.time() + self.ttl
+        try:
+            with self.lock:
+                self._put_memory(key, value, expires)
+                if self.db is not None:
+                    self._put_disk(key, value, expires)
+        finally:
+            # 不論寫入是否成功都要讓等待相同查詢的執行緒拿到結果
+            with self.lock:
+                del self.inflight[key]
+            future.set_result(value)
+        return value
+
+    def _put_disk(self, key, value, expires):
+        # sqlite 只是共用的快取，寫不進去（例如 database is locked）就算了
+        try:
+            # 順便清掉已經過期的結果
+            self.db.execute("DELETE FROM search_cache WHERE expires <= ?",
+                            (time.time(),))
+            self.db.execute("INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?)",
+                            (key, value, expires))
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.db.rollback()
+            self.disk_errors += 1
+            print(f"search cache: sqlite write failed: {e!r}")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM search_cache")
+                self.db.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits,
+                "misses": self.misses, "waits": self.waits,
+                "evictions": self.evictions, "disk_errors": self.disk_errors,
+                "entries": len(self.entries)}
+
+# 設定 SEARCH_CACHE_DB 環境變數就會把快取存放在該 sqlite 檔案中
+cache = SearchCache(path=os.environ.get("SEARCH_CACHE_DB"))
+
+def _google_res(keyword, num_results, lang):
+    results = [f"標題：{res.title}\n"
+               f"摘要：{res.description}\n\n"
+               for res in search(keyword, advanced=True,  # 一一串接搜尋結果
+                                 num_results=num_results,
+                                 lang=lang)]
+    return "以下為已發生的事實：\n" + "".join(results)  # 強調資料可信度
+
+def google_res(keyword, num_results=5, verbose=False, lang='zh-TW'):
+    content = cache.get_or_compute(
+        SearchCache.make_key(keyword, num_results, lang),
+        lambda: _google_res(keyword, num_results, lang),
+    )
     if verbose:
         print('------------')
         print(content)
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import struct
+import binascii
+import threading
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+from pydantic import BaseModel
+
+from event_router import json_field
+
+# 把每一條 Realtime API 連線收送的所有事件，連同單調時鐘的時間記錄到檔案中，
+# 之後可以用 session_replay.py 在離線時重播伺服端送來的事件。
+# 設定 RECORD_SESSION 環境變數，create_client() 建立的用戶端就會自動記錄：
+#
+#   RECORD_SESSION=session.rec python realtime_api_VAD.py
+#
+# 檔案是二進位格式，開頭是 MAGIC，接著一筆一筆的紀錄，每筆是固定長度的標頭
+# 加上 JSON 與音訊資料。response.audio.delta 的 delta 與
+# input_audio_buffer.append 的 audio 以原始的位元組存放（JSON 中留下空字串），
+# 比 base64 少 1/4；事件迴圈中只把收送的資料放進佇列，轉換與寫入都在背景執行緒
+RECORD_SESSION = os.environ.get("RECORD_SESSION")
+
+MAGIC = b"RTREC\x02\n"
+# 方向、音訊欄位、連線編號、時間（秒）、JSON 長度、音訊長度
+HEADER = struct.Struct("<BBIdII")
+# 無法記錄的事件只印出前幾次的錯誤，之後只計數
+MAX_ERRORS_SHOWN = 10
+
+CLIENT, SERVER, CONNECT = 0, 1, 2
+# 以原始位元組存放的欄位，索引就是標頭中的欄位代碼（0 表示沒有）
+AUDIO_FIELDS = (None, "delta", "audio")
+AUDIO_EVENTS = {"response.audio.delta": 1, "input_audio_buffer.append": 2}
+_SERVER_AUDIO = json_field(b"type", b"response.audio.delta")
+_TYPE = re.compile(rb'"type"\s*:\s*"([^"]*)"')
+_TYPE_WINDOW = 256  # 事件類型通常是第一個欄位
+
+@dataclass
+class Record:
+    direction: int     # CLIENT、SERVER 或 CONNECT
+    conn: int          # 連線編號，同一個行程中的多條連線依照建立的順序編號
+    t: float           # 從開始記錄算起的秒數
+    data: bytes        # 還原成原本的 JSON 訊息（音訊以 base64 放回）
+    size: int = 0      # 在檔案中佔的位元組數
+
+    def event(self) -> dict:
+        return json.loads(self.data)
+
+def event_type(data: bytes | str) -> str:
+    # 只取出事件類型，不必解碼整個 JSON（音訊可能很長）
+    if isinstance(data, str):
+        data = data.encode()
+    match = _TYPE.search(data)
+    return match.group(1).decode() if match else "?"
+
+def _split_audio(frame: bytes, field: str) -> tuple[bytes, bytes] | None:
+    # 把 JSON 中 field 的 base64 字串取出解碼，原位置留下空字串
+    match = json_field(field.encode()).search(frame)
+    if match is None:
+        return None
+    start = match.end()
+    end = frame.find(b'"', start)
+    if end < 0:
+        return None
+    return frame[:start] + frame[end:], binascii.a2b_base64(frame[start:end])
+
+class SessionRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.started = time.monotonic()
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.connections = 0
+        self.records = 0
+        self.json_bytes = 0     # 以原本的 JSON 訊息計算的大小
+        self.bytes_written = len(MAGIC)
+        self.errors = 0         # 無法記錄而略過的事件數
+        self.failed = False     # 寫入檔案失敗，之後的事件都不再記錄
+        self.closed = False
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+        # 程式結束時把佇列中的紀錄寫完
+        atexit.register(self.close)
+
+    # ---- 事件迴圈中呼叫，只記下時間並放進佇列 ----
+
+    def connect(self, **params: Any) -> int:
+        self.connections += 1
+        self.queue.put((CONNECT, self.connections, time.monotonic(), params))
+        return self.connections
+
+    def client_event(self, conn: int, event: Any) -> None:
+        self.queue.put((CLIENT, conn, time.monotonic(), event))
+
+    def server_event(self, conn: int, frame: bytes) -> None:
+        self.queue.put((SERVER, conn, time.monotonic(), frame))
+
+    def attach(self, connection, conn: int):
+        """包裝 AsyncRealtimeConnection 的 send() 與 recv_bytes()
+
+        connection.session.update() 等方法與 recv()、async for 也都是經過
+        這兩個方法，所以全部都會記錄到
+        """
+        send = connection.send
+        recv_bytes = connection.recv_bytes
+
+        async def recording_send(event) -> None:
+            self.client_event(conn, event)
+            await send(event)
+
+        async def recording_recv_bytes() -> bytes:
+            frame = await recv_bytes()
+            self.server_event(conn, frame)
+            return frame
+
+        connection.send = recording_send
+        connection.recv_bytes = recording_recv_bytes
+        return connection
+
+    # ---- 背景執行緒 ----
+
+    def _encode(self, direction: int, payload: Any) -> tuple[int, bytes, bytes]:
+        if direction == SERVER:
+            frame = payload if isinstance(payload, bytes) else payload.encode()
+            self.json_bytes += len(frame)
+            if _SERVER_AUDIO.search(frame, 0, _TYPE_WINDOW):
+                split = _split_audio(frame, "delta")
+                if split is not None:
+                    return AUDIO_EVENTS["response.audio.delta"], *split
+            return 0, frame, b""
+        if isinstance(payload, BaseModel):
+            payload = payload.to_dict()
+        event = dict(payload)
+        field = AUDIO_EVENTS.get(event.get("type"), 0) if direction == CLIENT else 0
+        audio = b""
+        if field:
+            name = AUDIO_FIELDS[field]
+            audio = binascii.a2b_base64(event[name])
+            event[name] = ""
+        data = json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+        self.json_bytes += len(data) + len(audio) * 4 // 3
+        return field, data, audio
+
+    def _writer(self) -> None:
+        # 不論發生什麼錯誤都要繼續從佇列取出事件，否則佇列會無限制地變大
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.failed:
+                continue
+            direction, conn, t, payload = item
+            try:
+                field, data, audio = self._encode(direction, payload)
+                record = b"".join((HEADER.pack(direction, field, conn, t - self.started,
+                                               len(data), len(audio)), data, audio))
+            except Exception as exc:
+                # 例如無法轉成 JSON 的事件，略過這一筆，檔案仍然是完整的
+                self.errors += 1
+                if self.errors <= MAX_ERRORS_SHOWN:
+                    print(f"session recorder: skipped an event: {exc!r}")
+                continue
+            try:
+                self.file.write(record)
+            except OSError as exc:
+                # 寫到一半的紀錄在讀取時會被當成檔案結尾，之後就不再寫入
+                self.failed = True
+                print(f"session recorder: stopped recording to {self.path}: {exc!r}")
+                continue
+            self.records += 1
+            self.bytes_written += len(record)
+        try:
+            self.file.close()
+        except OSError as exc:
+            print(f"session recorder: cannot close {self.path}: {exc!r}")
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.report()
+
+    def report(self) -> None:
+        ratio = self.bytes_written / self.json_bytes if self.json_bytes else 0.0
+        print(f"recorded {self.records} events on {self.connections} connections to {self.path}: "
+              f"{self.bytes_written / 1000:.1f}KB ({ratio * 100:.0f}% of the JSON size)"
+              + (f", {self.errors} events skipped" if self.errors else "")
+              + (", stopped after a write error" if self.failed else ""))
+
+class RecordingConnect:
+    # 包裝 client.beta.realtime.connect() 傳回的物件，連上後開始記錄
+    def __init__(self, manager, recorder: SessionRecorder, params: dict):
+        self.manager = manager
+        self.recorder = recorder
+        self.params = params
+
+    async def __aenter__(self):
+        connection = await self.manager.__aenter__()
+        conn = self.recorder.connect(**self.params)
+        return self.recorder.attach(connection, conn)
+
+    async def __aexit__(self, *exc_info):
+        return await self.manager.__aexit__(*exc_info)
+
+def record_client(client, recorder: SessionRecorder):
+    # 讓 client.beta.realtime.connect() 建立的每一條連線都記錄下來
+    realtime = client.beta.realtime
+    connect = realtime.connect
+
+    def recording_connect(**kwargs: Any) -> RecordingConnect:
+        params = {"model": kwargs.get("model"), "extra_query": kwargs.get("extra_query")}
+        return RecordingConnect(connect(**kwargs), recorder, params)
+
+    realtime.connect = recording_connect
+    return client
+
+def read_records(path: str) -> Iterator[Record]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+        while header := f.read(HEADER.size):
+            if len(header) < HEADER.size:
+                break  # 記錄到一半就中止的檔案
+            direction, field, conn, t, json_len, audio_len = HEADER.unpack(header)
+            data = f.read(json_len)
+            audio = f.read(audio_len)
+            if len(data) < json_len or len(audio) < audio_len:
+                break
+            if field:
+                # 把音訊以 base64 放回 JSON 中原本的位置
+                at = json_field(AUDIO_FIELDS[field].encode()).search(data).end()
+                data = data[:at] + binascii.b2a_base64(audio, newline=False) + data[at:]
+            yield Record(direction, conn, t, data, HEADER.size + json_len + audio_len)
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import sys
+import time
+import asyncio
+import argparse
+import importlib
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from openai.resources.beta.realtime.realtime import AsyncRealtimeConnection
+from websockets.exceptions import ConnectionClosedOK
+from websockets.frames import Close
+
+import audio_util
+from resample import SAMPLE_RATE
+from session_recorder import CLIENT, CONNECT, SERVER, Record, event_type, read_records
+
+# 在離線時重播 session_recorder.py 記錄的交談階段：伺服端送來的事件依照原本的
+# 時間間隔（或加速）交給原本的處理函式，不需要連網，每次執行收到的事件都一樣，
+# 適合用來重現與分析用戶端的處理時間：
+#
+#   python session_replay.py session.rec --info
+#   python session_replay.py session.rec --target realtime_api_VAD --speed 0 --profile
+#   python session_replay.py session.rec --target push_to_talk_app
+#
+# ReplayClient 可以取代 create_client() 傳回的 AsyncOpenAI，每次
+# client.beta.realtime.connect() 依序取得記錄中的下一條連線；連線的物件就是
+# openai 套件的 AsyncRealtimeConnection，只有底層的 websocket 換成記錄的內容，
+# 用戶端送出的事件只計數不會送到任何地方。範例程式在匯入時就會建立
+# AudioPlayerAsync，所以匯入前先換成不開啟音效裝置的 NullAudioPlayer，
+# 沒有音效裝置的機器上也能重播；加上 --play 才會真的播放回應的語音
+
+class NullStream:
+    """取代 sounddevice.OutputStream，不開啟音效裝置"""
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class NullAudioPlayer(audio_util.AudioPlayerAsync):
+    """收到的語音照常解碼寫進緩衝區（處理時間和實際播放時相同），再直接丟掉"""
+
+    def __init__(self, *args, **kwargs):
+        # 不查詢裝置的取樣率
+        kwargs.setdefault("rate", SAMPLE_RATE)
+        super().__init__(*args, **kwargs)
+
+    def _open_stream(self) -> NullStream:
+        return NullStream()
+
+    def start(self) -> None:
+        # 不會有 callback 讀取緩衝區，維持沒有在播放的狀態，flush() 就會直接清空
+        pass
+
+    def add_data(self, data: bytes) -> None:
+        super().add_data(data)
+        self.ring.clear()
+
+    def add_base64(self, delta: str | bytes | memoryview) -> None:
+        super().add_base64(delta)
+        self.ring.clear()
+
+class ReplaySocket:
+    """提供 AsyncRealtimeConnection 需要的 recv()、send()、close()"""
+
+    def __init__(self, client: ReplayClient, frames: list[Record], last: bool):
+        self.client = client
+        self.frames = frames
+        self.last = last  # 記錄中的最後一條連線，播完就結束重播
+        self.index = 0
+        self.started = time.monotonic()
+        self.t0 = frames[0].t if frames else 0.0
+
+    async def recv(self, decode: bool = True) -> bytes | str:
+        if self.index >= len(self.frames):
+            if not self.last:
+                # 記錄中這條連線斷了，讓用戶端像平常一樣重新連線
+                raise ConnectionClosedOK(Close(1000, "replay"), None)
+            # 上一個事件已經處理完了（處理函式是依序執行的）
+            self.client.finished.set()
+            await asyncio.Future()
+        record = self.frames[self.index]
+        self.index += 1
+        if self.client.speed > 0:
+            # 依照記錄的時間間隔送出，speed=2 就是兩倍速
+            due = self.started + (record.t - self.t0) / self.client.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self.client.replayed += 1
+        return record.data.decode() if decode else record.data
+
+    async def send(self, data: bytes | str) -> None:
+        self.client.sent[event_type(data)] += 1
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        pass
+
+class ReplayClient:
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed  # 0 表示不等待，盡快送出
+        # 依照連線編號分開，並依照連上的順序排列
+        self.order: list[int] = []
+        self.server: dict[int, list[Record]] = defaultdict(list)
+        self.recorded: Counter[str] = Counter()  # 記錄中用戶端送出的事件
+        for record in read_records(path):
+            if record.direction == CONNECT:
+                self.order.append(record.conn)
+            elif record.direction == SERVER:
+                self.server[record.conn].append(record)
+            elif record.direction == CLIENT:
+                self.recorded[event_type(record.data)] += 1
+        self.next = 0
+        self.replayed = 0
+        self.sent: Counter[str] = Counter()  # 重播時用戶端送出的事件
+        self.finished = asyncio.Event()
+        # 模仿 AsyncOpenAI 的 client.beta.realtime.connect(...)
+        self.beta = SimpleNamespace(realtime=SimpleNamespace(connect=self.connect))
+
+    @asynccontextmanager
+    async def connect(self, **kwargs):
+        if self.next >= len(self.order):
+            # 記錄中已經沒有連線了，等待結束重播
+            self.finished.set()
+            await asyncio.Future()
+        conn = self.order[self.next]
+        self.next += 1
+        socket = ReplaySocket(self, self.server[conn], last=self.next == len(self.order))
+        yield AsyncRealtimeConnection(socket)
+
+    def report(self, elapsed: float) -> None:
+        print("== replay ==")
+        print(f"{self.replayed} server events on {self.next} connections in {elapsed:.2f}s "
+              f"({self.replayed / max(elapsed, 1e-9):.0f} events/s)")
+        # 用戶端送出的事件與記錄時不同，表示處理的結果不一樣
+        for name in sorted(set(self.recorded) | set(self.sent)):
+            recorded, sent = self.recorded[name], self.sent[name]
+            mark = "" if recorded == sent else "  <- differs"
+            print(f"{name:<40} recorded {recorded:6d} replayed {sent:6d}{mark}")
+
+def info(path: str) -> None:
+    counts: Counter[tuple[int, str]] = Counter()
+    sizes: Counter[int] = Counter()
+    connections = 0
+    duration = 0.0
+    for record in read_records(path):
+        duration = record.t
+        sizes[record.direction] += record.size
+        if record.direction == CONNECT:
+            connections += 1
+            continue
+        counts[(record.direction, event_type(record.data))] += 1
+    print(f"{path}: {connections} connections, {duration:.1f}s, "
+          f"client {sizes[CLIENT] / 1000:.1f}KB, server {sizes[SERVER] / 1000:.1f}KB")
+    for (direction, name), n in sorted(counts.items()):
+        print(f"{'client' if direction == CLIENT else 'server'} {name:<50} {n:7d}")
+
+async def replay_script(module, client: ReplayClient) -> None:
+    # realtime_api_VAD*.py：以重播的用戶端執行 handle_realtime_connection()
+    module.create_client = lambda: client
+    task = asyncio.create_task(module.handle_realtime_connection())
+    await client.finished.wait()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    for name in ("tracer", "router", "manager", "audio_player"):
+        obj = getattr(module, name, None)
+        if obj is not None:
+            obj.report()
+
+async def replay_app(module, client: ReplayClient) -> None:
+    # push_to_talk_app.py：不顯示畫面執行 RealtimeApp
+    module.create_client = lambda: client
+    app = module.RealtimeApp()
+    async with app.run_test(headless=True):
+        await client.finished.wait()
+    app.tracer.report()
+    app.router.report()
+    app.audio_player.report()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="重播記錄下來的 Realtime API 交談階段")
+    parser.add_argument("path", help="以 RECORD_SESSION 記錄的檔案")
+    parser.add_argument("--info", action="store_true", help="只印出記錄的內容摘要")
+    parser.add_argument("--target", default="realtime_api_VAD",
+                        help="要執行的範例程式模組，例如 realtime_api_VAD_tools 或 push_to_talk_app")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="重播速度的倍數，0 表示不等待盡快送出")
+    parser.add_argument("--profile", action="store_true", help="以 cProfile 分析用戶端的處理")
+    parser.add_argument("--play", action="store_true", help="以音效裝置播放回應的語音")
+    args = parser.parse_args()
+    if args.info:
+        info(args.path)
+        return
+
+    if not args.play:
+        # 範例程式以 from audio_util import AudioPlayerAsync 取得播放端，要在匯入前替換
+        audio_util.AudioPlayerAsync = NullAudioPlayer
+    module = importlib.import_module(args.target)
+    replay = replay_app if hasattr(module, "RealtimeApp") else replay_script
+
+    async def run() -> None:
+        client = ReplayClient(args.path, speed=args.speed)
+        start = time.perf_counter()
+        await replay(module, client)
+        client.report(time.perf_counter() - start)
+
+    if not args.profile:
+        asyncio.run(run())
+        return
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    asyncio.run(run())
+    profiler.disable()
+    pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(30)
+
+if __name__ == "__main__":
+    main()
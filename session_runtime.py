@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import time
+import asyncio
+import itertools
+from typing import Any, Protocol
+
+from g711 import AUDIO_FORMAT
+from audio_sender import AudioSender
+from b64_decode import Base64Decoder
+from connection_manager import ConnectionManager
+from event_router import EventRouter
+from latency_trace import LatencyTracer, percentile
+from realtime_util import audio_format_session
+
+# 在同一個事件迴圈中同時執行多個互相獨立的 Realtime API 交談階段。
+# 範例程式都把 connection、audio_player 等狀態放在模組層級的全域變數，
+# 一個行程只能服務一個使用者；這裡把每個交談階段需要的狀態都放在
+# RealtimeSession 物件中：
+#
+#   runtime = SessionRuntime(create_client())
+#   session = runtime.add(RealtimeSession(sink=AudioPlayerAsync()))
+#   session.feed(pcm16)      # 麥克風或其他來源的 24kHz pcm16
+#   ...
+#   await runtime.close()
+#   runtime.report()
+
+class AudioSink(Protocol):
+    # 接收回應語音的物件，例如 AudioPlayerAsync，直接收下 base64 的資料
+    def add_base64(self, delta: str | bytes | memoryview) -> None: ...
+    # 回應結束，播完之後沒有資料不算是 underrun
+    def end_response(self) -> None: ...
+
+_session_ids = itertools.count(1)
+
+class RealtimeSession:
+    def __init__(self, session: dict | None = None, sink: AudioSink | None = None,
+                 name: str | None = None, packet_ms: float = 60, replay: bool = True,
+                 extra_query: dict | None = None, audio_format: str = AUDIO_FORMAT):
+        self.name = name or f"session-{next(_session_ids)}"
+        self.sink = sink
+        # 送出的音訊與 session 中的 input_audio_format 都由 audio_format 決定，
+        # 不會一邊是 G.711 另一邊是 pcm16
+        formats = audio_format_session(audio_format)
+        for key, value in (session or {}).items():
+            if key in formats and value != formats[key]:
+                raise ValueError(f"session {key}={value!r} does not match "
+                                 f"audio_format={audio_format!r}")
+        session = {**(session or {}), **formats}
+        self.router = EventRouter()
+        self.manager = ConnectionManager(self.router, session=session,
+                                         extra_query=extra_query, replay=replay)
+        self.sender = AudioSender(packet_ms=packet_ms, audio_format=audio_format)
+        self.tracer = LatencyTracer(on_span=None)
+        self.sender_task: asyncio.Task | None = None
+        self.response_id: str | None = None
+
+        self.audio_bytes_in = 0  # 收到的回應語音位元組數
+        self.responses = 0
+        self.errors = 0
+        self.last_error: str | None = None
+
+        self.manager.on_connect(self.on_connect)
+        self.router.on("input_audio_buffer.speech_stopped", raw=True)(self.on_speech_stopped)
+        self.router.on("response.created", raw=True)(self.on_response_created)
+        self.router.on("response.audio.delta", raw=True, payload="delta")(self.on_audio_delta)
+        self.router.on("response.done", raw=True)(self.on_response_done)
+        self.router.on("error", raw=True)(self.on_error)
+
+    @property
+    def connection(self):
+        return self.manager.connection
+
+    def on_connect(self, conn) -> None:
+        # 每條新的連線都重新啟動傳送音訊的工作
+        if self.sender_task is not None:
+            self.sender_task.cancel()
+        self.sender_task = asyncio.create_task(self.sender.run(conn))
+        self.response_id = None
+
+    def on_speech_stopped(self, event: dict) -> None:
+        self.tracer.speech_stopped()
+
+    def on_response_created(self, event: dict) -> None:
+        self.response_id = event["response"]["id"]
+        self.tracer.response_created(self.response_id)
+
+    def on_audio_delta(self, event: dict) -> None:
+        self.tracer.audio_delta(event["item_id"])
+        delta = event["delta"]
+        # 不解碼也能從 base64 的長度算出資料量
+        self.audio_bytes_in += Base64Decoder.decoded_size(Base64Decoder.source(delta))
+        if self.sink is not None:
+            self.sink.add_base64(delta)
+
+    def on_response_done(self, event: dict) -> None:
+        self.response_id = None
+        self.responses += 1
+        if self.sink is not None:
+            self.sink.end_response()
+
+    def on_error(self, event: dict) -> None:
+        self.errors += 1
+        self.last_error = event["error"]["message"]
+
+    def feed(self, data: bytes) -> None:
+        # 還沒連上時也可以送進來，會在 AudioSender 中排隊
+        self.sender.feed(data)
+
+    async def run(self, client) -> None:
+        await self.manager.run(client)
+
+    async def close(self) -> None:
+        if self.sender_task is not None:
+            self.sender_task.cancel()
+        await self.manager.close()
+        # 收尾還沒結束的這一輪，統計時才算得到
+        self.tracer.finish()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "connected": self.manager.connected.is_set(),
+            "messages_in": sum(self.router.counts.values()),
+            "messages_out": self.sender.packets_sent,
+            "audio_bytes_out": self.sender.bytes_sent,
+            "audio_bytes_in": self.audio_bytes_in,
+            "responses": self.responses,
+            "errors": self.errors,
+            "drops": self.manager.drops,
+        }
+
+class LoopLagMonitor:
+    """量測事件迴圈的延遲：預定 interval 秒後醒來，實際晚了多久"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lag_ms: list[float] = []
+        self.task: asyncio.Task | None = None
+
+    async def run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag_ms.append((time.perf_counter() - start - self.interval) * 1000)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+    def summary(self) -> dict[str, float]:
+        if not self.lag_ms:
+            return {}
+        return {
+            "p50": percentile(self.lag_ms, 50),
+            "p95": percentile(self.lag_ms, 95),
+            "p99": percentile(self.lag_ms, 99),
+            "max": max(self.lag_ms),
+        }
+
+class SessionRuntime:
+    def __init__(self, client, monitor_interval: float = 0.05):
+        self.client = client  # 所有交談階段共用同一個 AsyncOpenAI 用戶端
+        self.sessions: dict[str, RealtimeSession] = {}
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.monitor = LoopLagMonitor(monitor_interval)
+        self.started = time.monotonic()
+        self.cpu_started = time.process_time()
+
+    def add(self, session: RealtimeSession) -> RealtimeSession:
+        if not self.sessions:
+            self.monitor.start()
+            self.started = time.monotonic()
+            self.cpu_started = time.process_time()
+        self.sessions[session.name] = session
+        self.tasks[session.name] = asyncio.create_task(session.run(self.client))
+        return session
+
+    async def remove(self, name: str) -> None:
+        session = self.sessions.pop(name)
+        task = self.tasks.pop(name)
+        await session.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def close(self) -> None:
+        for name in list(self.sessions):
+            await self.remove(name)
+        self.monitor.stop()
+
+    def stats(self, sessions: list[RealtimeSession] | None = None) -> dict[str, Any]:
+        sessions = list(self.sessions.values()) if sessions is None else sessions
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        cpu = time.process_time() - self.cpu_started
+        rows = [session.stats() for session in sessions]
+        total = {key: sum(row[key] for row in rows)
+                 for key in ("messages_in", "messages_out", "audio_bytes_in",
+                             "audio_bytes_out", "responses", "errors", "drops")}
+        spans = [ms for session in sessions for span in session.tracer.spans
+                 if (ms := span.latency_ms("first_delta")) is not None]
+        return {
+            "sessions": len(rows),
+            "connected": sum(row["connected"] for row in rows),
+            "elapsed_s": elapsed,
+            **total,
+            "messages_per_s": (total["messages_in"] + total["messages_out"]) / elapsed,
+            "cpu_percent": cpu / elapsed * 100,
+            "cpu_percent_per_session": cpu / elapsed * 100 / max(1, len(rows)),
+            "loop_lag_ms": self.monitor.summary(),
+            "first_delta_p50_ms": percentile(spans, 50) if spans else None,
+            "first_delta_p95_ms": percentile(spans, 95) if spans else None,
+        }
+
+    def report(self, stats: dict[str, Any] | None = None) -> None:
+        stats = stats or self.stats()
+        elapsed = stats["elapsed_s"]
+        print(f"== {stats['sessions']} sessions over {elapsed:.1f}s ==")
+        print(f"connected {stats['connected']}, responses {stats['responses']}, "
+              f"errors {stats['errors']}, drops {stats['drops']}")
+        print(f"messages in {stats['messages_in'] / elapsed:.0f}/s, "
+              f"out {stats['messages_out'] / elapsed:.0f}/s, "
+              f"total {stats['messages_per_s']:.0f}/s")
+        print(f"audio in {stats['audio_bytes_in'] / elapsed / 1000:.0f} KB/s, "
+              f"out {stats['audio_bytes_out'] / elapsed / 1000:.0f} KB/s (base64)")
+        print(f"CPU {stats['cpu_percent']:.1f}% total, "
+              f"{stats['cpu_percent_per_session']:.2f}% per session")
+        lag = stats["loop_lag_ms"]
+        if lag:
+            print(f"event loop lag p50={lag['p50']:.1f}ms p95={lag['p95']:.1f}ms "
+                  f"p99={lag['p99']:.1f}ms max={lag['max']:.1f}ms")
+        if stats["first_delta_p50_ms"] is not None:
+            print(f"speech_stopped -> first delta p50={stats['first_delta_p50_ms']:.0f}ms "
+                  f"p95={stats['first_delta_p95_ms']:.0f}ms")
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import numpy as np
+
+from audio_util import JitterBuffer, RingBuffer, chunks_to_16bit_pcm, float_to_16bit_pcm
+from resample import SAMPLE_RATE
+
+# 不需要音訊裝置，測試音訊格式的轉換與播放端使用的緩衝區，JitterBuffer 使用模擬的時間：
+#
+#   python -m pytest test_audio_util.py
+#   python test_audio_util.py
+
+def samples(start: int, n: int) -> np.ndarray:
+    return np.arange(start, start + n, dtype=np.int16)
+
+def test_ring_buffer_wraps_around():
+    ring = RingBuffer(8)
+    out = np.zeros(5, dtype=np.int16)
+    assert ring.write(samples(0, 6)) == 6
+    assert ring.read_into(out) == 5
+    # 寫入的資料跨過緩衝區尾端，讀出時順序不變
+    assert ring.write(samples(6, 7)) == 7
+    assert ring.available() == 8
+    out = np.zeros(8, dtype=np.int16)
+    assert ring.read_into(out) == 8
+    assert out.tolist() == list(range(5, 13))
+
+def test_ring_buffer_overrun_keeps_oldest():
+    ring = RingBuffer(4)
+    assert ring.write(samples(0, 6)) == 4
+    assert ring.overruns == 2
+    out = np.zeros(4, dtype=np.int16)
+    ring.read_into(out)
+    assert out.tolist() == [0, 1, 2, 3]
+
+def test_ring_buffer_clear():
+    ring = RingBuffer(8)
+    out = np.zeros(4, dtype=np.int16)
+    ring.write(samples(0, 6))
+    ring.read_into(out)
+    ring.request_clear()
+    assert ring.clear_pending()
+    # 清除要求之後才寫入的資料會保留
+    ring.write(samples(100, 2))
+    assert ring.read_into(out) == 2
+    assert out[:2].tolist() == [100, 101]
+    assert not ring.clear_pending()
+    # 刻意清除造成的沒有資料不算是 underrun
+    assert ring.underruns == 0
+    ring.write(samples(0, 3))
+    ring.clear()
+    assert ring.available() == 0 and ring.read_into(out) == 0
+    assert ring.underruns == 0
+
+def test_ring_buffer_counts_underruns_once():
+    ring = RingBuffer(16)
+    out = np.zeros(4, dtype=np.int16)
+    # 還沒開始播放時沒有資料不算
+    assert ring.read_into(out) == 0
+    ring.write(samples(0, 6))
+    ring.read_into(out)
+    ring.read_into(out)
+    ring.read_into(out)
+    assert ring.underruns == 1
+    ring.write(samples(0, 4))
+    ring.read_into(out)
+    ring.read_into(out)
+    assert ring.underruns == 2
+
+def test_ring_buffer_prefill_read_keeps_starved_state():
+    ring = RingBuffer(16)
+    out = np.zeros(4, dtype=np.int16)
+    ring.write(samples(0, 4))
+    ring.read_into(out)
+    ring.read_into(out)
+    assert ring.underruns == 1
+    # 預先緩衝時的 read_into(out[:0]) 不會讓下一次沒有資料再算一次
+    ring.read_into(out[:0])
+    ring.read_into(out)
+    assert ring.underruns == 1
+
+def test_ring_buffer_end_of_response_is_a_drain():
+    ring = RingBuffer(16)
+    out = np.zeros(4, dtype=np.int16)
+    ring.write(samples(0, 6))
+    ring.mark_end()
+    ring.read_into(out)
+    ring.read_into(out)
+    assert ring.drains == 1 and ring.underruns == 0
+    # 下一個回應播到一半沒有資料仍然是 underrun
+    ring.write(samples(0, 6))
+    ring.read_into(out)
+    ring.read_into(out)
+    assert ring.drains == 1 and ring.underruns == 1
+
+def test_float_to_16bit_pcm_clips_and_truncates():
+    pcm = float_to_16bit_pcm(np.array([0.0, 0.5, -0.5, 1.5, -1.5], dtype=np.float32))
+    # 和原本的 int(x * 32767) 一樣直接捨去小數
+    assert pcm.tolist() == [0, 16383, -16383, 32767, -32767]
+
+def test_chunks_fill_out_in_order():
+    chunks = [np.full(3, 0.1, dtype=np.float32), np.full(2, 0.2, dtype=np.float32)]
+    out = np.zeros(8, dtype=np.int16)
+    pcm = chunks_to_16bit_pcm(chunks, out=out)
+    # 全部放得下時傳回 out 的 view
+    assert isinstance(pcm, np.ndarray) and np.shares_memory(pcm, out)
+    assert pcm.tolist() == [3276] * 3 + [6553] * 2
+
+def test_chunks_keep_order_after_overflow():
+    sizes = [3, 4, 1, 2]
+    chunks = [np.full(n, (i + 1) / 10, dtype=np.float32) for i, n in enumerate(sizes)]
+    expected = b"".join(float_to_16bit_pcm(c).tobytes() for c in chunks)
+    # 第二段放不下 out，之後比較短的第三段雖然放得下，也要接在第二段後面
+    assert chunks_to_16bit_pcm(chunks, out=np.zeros(5, dtype=np.int16)) == expected
+    assert chunks_to_16bit_pcm(iter(chunks), out=np.zeros(5, dtype=np.int16)) == expected
+    assert chunks_to_16bit_pcm(chunks) == expected
+
+PACKET = SAMPLE_RATE // 10  # 每個片段 100ms
+
+def play_burst(jitter: JitterBuffer, start: float, lateness_ms: list[float]) -> float:
+    # 第一個片段準時在 start 到達，之後的片段依序晚到 lateness_ms；
+    # 緩衝區中一直有資料，所以不會重新累積
+    jitter.arrived(PACKET, 0, start)
+    now = start
+    for k, late in enumerate(lateness_ms, 1):
+        now = start + k * 0.1 + late / 1000
+        jitter.arrived(PACKET, PACKET, now)
+    jitter.end()
+    return now + 1.0
+
+def test_jitter_target_follows_lateness_percentile():
+    jitter = JitterBuffer(min_prefill_ms=10, max_prefill_ms=400, quantile=50)
+    assert jitter.target_ms == 10
+    now = play_burst(jitter, 0.0, [30, 50, 20])
+    # 下一段語音開始時才更新目標，取晚到毫秒數的中位數
+    assert jitter.target_ms == 10
+    jitter.arrived(PACKET, 0, now)
+    assert abs(jitter.target_ms - 30) < 1e-6
+    assert jitter.buffering and not jitter.ready(now + 0.029)
+    assert jitter.ready(now + 0.031)
+    stats = jitter.stats()
+    assert stats["bursts"] == 2 and stats["late"] == 3 and stats["rebuffers"] == 0
+
+def test_jitter_target_is_clamped():
+    jitter = JitterBuffer(min_prefill_ms=10, max_prefill_ms=100)
+    now = play_burst(jitter, 0.0, [300, 300, 300])
+    jitter.arrived(PACKET, 0, now)
+    assert jitter.target_ms == 100
+    jitter = JitterBuffer(min_prefill_ms=10, max_prefill_ms=100)
+    now = play_burst(jitter, 0.0, [0, 0, 0])
+    jitter.arrived(PACKET, 0, now)
+    assert jitter.target_ms == 10
+
+def test_jitter_fixed_prefill_does_not_adapt():
+    jitter = JitterBuffer(prefill_ms=50)
+    now = play_burst(jitter, 0.0, [300, 200, 250])
+    jitter.arrived(PACKET, 0, now)
+    assert jitter.target_ms == 50
+    assert not jitter.ready(now + 0.049) and jitter.ready(now + 0.051)
+
+def test_jitter_rebuffers_when_starved():
+    jitter = JitterBuffer(prefill_ms=50)
+    jitter.arrived(PACKET, 0, 0.0)
+    assert jitter.ready(0.06)
+    # 播放到一半緩衝區已經空了才收到下一個片段
+    jitter.arrived(PACKET, 0, 0.16)
+    assert jitter.rebuffers == 1 and jitter.late == 1
+    assert not jitter.ready(0.2) and jitter.ready(0.22)
+
+if __name__ == "__main__":
+    test_float_to_16bit_pcm_clips_and_truncates()
+    test_chunks_fill_out_in_order()
+    test_chunks_keep_order_after_overflow()
+    test_jitter_target_follows_lateness_percentile()
+    test_jitter_target_is_clamped()
+    test_jitter_fixed_prefill_does_not_adapt()
+    test_jitter_rebuffers_when_starved()
+    test_ring_buffer_wraps_around()
+    test_ring_buffer_overrun_keeps_oldest()
+    test_ring_buffer_clear()
+    test_ring_buffer_counts_underruns_once()
+    test_ring_buffer_prefill_read_keeps_starved_state()
+    test_ring_buffer_end_of_response_is_a_drain()
+    print("ok")
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import base64
+import binascii
+
+import numpy as np
+
+from b64_decode import Base64Decoder
+
+# 比對 Base64Decoder 與 base64.b64decode 的解碼結果：
+#
+#   python -m pytest test_b64_decode.py
+#   python test_b64_decode.py
+
+def decode(decoder: Base64Decoder, data: str | bytes | memoryview) -> bytes:
+    src = decoder.source(data)
+    out = np.zeros(decoder.buffer_size(src) + 4, dtype=np.uint8)
+    n = decoder.decode_into(src, out)
+    assert n == decoder.decoded_size(src)
+    return out[:n].tobytes()
+
+def test_matches_b64decode_for_all_input_types():
+    decoder = Base64Decoder(capacity=8)
+    rng = np.random.default_rng(0)
+    # 長度除以 3 的餘數是 0、1、2，分別沒有補齊、補兩個 =、補一個 =
+    for size in (0, 1, 2, 3, 4, 5, 100, 4801):
+        raw = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        encoded = base64.b64encode(raw)
+        for data in (encoded, encoded.decode("ascii"), memoryview(b"x" + encoded + b"y")[1:-1]):
+            assert decode(decoder, data) == base64.b64decode(data) == raw
+    # 超過 capacity 時自動加大
+    assert decoder.capacity >= len(base64.b64encode(bytes(4801)))
+
+def test_padding_sizes():
+    decoder = Base64Decoder()
+    for encoded, size in ((b"", 0), (b"QQ==", 1), (b"QUI=", 2), (b"QUJD", 3)):
+        src = decoder.source(encoded)
+        assert decoder.decoded_size(src) == size
+        assert decoder.buffer_size(src) == len(encoded) // 4 * 3
+        assert decode(decoder, encoded) == base64.b64decode(encoded)
+
+def expect_error(decoder: Base64Decoder, data: bytes) -> None:
+    try:
+        decode(decoder, data)
+    except binascii.Error:
+        pass
+    else:
+        raise AssertionError(f"{data!r} should raise binascii.Error")
+    # base64.b64decode 同樣會拒絕
+    try:
+        base64.b64decode(data, validate=True)
+    except binascii.Error:
+        return
+    raise AssertionError(f"b64decode accepted {data!r}")
+
+def test_invalid_input_raises():
+    decoder = Base64Decoder()
+    expect_error(decoder, b"QUJ")       # 長度不是 4 的倍數
+    expect_error(decoder, b"QU*D")      # 不在字母表中的字元
+    expect_error(decoder, b"QUJD\nQUJD")
+    # 出錯之後仍然可以繼續使用
+    assert decode(decoder, b"QUJD") == b"ABC"
+
+if __name__ == "__main__":
+    test_matches_b64decode_for_all_input_types()
+    test_padding_sizes()
+    test_invalid_input_raises()
+    print("ok")
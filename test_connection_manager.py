@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import socket
+import asyncio
+import base64
+from http import HTTPStatus
+
+import numpy as np
+from openai import AsyncOpenAI
+from websockets.asyncio.server import serve
+from websockets.exceptions import InvalidStatus
+
+from connection_manager import ConnectionManager
+from event_router import EventRouter
+from realtime_stub_server import SAMPLE_RATE, StubOptions, StubServer
+
+# 以 realtime_stub_server.py 測試斷線重連後使用者的問題有沒有重建回對話中，
+# 以及連線被拒絕或一直連不上時會放棄重試：
+#
+#   python -m pytest test_connection_manager.py
+#   python test_connection_manager.py
+
+async def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+async def user_turn_after_reconnect() -> list[dict]:
+    tone = (np.sin(np.arange(SAMPLE_RATE // 5) * 0.1) * 8000).astype(np.int16).tobytes()
+    server = StubServer(StubOptions(pace=0, audio=tone))
+    async with serve(server.handler, "localhost", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        client = AsyncOpenAI(api_key="local", websocket_base_url=f"ws://localhost:{port}/v1")
+
+        router = EventRouter()
+        # 手動 commit，和 realtime_api_VAD_off.py 一樣
+        manager = ConnectionManager(router, session={"turn_detection": None},
+                                    min_backoff=0.01)
+        events: list[dict] = []
+        router.on_any(lambda event, size: events.append(event))
+        task = asyncio.create_task(manager.run(client))
+        try:
+            await wait_for(manager.connected.is_set)
+            conn = manager.connection
+            # 送出 200ms 的語音，讓伺服端產生使用者的項目與回應
+            await conn.input_audio_buffer.append(audio=base64.b64encode(tone).decode())
+            await conn.input_audio_buffer.commit()
+            await conn.response.create()
+            await wait_for(lambda: any(e["type"] == "response.done" for e in events))
+
+            events.clear()
+            server.kill_all()
+            await wait_for(lambda: manager.connects == 2 and manager.connected.is_set())
+            return [e["item"] for e in events
+                    if e["type"] == "conversation.item.created"
+                    and e["item"].get("role") == "user"]
+        finally:
+            await manager.close()
+            await asyncio.gather(task, return_exceptions=True)
+
+def test_user_turn_survives_reconnect():
+    items = asyncio.run(user_turn_after_reconnect())
+    assert len(items) == 1
+    assert items[0]["content"] == [{"type": "input_text", "text": "（模擬的語音轉錄）"}]
+
+async def rejected_connection() -> ConnectionManager:
+    # 伺服端以 401 拒絕連線，就像金鑰錯誤的時候
+    def reject(connection, request):
+        return connection.respond(HTTPStatus.UNAUTHORIZED, "invalid api key\n")
+
+    server = StubServer(StubOptions(pace=0))
+    async with serve(server.handler, "localhost", 0, process_request=reject) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        client = AsyncOpenAI(api_key="local", websocket_base_url=f"ws://localhost:{port}/v1")
+        manager = ConnectionManager(EventRouter(), min_backoff=0.01)
+        try:
+            await asyncio.wait_for(manager.run(client), 5)
+        except InvalidStatus as exc:
+            assert exc.response.status_code == 401
+            return manager
+        raise AssertionError("run() should raise on 401")
+
+def test_non_retryable_status_is_raised():
+    manager = asyncio.run(rejected_connection())
+    assert manager.failures == 1 and manager.connects == 0
+
+def unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+async def unreachable_server() -> ConnectionManager:
+    client = AsyncOpenAI(api_key="local",
+                         websocket_base_url=f"ws://localhost:{unused_port()}/v1")
+    manager = ConnectionManager(EventRouter(), min_backoff=0.01, max_attempts=3)
+    try:
+        await asyncio.wait_for(manager.run(client), 5)
+    except OSError:
+        return manager
+    raise AssertionError("run() should give up after max_attempts")
+
+def test_gives_up_after_max_attempts():
+    manager = asyncio.run(unreachable_server())
+    assert manager.failures == 3 and manager.connects == 0
+
+def test_transcription_argument():
+    router = EventRouter()
+    assert "input_audio_transcription" not in ConnectionManager(
+        router, transcription=None).session
+    assert ConnectionManager(router).session["input_audio_transcription"] == {
+        "model": "whisper-1"}
+    # session 中已經有設定就不會改變
+    manager = ConnectionManager(router, session={"input_audio_transcription": None})
+    assert manager.session["input_audio_transcription"] is None
+
+if __name__ == "__main__":
+    test_user_turn_survives_reconnect()
+    test_non_retryable_status_is_raised()
+    test_gives_up_after_max_attempts()
+    test_transcription_argument()
+    print("ok")
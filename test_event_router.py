@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import json
+import asyncio
+
+from event_router import EventRouter, json_field
+
+# 測試 payload 欄位的比對與切出，伺服端送來的 JSON 在冒號前後可能有也可能沒有空白：
+#
+#   python -m pytest test_event_router.py
+#   python test_event_router.py
+
+DELTA = "AAEC" * 8
+
+def message(separators: tuple[str, str], **fields) -> bytes:
+    return json.dumps({"type": "response.audio.delta", "response_id": "resp_1", **fields},
+                      separators=separators).encode()
+
+COMPACT = (",", ":")
+SPACED = (", ", ": ")
+
+def test_json_field_with_and_without_whitespace():
+    pattern = json_field(b"type", b"response.audio.delta")
+    for data in (b'{"type":"response.audio.delta"}', b'{"type" : "response.audio.delta"}',
+                 b'{"type":\n  "response.audio.delta"}'):
+        assert pattern.search(data), data
+    # 值要完全相同，不能只是開頭相同
+    assert not pattern.search(b'{"type":"response.audio.delta.extra"}')
+    assert not pattern.search(b'{"subtype":"response.audio.delta"}')
+    # 沒有指定值時比對到字串開頭的引號
+    match = json_field(b"delta").search(b'{"delta" :  "QUJD"}')
+    assert match and b'{"delta" :  "QUJD"}'[match.end():] == b'QUJD"}'
+
+def test_split_payload_returns_memoryview():
+    router = EventRouter()
+    router.add("response.audio.delta", lambda event: None, raw=True, payload="delta")
+    for separators in (COMPACT, SPACED):
+        data = message(separators, delta=DELTA, item_id="item_1")
+        event = router._split_payload(data)
+        assert isinstance(event["delta"], memoryview), separators
+        assert bytes(event["delta"]) == DELTA.encode()
+        # 其餘的欄位照常解碼
+        assert event["item_id"] == "item_1" and event["response_id"] == "resp_1"
+        assert event == {**json.loads(data), "delta": event["delta"]}
+
+def test_split_payload_falls_back():
+    router = EventRouter()
+    router.add("response.audio.delta", lambda event: None, raw=True, payload="delta")
+    # 其他類型的事件、沒有該欄位、欄位不是字串，都交給一般的 json.loads
+    assert router._split_payload(b'{"type":"response.done","delta":"QUJD"}') is None
+    assert router._split_payload(message(COMPACT)) is None
+    assert router._split_payload(message(SPACED, delta=None)) is None
+
+def test_dispatch_payload_handler():
+    router = EventRouter()
+    received = []
+    router.add("response.audio.delta", received.append, raw=True, payload="delta")
+    for separators in (COMPACT, SPACED):
+        asyncio.run(router.dispatch(None, message(separators, delta=DELTA)))
+    # str 沒有辦法以 memoryview 指向，照常解碼
+    asyncio.run(router.dispatch(None, message(SPACED, delta=DELTA).decode()))
+    assert [type(event["delta"]) for event in received] == [memoryview, memoryview, str]
+    assert [bytes(event["delta"]) for event in received[:2]] == [DELTA.encode()] * 2
+    assert received[2]["delta"] == DELTA
+    assert router.counts == {"response.audio.delta": 3}
+
+if __name__ == "__main__":
+    test_json_field_with_and_without_whitespace()
+    test_split_payload_returns_memoryview()
+    test_split_payload_falls_back()
+    test_dispatch_payload_handler()
+    print("ok")
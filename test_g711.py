@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import warnings
+
+import numpy as np
+
+import g711
+
+# 以 ITU-T G.711 參考實作（Sun Microsystems 的 g711.c）逐一樣本的演算法，
+# 比對 g711.py 的查表，所有 int16 的值與所有位元組都要一模一樣：
+#
+#   python -m pytest test_g711.py
+#   python test_g711.py
+
+SEG_UEND = [0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]
+SEG_AEND = [0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF]
+
+def segment(value: int, table: list[int]) -> int:
+    for i, end in enumerate(table):
+        if value <= end:
+            return i
+    return len(table)
+
+def linear2ulaw(sample: int) -> int:
+    pcm = sample >> 2  # 14 位元
+    if pcm < 0:
+        pcm = -pcm
+        mask = 0x7F
+    else:
+        mask = 0xFF
+    pcm = min(pcm, 8159) + 0x21
+    seg = segment(pcm, SEG_UEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    return ((seg << 4) | ((pcm >> (seg + 1)) & 0x0F)) ^ mask
+
+def ulaw2linear(byte: int) -> int:
+    u = ~byte & 0xFF
+    t = (((u & 0x0F) << 3) + 0x84) << ((u & 0x70) >> 4)
+    return 0x84 - t if u & 0x80 else t - 0x84
+
+def linear2alaw(sample: int) -> int:
+    pcm = sample >> 3  # 13 位元
+    if pcm >= 0:
+        mask = 0xD5
+    else:
+        mask = 0x55
+        pcm = -pcm - 1
+    seg = segment(pcm, SEG_AEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    shift = 1 if seg < 2 else seg
+    return ((seg << 4) | ((pcm >> shift) & 0x0F)) ^ mask
+
+def alaw2linear(byte: int) -> int:
+    a = byte ^ 0x55
+    t = (a & 0x0F) << 4
+    seg = (a & 0x70) >> 4
+    if seg == 0:
+        t += 8
+    elif seg == 1:
+        t += 0x108
+    else:
+        t = (t + 0x108) << (seg - 1)
+    return t if a & 0x80 else -t
+
+ALL_PCM = np.arange(-32768, 32768, dtype=np.int16)
+ALL_BYTES = bytes(range(256))
+
+# 幾個固定的值，與 audioop.lin2ulaw/lin2alaw 等的結果相同
+ENCODE_VECTORS = {
+    # pcm16: (μ-law, A-law)
+    0: (0xFF, 0xD5),
+    -1: (0x7E, 0x55),
+    1000: (0xCE, 0xFA),
+    -1000: (0x4E, 0x7A),
+    32767: (0x80, 0xAA),
+    -32768: (0x00, 0x2A),
+}
+DECODE_VECTORS = {
+    # 位元組: (μ-law, A-law)
+    0xFF: (0, 848),
+    0x7F: (0, -848),
+    0x80: (32124, 5504),
+    0x00: (-32124, -5504),
+    0xD5: (716, 8),
+    0x55: (-716, -8),
+    0xAA: (5372, 32256),
+    0x2A: (-5372, -32256),
+}
+
+def test_known_vectors():
+    pcm = np.array(list(ENCODE_VECTORS), dtype=np.int16)
+    assert g711.encode(pcm, "g711_ulaw").tolist() == [u for u, _ in ENCODE_VECTORS.values()]
+    assert g711.encode(pcm, "g711_alaw").tolist() == [a for _, a in ENCODE_VECTORS.values()]
+    data = bytes(DECODE_VECTORS)
+    assert g711.decode(data, "g711_ulaw").tolist() == [u for u, _ in DECODE_VECTORS.values()]
+    assert g711.decode(data, "g711_alaw").tolist() == [a for _, a in DECODE_VECTORS.values()]
+
+def test_encode_matches_reference():
+    for audio_format, reference in (("g711_ulaw", linear2ulaw), ("g711_alaw", linear2alaw)):
+        expected = [reference(int(sample)) for sample in ALL_PCM]
+        assert g711.encode(ALL_PCM, audio_format).tolist() == expected, audio_format
+
+def test_decode_matches_reference():
+    for audio_format, reference in (("g711_ulaw", ulaw2linear), ("g711_alaw", alaw2linear)):
+        expected = [reference(byte) for byte in ALL_BYTES]
+        assert g711.decode(ALL_BYTES, audio_format).tolist() == expected, audio_format
+        # 寫進 out 的結果相同，而且是 out 的 view
+        out = np.zeros(300, dtype=np.int16)
+        decoded = g711.decode(ALL_BYTES, audio_format, out=out)
+        assert decoded.tolist() == expected and np.shares_memory(decoded, out)
+
+def test_matches_audioop():
+    # audioop 在 Python 3.13 被移除，沒有的話就只比對上面的參考實作
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        try:
+            import audioop
+        except ImportError:
+            return
+    pcm = ALL_PCM.tobytes()
+    assert g711.encode(ALL_PCM, "g711_ulaw").tobytes() == audioop.lin2ulaw(pcm, 2)
+    assert g711.encode(ALL_PCM, "g711_alaw").tobytes() == audioop.lin2alaw(pcm, 2)
+    assert g711.decode(ALL_BYTES, "g711_ulaw").tobytes() == audioop.ulaw2lin(ALL_BYTES, 2)
+    assert g711.decode(ALL_BYTES, "g711_alaw").tobytes() == audioop.alaw2lin(ALL_BYTES, 2)
+
+def test_pcm16_passes_through():
+    pcm = np.array([1, -2, 3], dtype=np.int16)
+    assert g711.encode(pcm, "pcm16") is pcm
+    assert g711.decode(pcm.tobytes(), "pcm16").tolist() == [1, -2, 3]
+
+if __name__ == "__main__":
+    test_known_vectors()
+    test_encode_matches_reference()
+    test_decode_matches_reference()
+    test_matches_audioop()
+    test_pcm16_passes_through()
+    print("ok")
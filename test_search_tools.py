@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import time
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import search_tools
+from search_tools import SearchCache
+
+# 以假的 search 測試搜尋結果的快取，不會真的連到 Google：
+#
+#   python -m pytest test_search_tools.py
+#   python test_search_tools.py
+
+class FakeSearch:
+    # 取代 googlesearch.search，記錄被呼叫的次數；設定 gate 時會等到 gate 被設定才傳回
+    def __init__(self, gate: threading.Event | None = None):
+        self.calls = 0
+        self.gate = gate
+
+    def __call__(self, keyword, advanced, num_results, lang):
+        self.calls += 1
+        if self.gate is not None:
+            assert self.gate.wait(5)
+        return [SimpleNamespace(title=f"{keyword} {i}", description="desc")
+                for i in range(num_results)]
+
+def use_fake(fake: FakeSearch, cache: SearchCache) -> None:
+    search_tools.search = fake
+    search_tools.cache = cache
+
+def test_repeated_query_is_cached():
+    fake = FakeSearch()
+    use_fake(fake, SearchCache())
+    first = search_tools.google_res("台北 天氣", num_results=2)
+    # 大小寫與多餘的空白不影響快取
+    assert search_tools.google_res("  台北   天氣 ", num_results=2) == first
+    assert fake.calls == 1
+    assert search_tools.cache.stats()["hits"] == 1
+
+def test_ttl_expiry():
+    fake = FakeSearch()
+    use_fake(fake, SearchCache(ttl=0.05))
+    search_tools.google_res("a")
+    search_tools.google_res("a")
+    assert fake.calls == 1
+    time.sleep(0.1)
+    search_tools.google_res("a")
+    assert fake.calls == 2
+
+def test_lru_eviction_order():
+    cache = SearchCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.get_or_compute(key, lambda key=key: key)
+    # 用到 a 之後，最久沒用到的是 b
+    assert cache.get_or_compute("a", lambda: "recomputed") == "a"
+    cache.get_or_compute("c", lambda: "c")
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.evictions == 1
+    assert cache.get_or_compute("b", lambda: "b2") == "b2"
+    assert list(cache.entries) == ["c", "b"]
+
+def concurrent_queries(cache: SearchCache, gate: threading.Event, n: int) -> list[str]:
+    # 同時送出 n 個相同的查詢，等它們都在等待第一個查詢的結果後才放行
+    fake = FakeSearch(gate)
+    use_fake(fake, cache)
+    results = [None] * n
+
+    def query(i):
+        results[i] = search_tools.google_res("same")
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + 5
+    while cache.waits < n - 1:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert fake.calls == 1
+    return results
+
+def test_single_flight():
+    cache = SearchCache()
+    results = concurrent_queries(cache, threading.Event(), 4)
+    assert len(set(results)) == 1 and results[0] is not None
+    assert cache.misses == 1 and cache.waits == 3
+    assert not cache.inflight
+
+def test_locked_database_still_resolves_waiters():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "cache.db")
+        cache = SearchCache(path=path)
+        # 不等待鎖，直接得到 database is locked
+        cache.db.execute("PRAGMA busy_timeout = 0")
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        try:
+            results = concurrent_queries(cache, threading.Event(), 3)
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        assert len(set(results)) == 1 and results[0] is not None
+        # 三個查詢各讀一次、第一個查詢寫入一次，都失敗
+        assert cache.disk_errors == 4
+        assert not cache.inflight
+        # 記憶體中的快取不受影響，鎖解除後也能再寫入 sqlite
+        assert cache.stats()["entries"] == 1
+        cache.get_or_compute("other", lambda: "value")
+        assert cache.disk_errors == 4
+        cache.db.close()
+
+if __name__ == "__main__":
+    test_repeated_query_is_cached()
+    test_ttl_expiry()
+    test_lru_eviction_order()
+    test_single_flight()
+    test_locked_database_still_resolves_waiters()
+    print("ok")
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import base64
+import tempfile
+from pathlib import Path
+
+from session_recorder import CLIENT, CONNECT, MAGIC, SERVER, SessionRecorder, read_records
+
+# 以 SessionRecorder 寫入事件後用 read_records 讀回，確認內容與寫入的相同：
+#
+#   python -m pytest test_session_recorder.py
+#   python test_session_recorder.py
+
+AUDIO = base64.b64encode(bytes(range(256)) * 3).decode()
+
+SERVER_FRAMES = [
+    b'{"type":"session.created","event_id":"event_1","session":{"id":"sess_1"}}',
+    # 伺服端送來的 JSON 有沒有空白都要原樣還原
+    ('{"type":"response.audio.delta","response_id":"resp_1","delta":"' + AUDIO + '"}').encode(),
+    ('{"type": "response.audio.delta", "delta": "' + AUDIO + '", "item_id": "item_1"}').encode(),
+    b'{"type":"response.done","response":{"id":"resp_1","status":"completed"}}',
+]
+
+def record(path: str) -> SessionRecorder:
+    recorder = SessionRecorder(path)
+    conn = recorder.connect(model="gpt-4o-realtime-preview", extra_query=None)
+    recorder.client_event(conn, {"type": "input_audio_buffer.append", "audio": AUDIO})
+    recorder.client_event(conn, {"type": "response.create", "response": {"instructions": "嗨"}})
+    for frame in SERVER_FRAMES:
+        recorder.server_event(conn, frame)
+    recorder.close()
+    return recorder
+
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "session.rec")
+        recorder = record(path)
+        records = list(read_records(path))
+        assert recorder.records == len(records) == 7 and recorder.errors == 0
+        assert [r.direction for r in records] == [CONNECT, CLIENT, CLIENT] + [SERVER] * 4
+        assert {r.conn for r in records} == {1}
+        assert all(a.t <= b.t for a, b in zip(records, records[1:]))
+        assert records[0].event() == {"model": "gpt-4o-realtime-preview", "extra_query": None}
+        assert records[1].event() == {"type": "input_audio_buffer.append", "audio": AUDIO}
+        assert records[2].event()["response"] == {"instructions": "嗨"}
+        assert [r.data for r in records[3:]] == SERVER_FRAMES
+        # 音訊以原始位元組存放，檔案比 JSON 小
+        size = len(MAGIC) + sum(r.size for r in records)
+        assert size == recorder.bytes_written == Path(path).stat().st_size
+        assert recorder.bytes_written < recorder.json_bytes
+
+def test_truncated_file_stops_at_last_complete_record():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "session.rec"
+        record(str(path))
+        data = path.read_bytes()
+        path.write_bytes(data[:-10])
+        records = list(read_records(str(path)))
+        assert len(records) == 6 and records[-1].data == SERVER_FRAMES[-2]
+
+def test_unencodable_event_is_skipped():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "session.rec")
+        recorder = SessionRecorder(path)
+        recorder.client_event(1, 42)
+        recorder.client_event(1, {"type": "response.cancel"})
+        recorder.close()
+        assert recorder.errors == 1
+        assert [r.event() for r in read_records(path)] == [{"type": "response.cancel"}]
+
+def test_rejects_other_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "other.rec"
+        path.write_bytes(b'{"type":"session.created"}')
+        try:
+            list(read_records(str(path)))
+        except ValueError:
+            return
+        raise AssertionError("read_records should reject files without MAGIC")
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_truncated_file_stops_at_last_complete_record()
+    test_unencodable_event_is_skipped()
+    test_rejects_other_files()
+    print("ok")
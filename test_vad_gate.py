@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import numpy as np
+
+from vad_gate import VadGate
+
+# 以合成的 20ms 音訊塊測試 VadGate 的 attack、hangover 與 preroll，不需要麥克風：
+#
+#   python -m pytest test_vad_gate.py
+#   python test_vad_gate.py
+
+FRAME = 480  # 24kHz 的 20ms
+
+def speech(k: int = 0) -> bytes:
+    # 200Hz 的正弦波，約 -15dBFS，過零率很低；k 讓每一塊的內容都不同
+    t = np.arange(FRAME)
+    return (np.sin(2 * np.pi * 200 * t / 24000) * (8000 + k)).astype(np.int16).tobytes()
+
+def silence(k: int = 0) -> bytes:
+    # 很小的定值，遠低於 -45dBFS
+    return np.full(FRAME, k % 10, dtype=np.int16).tobytes()
+
+def feed(gate: VadGate, frames: list[bytes]) -> tuple[list[bytes], list[bool]]:
+    sent, ended = [], []
+    for frame in frames:
+        out, end = gate.process(frame)
+        sent.extend(out)
+        ended.append(end)
+    return sent, ended
+
+def test_attack_ignores_short_clicks():
+    gate = VadGate(attack_ms=40)
+    assert gate.is_speech(speech()) and not gate.is_speech(silence(3))
+    # 只有一塊像講話的聲音不會開始送出
+    sent, _ = feed(gate, [silence(1), speech(1), silence(2), speech(2), silence(3)])
+    assert sent == [] and not gate.active and gate.segments == 0
+    # 連續兩塊就開始講話
+    sent, _ = feed(gate, [speech(3), speech(4)])
+    assert gate.active and gate.segments == 1
+    assert sent[-2:] == [speech(3), speech(4)]
+
+def test_preroll_is_sent_in_order():
+    gate = VadGate(attack_ms=40, preroll_ms=100)
+    lead = [silence(k) for k in range(8)]
+    sent, _ = feed(gate, lead + [speech(1), speech(2)])
+    # 講話前 100ms（5 塊，包含觸發的兩塊）依照原本的順序補送
+    assert sent == lead[-3:] + [speech(1), speech(2)]
+    assert len(gate.preroll) == 0
+
+def test_hangover_keeps_pauses_and_ends_segment():
+    gate = VadGate(attack_ms=20, hangover_ms=100, preroll_ms=20)
+    feed(gate, [speech(0)])
+    assert gate.active
+    # 句子中間短暫的停頓照樣送出，不會切斷
+    sent, ended = feed(gate, [silence(k) for k in range(4)] + [speech(1)])
+    assert len(sent) == 5 and not any(ended) and gate.active
+    # 講話後連續 100ms 的靜音才結束，最後一塊靜音也會送出
+    pause = [silence(k) for k in range(6)]
+    sent, ended = feed(gate, pause)
+    assert sent == pause[:5]
+    assert ended == [False] * 4 + [True, False]
+    assert not gate.active and gate.segments == 1
+
+def test_reset_and_suppressed():
+    gate = VadGate(attack_ms=20, hangover_ms=20, preroll_ms=20)
+    feed(gate, [silence(1), silence(2), speech(0)])
+    assert gate.active
+    gate.reset()
+    assert not gate.active and len(gate.preroll) == 0
+    feed(gate, [silence(3)])
+    # 4 塊中只送出 1 塊
+    assert gate.suppressed() == 0.75
+    assert gate.stats().startswith("vad: 1 segments")
+
+if __name__ == "__main__":
+    test_attack_ignores_short_clicks()
+    test_preroll_is_sent_in_order()
+    test_hangover_keeps_pauses_and_ends_segment()
+    test_reset_and_suppressed()
+    print("ok")
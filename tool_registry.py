@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import json
+import time
+import asyncio
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from pydantic import BaseModel, ValidationError
+
+# 登記可以讓模型叫用的工具函式，並在執行緒池中執行，不會卡住 asyncio 的
+# 事件迴圈（搜尋等待網路回應時還能繼續接收、播放語音）。參數規格沿用
+# search_tools.GoogleRes 這種 pydantic 類別，同時用來產生 tools 設定與驗證參數
+#
+#   registry = ToolRegistry()
+#   registry.register(google_res, GoogleRes, "取得 Google 搜尋結果")
+#   await connection.session.update(session={"tools": registry.tools})
+#   ...
+#   await registry.run_calls(connection, event.response)
+#   registry.start_calls(connection, event.response)  # 或是在背景執行
+#   ...
+#   registry.reset()  # 重新連線時
+#   registry.close()  # 程式結束時
+#
+# 如果在收到 response.output_item.added、response.function_call_arguments.delta
+# 與 .done 事件時分別呼叫 item_added()、arguments_delta()、arguments_done()，
+# 就可以在參數送完時立刻開始執行，不必等到 response.done；speculative 為 True
+# 時甚至在累積的參數已經是完整的 JSON 時就先開始執行
+class Tool:
+    def __init__(self, func: Callable[..., Any], params: type[BaseModel],
+                 description: str, name: str, timeout: float):
+        self.func = func
+        self.params = params
+        self.description = description
+        self.name = name
+        self.timeout = timeout
+
+    def schema(self) -> dict:
+        return {
+            "type": "function",
+            # 注意 Realtime API 的這裡少一層 "function"
+            # 這是和 ChatCompletion 不一樣的地方
+            "name": self.name,
+            "description": self.description,
+            "parameters": self.params.model_json_schema(),
+        }
+
+class PendingCall:
+    """提早開始執行的函式叫用"""
+
+    def __init__(self, name: str, arguments: str, task: asyncio.Task):
+        self.name = name
+        self.arguments = arguments
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.finished = time.perf_counter()
+
+class ToolRegistry:
+    def __init__(self, max_workers: int = 4, timeout: float = 30.0,
+                 executor: Executor | None = None, speculative: bool = False):
+        # 也可以傳入 ProcessPoolExecutor，此時工具函式必須可以被 pickle
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+        self.timeout = timeout
+        self.speculative = speculative
+        self.entries: dict[str, Tool] = {}
+        self.names: dict[str, str] = {}      # call_id 對應的函式名稱
+        self.partial: dict[str, str] = {}    # call_id 目前累積的參數
+        self.pending: dict[str, PendingCall] = {}
+        # start_calls() 在背景執行的工作，事件迴圈只保留工作的弱參照，
+        # 要自己留著，否則執行到一半可能被回收
+        self.tasks: set[asyncio.Task] = set()
+        self.early_calls = 0   # 提早開始執行的次數
+        self.saved_s = 0.0     # 提早執行省下的總時間
+
+    def register(self, func: Callable[..., Any], params: type[BaseModel],
+                 description: str, name: str | None = None,
+                 timeout: float | None = None) -> None:
+        name = name or func.__name__
+        self.entries[name] = Tool(func, params, description, name,
+                                  timeout or self.timeout)
+
+    @property
+    def tools(self) -> list[dict]:
+        # 可以直接當成 session.update 的 tools 參數
+        return [tool.schema() for tool in self.entries.values()]
+
+    async def call(self, name: str, arguments: str) -> str:
+        # 執行工具並把結果轉成字串，發生錯誤時把錯誤訊息當成結果傳給模型
+        tool = self.entries.get(name)
+        if tool is None:
+            return f"錯誤：沒有名為 {name} 的工具"
+        try:
+            kwargs = tool.params.model_validate_json(arguments or "{}").model_dump()
+        except ValidationError as e:
+            return f"錯誤：{name} 的參數不正確：{e}"
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(tool.func, **kwargs))
+        try:
+            # 逾時只會放棄等待，已經在執行緒中執行的函式沒辦法中斷
+            result = await asyncio.wait_for(future, tool.timeout)
+        except asyncio.TimeoutError:
+            return f"錯誤：{name} 執行超過 {tool.timeout} 秒"
+        except Exception as e:
+            return f"錯誤：{name} 執行失敗：{e}"
+        return result if isinstance(result, str) else str(result)
+
+    def item_added(self, item) -> None:
+        # response.output_item.added，只有這裡才有函式名稱
+        if item.type == "function_call":
+            self.names[item.call_id] = item.name
+            self.partial[item.call_id] = ""
+
+    def arguments_delta(self, call_id: str, delta: str) -> None:
+        # response.function_call_arguments.delta
+        if not self.speculative or call_id in self.pending or call_id not in self.names:
+            return
+        arguments = self.partial.get(call_id, "") + delta
+        self.partial[call_id] = arguments
+        if not arguments.rstrip().endswith("}"):
+            return
+        try:
+            json.loads(arguments)
+        except ValueError:
+            return
+        self.start(call_id, self.names[call_id], arguments)
+
+    def arguments_done(self, call_id: str, arguments: str) -> None:
+        # response.function_call_arguments.done
+        self.partial.pop(call_id, None)
+        pending = self.pending.get(call_id)
+        if pending is not None:
+            if pending.arguments == arguments:
+                return
+            # 先前猜測的參數不對，放棄原本的結果重新執行
+            pending.task.cancel()
+        if call_id in self.names:
+            self.start(call_id, self.names[call_id], arguments)
+
+    def discard(self, call_ids) -> None:
+        # 不會再有 response.done 的函式叫用，丟掉記錄並取消提早開始的執行
+        for call_id in call_ids:
+            self.names.pop(call_id, None)
+            self.partial.pop(call_id, None)
+            pending = self.pending.pop(call_id, None)
+            if pending is not None:
+                pending.task.cancel()
+
+    def reset(self) -> None:
+        # 重新連線時呼叫，舊連線上的函式叫用都不會完成了
+        self.discard(list(self.names.keys() | self.pending.keys()))
+
+    def start(self, call_id: str, name: str, arguments: str) -> None:
+        task = asyncio.create_task(self.call(name, arguments))
+        self.pending[call_id] = PendingCall(name, arguments, task)
+
+    async def run_call(self, connection, item) -> None:
+        response_done = time.perf_counter()
+        self.names.pop(item.call_id, None)
+        pending = self.pending.pop(item.call_id, None)
+        print(f'\tcall {item.name}(**{item.arguments})')
+        if pending is None or pending.arguments != item.arguments:
+            output = await self.call(item.name, item.arguments)
+            print(f'\t{item.name} done in {time.perf_counter() - response_done:.2f}s')
+        else:
+            output = await pending.task
+            # 在 response.done 之前就已經執行的時間
+            saved = min(pending.finished or response_done, response_done) - pending.started
+            self.early_calls += 1
+            self.saved_s += saved
+            print(f'\t{item.name} done in {pending.finished - pending.started:.2f}s, '
+                  f'started {saved * 1000:.0f}ms before response.done')
+        # 將函式叫用結果傳回伺服端
+        await connection.conversation.item.create(
+            item={
+                "type": "function_call_output",
+                "call_id": item.call_id,
+                "output": output,
+            }
+        )
+
+    async def run_calls(self, connection, response) -> bool:
+        # 同時執行回應中所有的函式叫用，各自完成後就送回結果，
+        # 全部完成後才請伺服端重新生成回應，沒有函式叫用就傳回 False
+        if response.status != "completed":
+            # 被取消（例如使用者插話）或沒有完成的回應中，函式叫用的參數可能不完整，
+            # 也不應該再要求新的回應
+            print(f'\tskip function calls in {response.status} response')
+            self.discard(item.call_id for item in response.output
+                         if item.type == "function_call")
+            return False
+        calls = [item for item in response.output if item.type == "function_call"]
+        if not calls:
+            return False
+        await asyncio.gather(*(self.run_call(connection, item) for item in calls))
+        # 請伺服端重新生成回應
+        await connection.response.create()
+        return True
+
+    def start_calls(self, connection, response) -> asyncio.Task:
+        # 在背景執行 run_calls()，不會卡住接收與播放語音
+        task = asyncio.create_task(self.run_calls(connection, response))
+        self.tasks.add(task)
+        task.add_done_callback(self._calls_done)
+        return task
+
+    def _calls_done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            # 例如送回結果時連線已經斷了
+            print(f"\tfunction calls failed: {exc!r}")
+
+    def close(self) -> None:
+        # 程式結束時呼叫：取消還在執行的工作與還沒開始的函式，不等待執行中的
+        # 執行緒（逾時的函式可能還卡在網路上）
+        for task in self.tasks:
+            task.cancel()
+        for pending in self.pending.values():
+            pending.task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import os
+from collections import deque
+
+import numpy as np
+
+from resample import SAMPLE_RATE
+
+# 設定 CLIENT_VAD=1 環境變數就會在本機先判斷有沒有人在講話，只把講話的部分送出
+CLIENT_VAD = os.environ.get("CLIENT_VAD") == "1"
+# 回覆的語音還在播放時暫停判斷，以免喇叭的聲音被麥克風收到而當成使用者講話；
+# 戴耳機時沒有回音，可以設定 CLIENT_VAD_DUCK=0 讓使用者隨時插話
+CLIENT_VAD_DUCK = os.environ.get("CLIENT_VAD_DUCK", "1") != "0"
+
+# 在送出麥克風音訊之前，以每一塊音訊的能量與過零率判斷是不是有人在講話，
+# 只把講話的部分（加上前後的緩衝）送給伺服端，長時間的靜音就不必上傳
+#
+#   gate = VadGate()
+#   frames, ended = gate.process(data)
+#   for frame in frames:
+#       audio_sender.feed(frame)
+#   if ended:
+#       ...  # 講完話了，關閉伺服端 VAD 時可以在這裡 commit
+#
+# 判斷為講話時會先補送 preroll_ms 之前的音訊，避免切掉第一個字；
+# 最後一塊講話的音訊之後還會繼續送 hangover_ms，避免把句子中間的停頓切斷
+class VadGate:
+    def __init__(self, threshold_db: float = -45.0, noise_margin_db: float = 10.0,
+                 zcr_max: float = 0.4, attack_ms: float = 40, hangover_ms: float = 400,
+                 preroll_ms: float = 300, frame_ms: float = 20):
+        self.threshold_db = threshold_db        # 低於這個音量（dBFS）一律視為靜音
+        self.noise_margin_db = noise_margin_db  # 要比背景雜音大多少才算是講話
+        self.zcr_max = zcr_max                  # 過零率太高又不夠大聲的視為雜音
+        self.attack_frames = max(1, round(attack_ms / frame_ms))
+        self.hangover_frames = max(1, round(hangover_ms / frame_ms))
+        self.preroll: deque[bytes] = deque(maxlen=max(1, round(preroll_ms / frame_ms)))
+        self.noise_db = threshold_db  # 背景雜音音量的估計值
+        self.active = False
+        self.voiced_run = 0   # 連續判斷為講話的塊數
+        self.silent_run = 0   # 講話後連續靜音的塊數
+
+        self.frames_in = 0
+        self.frames_sent = 0
+        self.samples_in = 0
+        self.samples_sent = 0
+        self.segments = 0     # 偵測到的講話段數
+
+    def is_speech(self, data: bytes) -> bool:
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if len(samples) == 0:
+            return False
+        rms = np.sqrt(np.mean(samples * samples)) / 32768
+        level_db = 20 * np.log10(max(rms, 1e-9))
+        # 正負號改變的比例，嘶嘶的雜音很高，有聲的語音較低
+        zcr = np.count_nonzero(np.signbit(samples[1:]) != np.signbit(samples[:-1])) / len(samples)
+        threshold = max(self.threshold_db, self.noise_db + self.noise_margin_db)
+        speech = level_db > threshold and (
+            zcr < self.zcr_max or level_db > threshold + self.noise_margin_db)
+        if not speech:
+            # 只以判斷為靜音的音訊慢慢更新背景雜音的估計值
+            self.noise_db += 0.05 * (level_db - self.noise_db)
+        return speech
+
+    def process(self, data: bytes) -> tuple[list[bytes], bool]:
+        """傳回要送出的音訊塊，以及這一塊是不是剛好講完話"""
+        self.frames_in += 1
+        self.samples_in += len(data) // 2
+        speech = self.is_speech(data)
+        out: list[bytes] = []
+        ended = False
+        if not self.active:
+            self.voiced_run = self.voiced_run + 1 if speech else 0
+            self.preroll.append(data)
+            if self.voiced_run >= self.attack_frames:
+                # 開始講話，連同前面緩衝的音訊一起送出
+                self.active = True
+                self.silent_run = 0
+                self.segments += 1
+                out.extend(self.preroll)
+                self.preroll.clear()
+        else:
+            out.append(data)
+            self.silent_run = 0 if speech else self.silent_run + 1
+            if self.silent_run >= self.hangover_frames:
+                self.active = False
+                self.voiced_run = 0
+                ended = True
+        self.frames_sent += len(out)
+        self.samples_sent += sum(len(frame) for frame in out) // 2
+        return out, ended
+
+    def reset(self) -> None:
+        # 例如手動 commit 之後，下一塊音訊重新開始判斷
+        self.active = False
+        self.voiced_run = 0
+        self.silent_run = 0
+        self.preroll.clear()
+
+    def suppressed(self) -> float:
+        # 沒有送出的音訊比例
+        if self.samples_in == 0:
+            return 0.0
+        return 1 - self.samples_sent / self.samples_in
+
+    def stats(self) -> str:
+        return (f"vad: {self.segments} segments, "
+                f"{self.samples_sent / SAMPLE_RATE:.1f}s of "
+                f"{self.samples_in / SAMPLE_RATE:.1f}s sent, "
+                f"{self.suppressed() * 100:.1f}% suppressed")